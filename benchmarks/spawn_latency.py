@@ -0,0 +1,66 @@
+# Copyright (c) Shopkick 2017
+# See LICENSE for details.
+"""
+Measure process spawn latency against the size of the parent process.
+
+Run with seashore installed:
+
+    $ python benchmarks/spawn_latency.py --rss-mb 0 512 2048
+
+Prints one JSON object per (parent size, launcher) pair.
+"""
+from __future__ import print_function
+
+import argparse
+import json
+import resource
+import sys
+import time
+
+from seashore import launch, shell
+
+_PAGE = 4096
+
+def _grow(megabytes):
+    """allocate and touch memory, so it is really resident"""
+    ballast = bytearray(megabytes * 1024 * 1024)
+    for offset in range(0, len(ballast), _PAGE):
+        ballast[offset] = 1
+    return ballast
+
+def _max_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+def _measure(launcher, command, repeat):
+    sh = shell.Shell(launcher=launcher)
+    timings = []
+    for _ in range(repeat):
+        start = time.time()
+        sh.batch(command)
+        timings.append(time.time() - start)
+    timings.sort()
+    return dict(min=timings[0], median=timings[len(timings) // 2],
+                mean=sum(timings) / len(timings))
+
+def main(argv=None):
+    """run the benchmark"""
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rss-mb', type=int, nargs='+', default=[0, 256, 1024])
+    parser.add_argument('--repeat', type=int, default=50)
+    parser.add_argument('--command', nargs='+', default=['true'])
+    args = parser.parse_args(argv)
+    ballast = []
+    grown = 0
+    for size in sorted(args.rss_mb):
+        ballast.append(_grow(size - grown))
+        grown = size
+        for name, launcher in (('popen', launch.PopenLauncher()),
+                               ('posix_spawn', launch.SpawnLauncher())):
+            result = _measure(launcher, args.command, args.repeat)
+            result.update(benchmark='spawn_latency', launcher=name, ballast_mb=size,
+                          max_rss_mb=_max_rss_mb(), paths=dict(launcher.counts))
+            print(json.dumps(result, sort_keys=True))
+            sys.stdout.flush()
+
+if __name__ == '__main__':
+    main()
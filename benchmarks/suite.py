@@ -0,0 +1,200 @@
+# Copyright (c) Shopkick 2017
+# See LICENSE for details.
+"""
+Benchmark seashore's command construction and process execution paths.
+
+Run with seashore installed:
+
+    $ python benchmarks/suite.py > before.json
+    $ git checkout my-branch
+    $ python benchmarks/suite.py > after.json
+    $ python benchmarks/suite.py --compare before.json after.json
+
+Prints one JSON object per benchmark, with timings in seconds per call,
+and the commit and Python version it ran on.
+"""
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+from seashore import executor, launch, shell
+
+clock = getattr(time, 'perf_counter', time.time)
+
+BENCHMARKS = []
+
+def benchmark(repeat):
+    """register a benchmark, with a default number of timed calls"""
+    def _register(func):
+        BENCHMARKS.append((func.__name__, repeat, func))
+        return func
+    return _register
+
+def _options(count):
+    options = {}
+    values = (executor.NO_VALUE, 'value', 42, ['a', 'b'], dict(key='value'),
+              executor.Eq('equal'))
+    for index in range(count):
+        options['option_{}'.format(index)] = values[index % len(values)]
+    return options
+
+@benchmark(repeat=2000)
+def cmd_many_options(args):
+    """cmd() with many options, of every kind"""
+    options = _options(args.options)
+    def _run():
+        executor.cmd('docker', 'run', 'image:tag', 'true', **options)
+    return _run
+
+@benchmark(repeat=2000)
+def attribute_chain(args):
+    """preparing a command through Executor attributes"""
+    xctr = executor.Executor(shell.Shell())
+    def _run():
+        xctr.git.remote('add', 'origin', 'https://example.com/repo.git',
+                        fetch=executor.NO_VALUE)
+    return _run
+
+@benchmark(repeat=2000)
+def template_call(args):
+    """preparing a command from a template"""
+    xctr = executor.Executor(shell.Shell())
+    template = xctr.template('docker', 'run', **_options(args.options))
+    def _run():
+        template('image:tag', 'true')
+    return _run
+
+@benchmark(repeat=2000)
+def clone_large_env(args):
+    """Shell.clone with a large environment"""
+    sh = shell.Shell()
+    for index in range(args.env_size):
+        sh.setenv('SEASHORE_BENCHMARK_{}'.format(index), 'x' * 64)
+    sh.clone().environ()
+    def _run():
+        sh.clone()
+    return _run
+
+@benchmark(repeat=200)
+def batch_true(args):
+    """batch of a process with no output"""
+    sh = shell.Shell()
+    def _run():
+        sh.batch(['true'])
+    return _run
+
+@benchmark(repeat=200)
+def batch_true_spawn(args):
+    """batch of a process with no output, started with posix_spawn"""
+    sh = shell.Shell(launcher=launch.SpawnLauncher())
+    def _run():
+        sh.batch(['true'])
+    return _run
+
+@benchmark(repeat=200)
+def batch_true_forkserver(args):
+    """batch of a process with no output, started by a fork server"""
+    from seashore import forkserver
+    launcher = forkserver.ForkserverLauncher()
+    sh = shell.Shell(launcher=launcher)
+    sh.batch(['true']) # Start the helper outside of the timings
+    def _run():
+        sh.batch(['true'])
+    _run.teardown = launcher.close
+    return _run
+
+@benchmark(repeat=5)
+def batch_large_output(args):
+    """batch of a process with a large output"""
+    sh = shell.Shell()
+    command = ['head', '-c', str(args.large_mb * 1024 * 1024), '/dev/zero']
+    def _run():
+        sh.batch(command)
+    return _run
+
+@benchmark(repeat=5)
+def reap_all_children(args):
+    """reap_all with many children, which all exit on SIGINT"""
+    sh = shell.Shell()
+    def _setup():
+        del sh._procs[:]
+        for _ in range(args.children):
+            sh.popen(['sleep', '1000'])
+    def _run():
+        sh.reap_all()
+    _run.setup = _setup
+    return _run
+
+def _measure(func, repeat):
+    setup = getattr(func, 'setup', None)
+    timings = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = clock()
+        func()
+        timings.append(clock() - start)
+    teardown = getattr(func, 'teardown', None)
+    if teardown is not None:
+        teardown()
+    timings.sort()
+    mean = sum(timings) / len(timings)
+    return dict(min=timings[0], median=timings[len(timings) // 2], mean=mean,
+                max=timings[-1], repeat=repeat)
+
+def _commit():
+    try:
+        output = subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+                                         cwd=os.path.dirname(os.path.abspath(__file__)),
+                                         stderr=subprocess.STDOUT)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return output.decode('ascii').strip()
+
+def _load(path):
+    with open(path) as fp:
+        return dict((result['benchmark'], result) for result in map(json.loads, fp))
+
+def compare(before_path, after_path):
+    """print the change in median time of each benchmark"""
+    before, after = _load(before_path), _load(after_path)
+    for name in sorted(set(before) & set(after)):
+        ratio = after[name]['median'] / before[name]['median']
+        print('{:24} {:12.6f} {:12.6f} {:8.2f}x'.format(name, before[name]['median'],
+                                                        after[name]['median'], ratio))
+
+def main(argv=None):
+    """run the benchmarks"""
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--compare', nargs=2, metavar=('BEFORE', 'AFTER'))
+    parser.add_argument('--only', nargs='+', help='names of benchmarks to run')
+    parser.add_argument('--repeat-factor', type=float, default=1.0)
+    parser.add_argument('--options', type=int, default=60)
+    parser.add_argument('--env-size', type=int, default=10000)
+    parser.add_argument('--large-mb', type=int, default=100)
+    parser.add_argument('--children', type=int, default=100)
+    parser.add_argument('--ballast-mb', type=int, default=0,
+                        help='memory to hold while benchmarking, as a large parent would')
+    args = parser.parse_args(argv)
+    if args.compare:
+        compare(*args.compare)
+        return
+    ballast = bytearray(b'x' * (args.ballast_mb * 1024 * 1024)) # pylint: disable=unused-variable
+    context = dict(commit=_commit(), python=platform.python_version(),
+                   implementation=platform.python_implementation())
+    for name, repeat, make in BENCHMARKS:
+        if args.only and name not in args.only:
+            continue
+        result = _measure(make(args), max(1, int(repeat * args.repeat_factor)))
+        result.update(context, benchmark=name)
+        print(json.dumps(result, sort_keys=True))
+        sys.stdout.flush()
+
+if __name__ == '__main__':
+    main()
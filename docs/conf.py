@@ -2,12 +2,19 @@
 # See LICENSE for details.
 import os
 import sys
+import types
 
 up = os.path.dirname(os.path.dirname(__file__))
 sys.path.append(up)
 
 import seashore
 
+# seashore.asyncshell uses async/await, which Python 2 cannot parse
+if sys.version_info < (3, 5):
+    sys.modules['seashore.asyncshell'] = types.ModuleType(
+        'seashore.asyncshell',
+        'Running subprocesses from an asyncio event loop (requires Python 3.5 or later).')
+
 extensions = [
     'sphinx.ext.autodoc',
     'sphinx.ext.viewcode',
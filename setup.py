@@ -19,6 +19,8 @@ setuptools.setup(
         'incremental',
         'attrs',
         'singledispatch',
+        'selectors34; python_version<"3.4"',
+        'backports.functools_lru_cache; python_version<"3"',
     ],
     package_dir={"": "src"},
     packages=setuptools.find_packages('src'),
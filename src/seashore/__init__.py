@@ -6,8 +6,18 @@ Seashore
 
 Seashore is a collection of shell abstractions.
 """
+import importlib
+import sys
+
 from seashore.executor import Executor, NO_VALUE, Eq
-from seashore.shell import Shell, ProcessError
+from seashore.shell import (Shell, ProcessError, PipelineError, OutputTooLarge,
+                            ProcessTimeoutError)
 from seashore._version import __version__
 
-__all__ = ['Executor', 'NO_VALUE', 'Eq', 'Shell', 'ProcessError', '__version__']
+__all__ = ['Executor', 'NO_VALUE', 'Eq', 'Shell', 'ProcessError', 'PipelineError',
+           'OutputTooLarge', 'ProcessTimeoutError', '__version__']
+
+if sys.version_info >= (3, 5):
+    # Python 2 cannot parse it
+    AsyncShell = importlib.import_module('seashore.asyncshell').AsyncShell # pylint: disable=invalid-name
+    __all__.append('AsyncShell')
@@ -0,0 +1,564 @@
+# Copyright (c) Shopkick 2017
+# See LICENSE for details.
+"""
+Async Shell
+-----------
+
+Running subprocesses from an :code:`asyncio` event loop.
+
+Requires Python 3.5 or later.
+"""
+import asyncio
+import collections
+import signal
+import subprocess
+import threading
+
+import attr
+
+from seashore import capture, coprocess, fanout, instrument, reap, tree
+from seashore.shell import (Shell, ProcessError, ProcessTimeoutError, OutputTooLarge,
+                            _deadline, _output_size)
+
+async def _drain(stream, sink):
+    while True:
+        data = await stream.read(capture.CHUNK_SIZE)
+        if not data:
+            break
+        sink.write(data)
+
+async def _collect(streams, spill_threshold, max_output=None, policy='raise', deadline=None):
+    sinks = dict((name, capture.make_sink(name, spill_threshold, max_output, policy))
+                 for name in streams)
+    drains = [asyncio.ensure_future(_drain(stream, sinks[name]))
+              for name, stream in streams.items()]
+    timeout = None if deadline is None else max(deadline - capture.clock(), 0)
+    try:
+        try:
+            await asyncio.wait_for(asyncio.gather(*drains), timeout)
+        except asyncio.TimeoutError as exc:
+            for drain in drains:
+                drain.cancel()
+            raise capture.DeadlineExceeded(dict((name, sink.getvalue())
+                                                for name, sink in sinks.items())) from exc
+        except capture.OutputLimitExceeded as exc:
+            for drain in drains:
+                drain.cancel()
+            exc.contents.update((name, sink.getvalue()) for name, sink in sinks.items())
+            raise
+        return dict((name, sink.getvalue()) for name, sink in sinks.items())
+    finally:
+        for sink in sinks.values():
+            sink.close()
+
+async def _reap(proc, grace_periods):
+    try:
+        if proc.returncode is not None:
+            return 'exited'
+        for (name, signum), grace in zip(reap.SIGNALS, tuple(grace_periods) + (None,)):
+            try:
+                reap.signal_tree(proc, signum)
+            except ProcessLookupError: # pragma: no cover
+                pass
+            try:
+                await asyncio.wait_for(proc.wait(), grace)
+            except asyncio.TimeoutError:
+                continue
+            return name
+    finally:
+        reap.kill_leftovers([proc])
+
+async def retry_async(policy, run, kwargs):
+    """
+    Run a command, retrying it as a policy says, without blocking the event loop.
+
+    :param policy: a :code:`retry.RetryPolicy`
+    :param run: function running the command once, with keyword arguments,
+                and returning an awaitable
+    :param kwargs: keyword arguments for :code:`run`
+    :returns: whatever :code:`run`'s awaitable returns
+    :raises: the :code:`ProcessError` of the last attempt
+    """
+    started = capture.clock()
+    attempt = 1
+    while True:
+        try:
+            return await run(**policy.attempt_kwargs(kwargs, capture.clock() - started))
+        except ProcessError as exc:
+            delay = policy.backoff(attempt, exc, capture.clock() - started)
+            if delay is None:
+                raise
+        await asyncio.sleep(delay)
+        attempt += 1
+
+@attr.s
+class AsyncShell(Shell):
+
+    """
+    Run subprocesses without blocking the event loop.
+
+    Has the same interface as :code:`Shell`, except that
+    :code:`batch`, :code:`interactive`, :code:`redirect`, :code:`popen`
+    and :code:`reap_all` are coroutines, and :code:`stream`, :code:`parse`
+    and :code:`pipeline` are not supported: they raise :code:`TypeError`.
+    """
+
+    # Coroutines in place of the blocking methods are the point of this class
+    # pylint: disable=invalid-overridden-method
+
+    async def redirect(self, command, outfp, errfp, cwd=None, timeout=None): # pylint: disable=too-many-arguments
+        """
+        Run a process, while its standard error and output go to pre-existing files
+
+        :param command: list of arguments
+        :param outfp: output file object
+        :param errfp: error file object
+        :param cwd: current working directory (default is to use the internal working directory)
+        :param timeout: seconds after which to stop the process (default is to wait forever)
+        :raises: :code:`ProcessError` with return code,
+                 :code:`ProcessTimeoutError` if the process was stopped
+        """
+        deadline = _deadline(timeout)
+        proc = await self.popen(command, stdin=subprocess.PIPE, stdout=outfp, stderr=errfp,
+                                cwd=cwd)
+        proc.stdin.close()
+        timed_out = await self._timed_out(proc, deadline)
+        record = await self._finish(proc)
+        if timed_out:
+            raise ProcessTimeoutError(record.returncode, timeout=timeout, record=record)
+        if record.returncode != 0:
+            raise ProcessError(record.returncode, record=record)
+
+    async def batch(self, command, cwd=None, spill_threshold=None, max_output=None, # pylint: disable=too-many-arguments
+                    output_policy='raise', timeout=None):
+        """
+        Run a process, wait until it ends and return the output and error
+
+        :param command: list of arguments
+        :param cwd: current working directory (default is to use the internal working directory)
+        :param spill_threshold: bytes per stream to keep in memory (default is the shell's)
+        :param max_output: bytes of output allowed per stream (default is no limit)
+        :param output_policy: :code:`'raise'`, :code:`'truncate'` or :code:`'spill'`
+                              (see :code:`Shell.batch`)
+        :param timeout: seconds after which to stop the process (default is to wait forever)
+        :returns: pair of standard output, standard error
+        :raises: :code:`ProcessError` with (return code, standard output, standard error),
+                 :code:`ProcessTimeoutError` (with the output read until then)
+                 if the process was stopped
+        """
+        if spill_threshold is None:
+            spill_threshold = self._spill_threshold
+        if output_policy not in capture.POLICIES:
+            raise ValueError('unknown output policy', output_policy)
+        deadline = _deadline(timeout)
+        proc = await self.popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE, cwd=cwd)
+        proc.stdin.close()
+        try:
+            try:
+                contents = await _collect(dict(stdout=proc.stdout, stderr=proc.stderr),
+                                          spill_threshold, max_output, output_policy, deadline)
+            except capture.OutputLimitExceeded as exc:
+                reap.signal_tree(proc, signal.SIGKILL)
+                record = await self._finish(proc)
+                raise OutputTooLarge(record.returncode, exc.contents['stdout'],
+                                     exc.contents['stderr'], stream=exc.name,
+                                     limit=max_output, record=record) from exc
+            except capture.DeadlineExceeded as exc:
+                await _reap(proc, self._grace_periods)
+                record = await self._finish(proc)
+                raise ProcessTimeoutError(record.returncode, exc.contents['stdout'],
+                                          exc.contents['stderr'], timeout=timeout,
+                                          record=record) from exc
+            stdout_contents, stderr_contents = contents['stdout'], contents['stderr']
+            timed_out = await self._timed_out(proc, deadline)
+            record = await self._finish(proc, stdout_bytes=_output_size(stdout_contents),
+                                        stderr_bytes=_output_size(stderr_contents))
+            if timed_out:
+                raise ProcessTimeoutError(record.returncode, stdout_contents, stderr_contents,
+                                          timeout=timeout, record=record)
+        except asyncio.CancelledError:
+            await _reap(proc, self._grace_periods)
+            raise
+        finally:
+            if proc in self._procs:
+                self._procs.remove(proc)
+        if record.returncode != 0:
+            raise ProcessError(record.returncode, stdout_contents, stderr_contents,
+                               record=record)
+        return stdout_contents, stderr_contents
+
+    async def interactive(self, command, cwd=None, timeout=None):
+        """
+        Run a process, while its standard output and error go directly to ours.
+
+        :param command: list of arguments
+        :param cwd: current working directory (default is to use the internal working directory)
+        :param timeout: seconds after which to stop the process (default is to wait forever)
+        :raises: :code:`ProcessError` with return code,
+                 :code:`ProcessTimeoutError` if the process was stopped
+        """
+        deadline = _deadline(timeout)
+        proc = await self.popen(command, cwd=cwd)
+        timed_out = await self._timed_out(proc, deadline)
+        record = await self._finish(proc)
+        if timed_out:
+            raise ProcessTimeoutError(record.returncode, timeout=timeout, record=record)
+        if record.returncode != 0:
+            raise ProcessError(record.returncode, record=record)
+
+    async def _timed_out(self, proc, deadline):
+        if deadline is None or proc.returncode is not None:
+            return False
+        try:
+            await asyncio.wait_for(proc.wait(), max(deadline - capture.clock(), 0))
+        except asyncio.TimeoutError:
+            await _reap(proc, self._grace_periods)
+            return True
+        return False
+
+    async def _finish(self, proc, stdout_bytes=None, stderr_bytes=None):
+        # The event loop's child watcher reaps the process, so there is no resource usage
+        retcode = await proc.wait()
+        self._procs.remove(proc)
+        self._untrack(proc)
+        record = instrument.record(proc, retcode, stdout_bytes=stdout_bytes,
+                                   stderr_bytes=stderr_bytes)
+        self._notify(record)
+        return record
+
+    async def popen(self, command, **kwargs):
+        """
+        Run a process, giving direct access to the :code:`asyncio.create_subprocess_exec` arguments.
+
+        :param command: list of arguments
+        :param kwargs: keyword arguments passed to :code:`asyncio.create_subprocess_exec`
+        :returns: an :code:`asyncio.subprocess.Process`
+        """
+        if kwargs.get('cwd') is None:
+            kwargs['cwd'] = self._cwd
+        if kwargs.get('env') is None:
+            kwargs['env'] = self._env.flatten()
+        for key, value in tree.popen_kwargs(self._isolate).items():
+            kwargs.setdefault(key, value)
+        started = capture.clock()
+        proc = await asyncio.create_subprocess_exec(*command, **kwargs)
+        instrument.launched(proc, command, kwargs['cwd'], started)
+        self._track(proc)
+        self._procs.append(proc)
+        return proc
+
+    async def reap_all(self):
+        """
+        Kill, as gently as possible, all processes.
+
+        All processes are signalled together with a sequence of
+        :code:`SIGINT`, :code:`SIGTERM` and :code:`SIGKILL`,
+        waiting for the shell's grace periods in between.
+
+        :returns: :code:`reap.ReapReport` of the stage at which each process exited
+        """
+        procs = list(self._procs)
+        leftovers = list(self._leftovers)
+        del self._leftovers[:]
+        stopping = [_reap(proc, self._grace_periods) for proc in procs]
+        if leftovers:
+            # Leftover trees are not processes the event loop can wait for
+            stopping.append(asyncio.get_event_loop().run_in_executor(
+                None, reap.reap, leftovers, self._grace_periods))
+        stages = await asyncio.gather(*stopping)
+        report = stages.pop() if leftovers else reap.ReapReport()
+        for process_tree in leftovers:
+            process_tree.close()
+        report.stages.update((proc.pid, stage) for proc, stage in zip(procs, stages))
+        return report
+
+    def stream(self, command, *args, **kwargs):
+        """
+        Not supported: output is read as it comes by a generator, which would block the loop.
+
+        :raises: :code:`TypeError`
+        """
+        raise TypeError('stream is not supported by AsyncShell, use a Shell', command)
+
+    def parse(self, command, parser, *args, **kwargs):
+        """
+        Not supported: output is read and parsed while waiting, which would block the loop.
+
+        :raises: :code:`TypeError`
+        """
+        raise TypeError('parse is not supported by AsyncShell, use a Shell', command)
+
+    def pipeline(self, commands, *args, **kwargs):
+        """
+        Not supported: waiting for the processes, and relaying their ends, would block the loop.
+
+        :raises: :code:`TypeError`
+        """
+        raise TypeError('pipeline is not supported by AsyncShell, use a Shell', commands)
+
+    def coprocess(self, command, framing=None, cwd=None):
+        """
+        Keep a process running, to send it request after request.
+
+        :param command: list of arguments
+        :param framing: how requests and responses are framed
+                        (default is :code:`coprocess.LINES`)
+        :param cwd: current working directory (default is to use the internal working directory)
+        :returns: :code:`AsyncCoprocess`
+        """
+        if framing is None:
+            framing = coprocess.LINES
+        return AsyncCoprocess(coprocess.starter(self.popen, command, cwd=cwd), framing=framing,
+                              grace_periods=self._grace_periods, forget=self._forget)
+
+    abatch = batch
+
+    ainteractive = interactive
+
+    acoprocess = coprocess
+
+@attr.s
+class _AsyncSession(object):
+
+    """
+    One run of an asynchronous coprocess, and the requests sent to it.
+    """
+
+    proc = attr.ib()
+    pending = attr.ib(default=attr.Factory(collections.deque))
+    dead = attr.ib(default=False)
+    reader = attr.ib(default=None)
+
+@attr.s
+class AsyncCoprocess(object):
+
+    """
+    A process which answers requests, started when needed,
+    used from an :code:`asyncio` event loop.
+
+    :param start: coroutine function starting the process, with pipes for
+                  standard input and output (such as a partial
+                  of :code:`AsyncShell.popen`)
+    :param framing: the framing of requests and responses
+    :param grace_periods: seconds :code:`close` waits for the process
+                          to exit, after closing its input, and after
+                          each signal of a reap
+    :param forget: function called with each process which died,
+                   when it is started again
+    """
+
+    _start = attr.ib()
+    framing = attr.ib(default=coprocess.LINES)
+    _grace_periods = attr.ib(default=reap.DEFAULT_GRACE_PERIODS, convert=tuple)
+    _forget = attr.ib(default=None, repr=False)
+
+    restarts = attr.ib(init=False, default=0)
+
+    _session = attr.ib(init=False, default=None, repr=False)
+    _starting = attr.ib(init=False, default=None, repr=False)
+    _started = attr.ib(init=False, default=False, repr=False)
+    _closed = attr.ib(init=False, default=False, repr=False)
+
+    async def _ensure(self):
+        while self._session is None or self._session.dead:
+            if self._starting is not None:
+                # Another request is starting the process
+                await asyncio.shield(self._starting)
+                continue
+            if self._started:
+                self.restarts += 1
+                if self._forget is not None:
+                    self._forget(self._session.proc)
+            self._started = True
+            self._starting = asyncio.ensure_future(self._start())
+            try:
+                proc = await self._starting
+            finally:
+                self._starting = None
+            session = _AsyncSession(proc=proc)
+            session.reader = asyncio.ensure_future(self._read(session))
+            self._session = session
+        return self._session
+
+    async def _read(self, session):
+        responses = coprocess.Responses(self.framing)
+        while True:
+            data = await session.proc.stdout.read(capture.CHUNK_SIZE)
+            if not data:
+                break
+            for response in responses.feed(data):
+                if not session.pending:
+                    continue # pragma: no cover
+                future = session.pending.popleft()
+                if future.done():
+                    continue
+                if isinstance(response, Exception):
+                    future.set_exception(response)
+                else:
+                    future.set_result(response)
+        returncode = await session.proc.wait()
+        session.dead = True
+        pending, session.pending = list(session.pending), collections.deque()
+        for future in pending:
+            if not future.done():
+                future.set_exception(coprocess.CoprocessDied(returncode))
+
+    async def submit(self, request):
+        """
+        Send a request, without waiting for its response.
+
+        :param request: the request, as the framing takes it
+        :returns: future of the response
+        :raises: :code:`ValueError` if the coprocess was closed
+        """
+        data = self.framing.encode(request)
+        if self._closed:
+            raise ValueError('coprocess is closed')
+        session = await self._ensure()
+        future = asyncio.get_event_loop().create_future()
+        session.pending.append(future)
+        session.proc.stdin.write(data)
+        try:
+            await session.proc.stdin.drain()
+        except (BrokenPipeError, ConnectionResetError):
+            # The process died: the reader fails what it did not answer
+            pass
+        return future
+
+    async def request(self, request):
+        """
+        Send a request, and wait for its response.
+
+        :param request: the request, as the framing takes it
+        :returns: the response
+        :raises: :code:`coprocess.CoprocessDied` if the process died first,
+                 :code:`KeyError` for names :code:`git cat-file` does not know
+        """
+        return await (await self.submit(request))
+
+    async def map(self, requests):
+        """
+        Send many requests, all in flight at once, and wait for their responses.
+
+        :param requests: iterable of requests
+        :returns: list of responses, in the order of the requests
+        :raises: the exception of the first request which failed
+        """
+        futures = [await self.submit(request) for request in requests]
+        return [await future for future in futures]
+
+    async def close(self):
+        """
+        Close the process's input, and wait for it to exit,
+        reaping it if it does not.
+        """
+        self._closed = True
+        session = self._session
+        if session is None:
+            return
+        session.proc.stdin.close()
+        try:
+            await asyncio.wait_for(asyncio.shield(session.reader), self._grace_periods[0])
+        except asyncio.TimeoutError:
+            await _reap(session.proc, self._grace_periods)
+            await session.reader
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+@attr.s
+class AsyncRunner(object):
+
+    """
+    Run commands' :code:`abatch` on one event loop, in a helper thread.
+
+    This is the :code:`'async'` backend of :code:`fanout.map_batch`.
+    """
+
+    _commands = attr.ib()
+    _concurrency = attr.ib()
+    _results = attr.ib()
+    _limits = attr.ib(default=attr.Factory(fanout.Limits))
+
+    _loop = attr.ib(init=False, default=attr.Factory(asyncio.new_event_loop))
+    _thread = attr.ib(init=False, default=None)
+    _tasks = attr.ib(init=False, default=attr.Factory(set))
+    _cancelled = attr.ib(init=False, default=False)
+
+    def start(self):
+        """Start the event loop thread"""
+        self._thread = threading.Thread(target=self._main)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _main(self):
+        asyncio.set_event_loop(self._loop)
+        try:
+            self._loop.run_until_complete(self._run_all())
+        finally:
+            self._loop.close()
+            self._results.put(fanout.DONE)
+
+    async def _run_all(self):
+        semaphore = asyncio.Semaphore(self._concurrency)
+        for index, command in self._commands:
+            await semaphore.acquire()
+            if self._cancelled:
+                break
+            task = asyncio.ensure_future(self._run_one(index, command, semaphore))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        if self._tasks:
+            await asyncio.wait(list(self._tasks))
+
+    async def _run_attempt(self, attempt):
+        if self._limits.expired():
+            return self._limits.expired_result(attempt.index, attempt.command)
+        try:
+            output, error = await attempt.command.abatch(**attempt.kwargs(self._limits))
+        except Exception as exc: # pylint: disable=broad-except
+            return fanout.BatchResult(index=attempt.index, command=attempt.command,
+                                      exception=exc)
+        return fanout.BatchResult(index=attempt.index, command=attempt.command,
+                                  output=output, error=error)
+
+    async def _run_one(self, index, command, semaphore):
+        holding = True
+        try:
+            attempt = fanout.first_attempt(index, command)
+            while True:
+                result = await self._run_attempt(attempt)
+                delay = attempt.retry_delay(result, self._limits)
+                if delay is None:
+                    break
+                # Let another command run while this one waits
+                semaphore.release()
+                holding = False
+                await asyncio.sleep(delay)
+                await semaphore.acquire()
+                holding = True
+                attempt = attempt.again()
+            self._results.put(result)
+        finally:
+            if holding:
+                semaphore.release()
+
+    def _cancel_tasks(self):
+        for task in self._tasks:
+            task.cancel()
+
+    def cancel(self):
+        """Start no more commands, and reap the running ones"""
+        self._cancelled = True
+        try:
+            self._loop.call_soon_threadsafe(self._cancel_tasks)
+        except RuntimeError: # loop already closed
+            pass
+
+    def join(self):
+        """Wait for the event loop thread to finish"""
+        self._thread.join()
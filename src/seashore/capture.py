@@ -0,0 +1,507 @@
+# Copyright (c) Shopkick 2017
+# See LICENSE for details.
+"""
+Capture
+-------
+
+Read the output of subprocesses through pipes.
+
+All streams are read in one selector loop, so a child that fills
+one pipe while we wait on the other cannot deadlock.
+Output is kept in memory, and moves to a temporary file once it
+grows past a spill threshold.
+
+:const:`DEFAULT_SPILL_THRESHOLD` -- bytes kept in memory, per stream, before spilling to disk
+
+:const:`DEFAULT_TAIL_SIZE` -- bytes of standard error kept when streaming
+
+Output can also be limited, per stream, with one of the :const:`POLICIES`:
+:code:`'raise'` stops reading (and the caller kills the process),
+:code:`'truncate'` keeps the head and tail and counts the bytes dropped
+in between, and :code:`'spill'` moves the output to a temporary file,
+returned as a memory-mapped :code:`SpilledOutput`.
+"""
+import collections
+import io
+import mmap
+import os
+import tempfile
+import time
+
+try:
+    import selectors
+except ImportError: # pragma: no cover
+    import selectors34 as selectors
+
+import attr
+
+DEFAULT_SPILL_THRESHOLD = 16 * 1024 * 1024
+
+DEFAULT_TAIL_SIZE = 64 * 1024
+
+CHUNK_SIZE = 64 * 1024
+
+POLICIES = ('raise', 'truncate', 'spill')
+
+_CLOCK = getattr(time, 'monotonic', time.time)
+
+def clock():
+    """
+    Seconds since an arbitrary point, unaffected by setting the time of day
+    where the platform has a monotonic clock.
+
+    :returns: float
+    """
+    return _CLOCK()
+
+class Truncated(bytes):
+
+    """
+    Output whose middle was dropped: the head, followed by the tail.
+
+    :param value: the bytes kept
+    :param dropped: the number of bytes dropped between the head and the tail
+    """
+
+    def __new__(cls, value, dropped):
+        ret = super(Truncated, cls).__new__(cls, value)
+        ret.dropped = dropped
+        return ret
+
+class SpilledOutput(object):
+
+    """
+    Output kept in a temporary file, and memory-mapped when read.
+
+    Supports :code:`len`, indexing and slicing (which return bytes),
+    and :code:`find`, without reading the whole output into memory.
+    Close it (or use it as a context manager) to release the file.
+
+    :param fp: the temporary file, which the output owns from now on
+    """
+
+    dropped = 0
+
+    def __init__(self, fp):
+        fp.flush()
+        self._fp = fp
+        self._size = os.fstat(fp.fileno()).st_size
+        self._map = mmap.mmap(fp.fileno(), self._size, access=mmap.ACCESS_READ)
+
+    def __len__(self):
+        return self._size
+
+    def __getitem__(self, index):
+        return self._map[index]
+
+    def find(self, sub, *args):
+        """
+        Find bytes in the output.
+
+        :param sub: bytes to find
+        :returns: index of the first occurrence, or -1
+        """
+        return self._map.find(sub, *args)
+
+    def tobytes(self):
+        """
+        Read the whole output into memory.
+
+        :returns: bytes
+        """
+        return self._map[:]
+
+    def close(self):
+        """Unmap and close the temporary file"""
+        self._map.close()
+        self._fp.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+class DeadlineExceeded(Exception):
+
+    """
+    The deadline passed before the streams reached end of file.
+
+    :param contents: dictionary mapping names to what was read of each stream so far
+    """
+
+    def __init__(self, contents=None):
+        super(DeadlineExceeded, self).__init__()
+        self.contents = contents if contents is not None else {}
+
+class OutputLimitExceeded(Exception):
+
+    """
+    A stream's output passed the limit, with the :code:`'raise'` policy.
+
+    :param name: name of the stream
+    :param contents: dictionary mapping names to what was read of each stream so far
+    """
+
+    def __init__(self, name, contents):
+        super(OutputLimitExceeded, self).__init__(name)
+        self.name = name
+        self.contents = contents
+
+@attr.s
+class _Sink(object):
+
+    """
+    Accumulate bytes in memory, spilling to a temporary file when too big.
+
+    :param spill_threshold: number of bytes after which data goes to disk
+    """
+
+    _spill_threshold = attr.ib()
+
+    _buffer = attr.ib(init=False, default=attr.Factory(io.BytesIO))
+
+    _spilled = attr.ib(init=False, default=False)
+
+    @property
+    def spilled(self):
+        """Whether the data moved to a temporary file"""
+        return self._spilled
+
+    @property
+    def fileobj(self):
+        """Where the data is kept: a :code:`BytesIO`, or the temporary file once spilled"""
+        return self._buffer
+
+    def write(self, data):
+        """
+        Add data to the sink.
+
+        :param data: bytes
+        """
+        if not self._spilled and self._buffer.tell() + len(data) > self._spill_threshold:
+            spill = tempfile.TemporaryFile()
+            spill.write(self._buffer.getvalue())
+            self._buffer.close()
+            self._buffer = spill
+            self._spilled = True
+        self._buffer.write(data)
+
+    def getvalue(self):
+        """
+        Return everything written so far.
+
+        :returns: bytes
+        """
+        if not self._spilled:
+            return self._buffer.getvalue()
+        self._buffer.seek(0)
+        return self._buffer.read()
+
+    def close(self):
+        """
+        Release the memory or temporary file.
+        """
+        self._buffer.close()
+
+@attr.s
+class _LimitedSink(object):
+
+    """
+    Accumulate bytes, refusing more than a limit.
+
+    :param name: name of the stream
+    :param limit: maximum number of bytes
+    :param sink: where to accumulate bytes
+    """
+
+    _name = attr.ib()
+
+    _limit = attr.ib()
+
+    _sink = attr.ib()
+
+    _size = attr.ib(init=False, default=0)
+
+    def write(self, data):
+        """
+        Add data to the sink.
+
+        :param data: bytes
+        :raises: :code:`OutputLimitExceeded` if over the limit (the data is dropped)
+        """
+        if self._size + len(data) > self._limit:
+            raise OutputLimitExceeded(self._name, {})
+        self._size += len(data)
+        self._sink.write(data)
+
+    def getvalue(self):
+        """
+        Return everything written so far.
+
+        :returns: bytes
+        """
+        return self._sink.getvalue()
+
+    def close(self):
+        """
+        Release the memory or temporary file.
+        """
+        self._sink.close()
+
+@attr.s
+class _HeadTailSink(object):
+
+    """
+    Keep the first and the last bytes written, and count the ones in between.
+
+    :param limit: maximum number of bytes kept, half at the head and half at the tail
+    """
+
+    _limit = attr.ib()
+
+    _head = attr.ib(init=False, default=attr.Factory(bytearray))
+
+    _tail = attr.ib(init=False, default=None)
+
+    _size = attr.ib(init=False, default=0)
+
+    def write(self, data):
+        """
+        Add data to the sink.
+
+        :param data: bytes
+        """
+        self._size += len(data)
+        head_room = self._limit // 2 - len(self._head)
+        if head_room > 0:
+            self._head.extend(data[:head_room])
+            data = data[head_room:]
+        if data:
+            if self._tail is None:
+                self._tail = RingBuffer(self._limit - self._limit // 2)
+            self._tail.write(data)
+
+    def getvalue(self):
+        """
+        Return the head and tail.
+
+        :returns: bytes, or :code:`Truncated` if bytes were dropped
+        """
+        tail = self._tail.getvalue() if self._tail is not None else b''
+        value = bytes(self._head) + tail
+        if len(value) == self._size:
+            return value
+        return Truncated(value, self._size - len(value))
+
+    def close(self):
+        """
+        Release the memory.
+        """
+        self._head = bytearray()
+        self._tail = None
+
+@attr.s
+class _MappedSink(object):
+
+    """
+    Accumulate bytes in memory, moving them to a temporary file when too big,
+    and returning the file memory-mapped.
+
+    :param threshold: number of bytes after which data goes to disk
+    """
+
+    _threshold = attr.ib()
+
+    _sink = attr.ib(init=False, default=None)
+
+    _handed_over = attr.ib(init=False, default=False)
+
+    def __attrs_post_init__(self):
+        self._sink = _Sink(self._threshold)
+
+    def write(self, data):
+        """
+        Add data to the sink.
+
+        :param data: bytes
+        """
+        self._sink.write(data)
+
+    def getvalue(self):
+        """
+        Return everything written so far.
+
+        :returns: bytes if under the threshold, otherwise a :code:`SpilledOutput`
+                  (which the caller should close)
+        """
+        if not self._sink.spilled:
+            return self._sink.getvalue()
+        self._handed_over = True
+        return SpilledOutput(self._sink.fileobj)
+
+    def close(self):
+        """
+        Release the memory, or the temporary file if not handed over.
+        """
+        if not self._handed_over:
+            self._sink.close()
+
+def make_sink(name, spill_threshold=DEFAULT_SPILL_THRESHOLD, max_output=None, policy='raise'):
+    """
+    Make something to accumulate a stream's output.
+
+    :param name: name of the stream
+    :param spill_threshold: bytes kept in memory before using a temporary file
+    :param max_output: bytes of output allowed (default is no limit)
+    :param policy: what to do past :code:`max_output`: one of :const:`POLICIES`
+    :returns: an object with :code:`write`, :code:`getvalue` and :code:`close`
+    """
+    if policy not in POLICIES:
+        raise ValueError('unknown output policy', policy)
+    if max_output is None:
+        return _Sink(spill_threshold)
+    if policy == 'raise':
+        return _LimitedSink(name, max_output, _Sink(spill_threshold))
+    if policy == 'truncate':
+        return _HeadTailSink(max_output)
+    return _MappedSink(max_output)
+
+@attr.s
+class RingBuffer(object):
+
+    """
+    Keep only the last bytes written.
+
+    :param limit: maximum number of bytes kept
+    """
+
+    _limit = attr.ib()
+
+    _chunks = attr.ib(init=False, default=attr.Factory(collections.deque))
+
+    _size = attr.ib(init=False, default=0)
+
+    def write(self, data):
+        """
+        Add data, forgetting the oldest data if over the limit.
+
+        :param data: bytes
+        """
+        self._chunks.append(data)
+        self._size += len(data)
+        while self._chunks and self._size - len(self._chunks[0]) >= self._limit:
+            self._size -= len(self._chunks.popleft())
+
+    def getvalue(self):
+        """
+        Return the last bytes written.
+
+        :returns: at most :code:`limit` bytes
+        """
+        if self._limit <= 0:
+            return b''
+        return b''.join(self._chunks)[-self._limit:]
+
+def iter_chunks(streams, chunk_size=CHUNK_SIZE, deadline=None):
+    """
+    Read from several pipes at once, as data becomes available.
+
+    Streams are closed when they reach end of file.
+
+    :param streams: dictionary mapping names to readable pipes
+    :param chunk_size: maximum size of a single read
+    :param deadline: :code:`clock()` value after which to stop waiting (default is never)
+    :returns: iterator of (name, bytes) pairs, in the order the data arrived
+    :raises: :code:`DeadlineExceeded` if the deadline passes first
+    """
+    selector = selectors.DefaultSelector()
+    try:
+        for name, stream in streams.items():
+            selector.register(stream, selectors.EVENT_READ, name)
+        while selector.get_map():
+            timeout = None
+            if deadline is not None:
+                timeout = deadline - clock()
+                if timeout <= 0:
+                    raise DeadlineExceeded()
+            for key, _events in selector.select(timeout):
+                data = os.read(key.fd, chunk_size)
+                if not data:
+                    selector.unregister(key.fileobj)
+                    key.fileobj.close()
+                    continue
+                yield key.data, data
+    finally:
+        selector.close()
+
+def collect(streams, spill_threshold=DEFAULT_SPILL_THRESHOLD, max_output=None, policy='raise',
+            deadline=None):
+    """
+    Read several pipes to the end.
+
+    :param streams: dictionary mapping names to readable pipes
+    :param spill_threshold: bytes per stream kept in memory before using a temporary file
+    :param max_output: bytes of output allowed per stream (default is no limit)
+    :param policy: what to do past :code:`max_output`: one of :const:`POLICIES`
+    :param deadline: :code:`clock()` value after which to stop reading (default is never)
+    :returns: dictionary mapping names to bytes (or, depending on the policy,
+              :code:`Truncated` or :code:`SpilledOutput`)
+    :raises: :code:`OutputLimitExceeded` with the :code:`'raise'` policy,
+             :code:`DeadlineExceeded` if the deadline passes first
+             (both with what was read so far)
+    """
+    sinks = dict((name, make_sink(name, spill_threshold, max_output, policy))
+                 for name in streams)
+    try:
+        try:
+            for name, data in iter_chunks(streams, deadline=deadline):
+                sinks[name].write(data)
+        except (OutputLimitExceeded, DeadlineExceeded) as exc:
+            exc.contents.update((name, sink.getvalue()) for name, sink in sinks.items())
+            raise
+        return dict((name, sink.getvalue()) for name, sink in sinks.items())
+    finally:
+        for sink in sinks.values():
+            sink.close()
+        for stream in streams.values():
+            stream.close()
+
+def iter_lines(chunks):
+    """
+    Split a stream of bytes into lines.
+
+    :param chunks: iterable of bytes
+    :returns: iterator of lines, each ending with a newline except maybe the last
+    """
+    pending = bytearray()
+    for chunk in chunks:
+        pending.extend(chunk)
+        start = 0
+        end = pending.find(b'\n') + 1
+        while end:
+            yield bytes(pending[start:end])
+            start = end
+            end = pending.find(b'\n', start) + 1
+        del pending[:start]
+    if pending:
+        yield bytes(pending)
+
+def iter_fixed(chunks, size):
+    """
+    Split a stream of bytes into fixed-size pieces.
+
+    :param chunks: iterable of bytes
+    :param size: size of each piece
+    :returns: iterator of bytes, each :code:`size` long except maybe the last
+    """
+    pending = bytearray()
+    for chunk in chunks:
+        pending.extend(chunk)
+        start = 0
+        while len(pending) - start >= size:
+            yield bytes(pending[start:start + size])
+            start += size
+        del pending[:start]
+    if pending:
+        yield bytes(pending)
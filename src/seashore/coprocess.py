@@ -0,0 +1,407 @@
+# Copyright (c) Shopkick 2017
+# See LICENSE for details.
+"""
+Coprocess
+---------
+
+Keeping a process running, and sending it request after request.
+
+Tools such as :code:`git cat-file --batch`, :code:`git check-ignore --stdin`
+or :code:`jq --seq` answer requests read from their standard input, one
+response each, on their standard output. Starting such a tool once, rather
+than once per request, saves a :code:`fork` and :code:`exec` per request.
+
+A framing says how requests are written, and how responses are told apart:
+
+* :const:`LINES` -- each request and response is a line
+* :const:`NUL` -- each request and response ends with a NUL byte
+* :const:`GIT_CAT_FILE` -- requests are object names, responses
+  are a header with the size of the content, then the content, as
+  :code:`git cat-file --batch` writes them
+
+Many requests can be in flight at once: they are written as they are made,
+while a reader thread matches responses to requests in order.
+When the process dies, requests in flight fail with :code:`CoprocessDied`,
+and the next request starts it again.
+"""
+import collections
+import functools
+import os
+import subprocess
+import threading
+
+import attr
+import six
+
+from seashore import capture, reap
+from seashore.shell import ProcessError
+
+class CoprocessDied(ProcessError):
+
+    """
+    A coprocess died before answering a request.
+
+    :param args: return code of the process
+    """
+
+    def __repr__(self):
+        return 'CoprocessDied{}'.format(repr(self._args))
+
+    __str__ = __repr__
+
+def _as_bytes(request):
+    if isinstance(request, six.text_type):
+        return request.encode('utf-8')
+    return request
+
+@attr.s(frozen=True)
+class Delimited(object):
+
+    """
+    Requests and responses each end with a delimiter.
+
+    :param delimiter: bytes at the end of each request and response
+    """
+
+    delimiter = attr.ib()
+
+    def encode(self, request):
+        """
+        Write a request.
+
+        :param request: bytes, or text (encoded as UTF-8)
+        :returns: bytes
+        """
+        return _as_bytes(request) + self.delimiter
+
+    def decode(self, buf):
+        """
+        Read a response from the start of a buffer.
+
+        :param buf: :code:`bytearray` of what has been read
+        :returns: pair of the response (without the delimiter),
+                  and its length in the buffer, or :code:`None`
+                  if the buffer does not hold a whole response yet
+        """
+        index = buf.find(self.delimiter)
+        if index == -1:
+            return None
+        return bytes(buf[:index]), index + len(self.delimiter)
+
+LINES = Delimited(b'\n')
+
+NUL = Delimited(b'\0')
+
+@attr.s(frozen=True)
+class GitObject(object):
+
+    """
+    An object read by :code:`git cat-file --batch`.
+
+    :param oid: object id
+    :param type: :code:`'blob'`, :code:`'tree'`, :code:`'commit'` or :code:`'tag'`
+    :param content: bytes
+    """
+
+    oid = attr.ib()
+    type = attr.ib()
+    content = attr.ib(repr=False)
+
+@attr.s(frozen=True)
+class GitCatFile(object):
+
+    """
+    The framing of :code:`git cat-file --batch`.
+
+    Responses are :code:`GitObject`. Names which are missing, or ambiguous,
+    get a :code:`KeyError` instead, which is raised to the requester.
+    """
+
+    def encode(self, request): # pylint: disable=no-self-use
+        """
+        Write a request.
+
+        :param request: name of an object (bytes, or text)
+        :returns: bytes
+        """
+        return _as_bytes(request) + b'\n'
+
+    def decode(self, buf): # pylint: disable=no-self-use
+        """
+        Read a response from the start of a buffer.
+
+        :param buf: :code:`bytearray` of what has been read
+        :returns: pair of the response, and its length in the buffer,
+                  or :code:`None` if the buffer does not hold a whole response yet
+        """
+        header_end = buf.find(b'\n')
+        if header_end == -1:
+            return None
+        header = bytes(buf[:header_end]).decode('utf-8', 'replace')
+        parts = header.rsplit(' ', 2)
+        if len(parts) != 3 or not parts[2].isdigit():
+            return KeyError(header), header_end + 1
+        oid, kind, size = parts
+        start = header_end + 1
+        end = start + int(size)
+        if len(buf) < end + 1:
+            return None
+        return GitObject(oid=oid, type=kind, content=bytes(buf[start:end])), end + 1
+
+GIT_CAT_FILE = GitCatFile()
+
+@attr.s
+class Responses(object):
+
+    """
+    Responses, split out of what a coprocess writes as it comes.
+
+    :param framing: the framing
+    """
+
+    _framing = attr.ib()
+    _buffer = attr.ib(init=False, default=attr.Factory(bytearray), repr=False)
+
+    def feed(self, data):
+        """
+        Add what was read.
+
+        :param data: bytes
+        :returns: list of the responses which are now whole
+        """
+        self._buffer.extend(data)
+        ret = []
+        while self._buffer:
+            decoded = self._framing.decode(self._buffer)
+            if decoded is None:
+                break
+            response, length = decoded
+            del self._buffer[:length]
+            ret.append(response)
+        return ret
+
+@attr.s
+class PendingResponse(object):
+
+    """
+    The response to a request, once it has been read.
+    """
+
+    request = attr.ib()
+
+    _answered = attr.ib(init=False, default=attr.Factory(threading.Event), repr=False)
+    _response = attr.ib(init=False, default=None, repr=False)
+    _exception = attr.ib(init=False, default=None, repr=False)
+
+    def set_result(self, response):
+        """
+        Record the response, once it has been read.
+
+        :param response: the response
+        """
+        self._response = response
+        self._answered.set()
+
+    def set_exception(self, exception):
+        """
+        Record why the request failed.
+
+        :param exception: the exception to raise to the requester
+        """
+        self._exception = exception
+        self._answered.set()
+
+    def done(self):
+        """Whether the response has been read (or the request failed)"""
+        return self._answered.is_set()
+
+    def result(self, timeout=None):
+        """
+        Wait for the response.
+
+        :param timeout: seconds to wait (default is to wait forever)
+        :returns: the response
+        :raises: :code:`CoprocessDied` if the process died first,
+                 :code:`KeyError` for names :code:`git cat-file` does not know,
+                 :code:`RuntimeError` if the timeout passed first
+        """
+        if not self._answered.wait(timeout):
+            raise RuntimeError('no response in time', self.request)
+        if self._exception is not None:
+            raise self._exception
+        return self._response
+
+def _settle(pending, response):
+    if isinstance(response, Exception):
+        pending.set_exception(response)
+    else:
+        pending.set_result(response)
+
+@attr.s
+class _Session(object):
+
+    """
+    One run of the process, and the requests sent to it.
+    """
+
+    proc = attr.ib()
+    pending = attr.ib(default=attr.Factory(collections.deque))
+    dead = attr.ib(default=False)
+    reader = attr.ib(default=None)
+
+@attr.s
+class Coprocess(object):
+
+    """
+    A process which answers requests, started when needed.
+
+    Safe to use from several threads.
+
+    :param start: function starting the process, with pipes for
+                  standard input and output (such as a partial
+                  of :code:`Shell.popen`)
+    :param framing: the framing of requests and responses
+    :param grace_periods: seconds :code:`close` waits for the process
+                          to exit, after closing its input, and after
+                          each signal of a reap
+    :param forget: function called with each process which died,
+                   when it is started again (such as a shell's,
+                   so that it stops keeping track of it)
+    """
+
+    _start = attr.ib()
+    framing = attr.ib(default=LINES)
+    _grace_periods = attr.ib(default=reap.DEFAULT_GRACE_PERIODS, convert=tuple)
+    _forget = attr.ib(default=None, repr=False)
+
+    restarts = attr.ib(init=False, default=0)
+
+    _session = attr.ib(init=False, default=None, repr=False)
+    _started = attr.ib(init=False, default=False, repr=False)
+    _closed = attr.ib(init=False, default=False, repr=False)
+    _lock = attr.ib(init=False, default=attr.Factory(threading.Lock), repr=False)
+    _write_lock = attr.ib(init=False, default=attr.Factory(threading.Lock), repr=False)
+
+    def _ensure(self):
+        if self._session is not None and not self._session.dead:
+            return self._session
+        if self._started:
+            self.restarts += 1
+            if self._forget is not None:
+                self._forget(self._session.proc)
+        self._started = True
+        session = _Session(proc=self._start())
+        session.reader = threading.Thread(target=self._read, args=(session,))
+        session.reader.daemon = True
+        session.reader.start()
+        self._session = session
+        return session
+
+    def _read(self, session):
+        responses = Responses(self.framing)
+        fileno = session.proc.stdout.fileno()
+        while True:
+            try:
+                data = os.read(fileno, capture.CHUNK_SIZE)
+            except OSError: # pragma: no cover
+                data = b''
+            if not data:
+                break
+            for response in responses.feed(data):
+                with self._lock:
+                    if not session.pending:
+                        continue # pragma: no cover
+                    pending = session.pending.popleft()
+                _settle(pending, response)
+        session.proc.stdout.close()
+        returncode = session.proc.wait()
+        with self._lock:
+            session.dead = True
+            pending, session.pending = list(session.pending), collections.deque()
+        for request in pending:
+            request.set_exception(CoprocessDied(returncode))
+
+    def submit(self, request):
+        """
+        Send a request, without waiting for its response.
+
+        :param request: the request, as the framing takes it
+        :returns: :code:`PendingResponse`
+        :raises: :code:`ValueError` if the coprocess was closed
+        """
+        data = self.framing.encode(request)
+        pending = PendingResponse(request)
+        # Requests are written in the order they are queued; the reader only
+        # takes the other lock, so it keeps reading while a write blocks
+        with self._write_lock:
+            with self._lock:
+                if self._closed:
+                    raise ValueError('coprocess is closed')
+                session = self._ensure()
+                session.pending.append(pending)
+            try:
+                session.proc.stdin.write(data)
+                session.proc.stdin.flush()
+            except (IOError, OSError):
+                # The process died: the reader fails what it did not answer
+                pass
+        return pending
+
+    def request(self, request, timeout=None):
+        """
+        Send a request, and wait for its response.
+
+        :param request: the request, as the framing takes it
+        :param timeout: seconds to wait (default is to wait forever)
+        :returns: the response
+        :raises: as :code:`PendingResponse.result` does
+        """
+        return self.submit(request).result(timeout)
+
+    def map(self, requests):
+        """
+        Send many requests, all in flight at once, and wait for their responses.
+
+        :param requests: iterable of requests
+        :returns: list of responses, in the order of the requests
+        :raises: the exception of the first request which failed
+        """
+        pending = [self.submit(request) for request in requests]
+        return [each.result() for each in pending]
+
+    def close(self):
+        """
+        Close the process's input, and wait for it to exit,
+        reaping it if it does not.
+        """
+        with self._lock:
+            self._closed = True
+            session = self._session
+        if session is None:
+            return
+        try:
+            session.proc.stdin.close()
+        except (IOError, OSError): # pragma: no cover
+            pass
+        session.reader.join(self._grace_periods[0])
+        if session.reader.is_alive():
+            reap.reap([session.proc], self._grace_periods)
+            session.reader.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+def starter(popen, command, cwd=None):
+    """
+    Make a function starting a coprocess.
+
+    :param popen: the :code:`popen` of a shell
+    :param command: list of arguments
+    :param cwd: working directory (default is the shell's)
+    :returns: function taking no arguments
+    """
+    return functools.partial(popen, command, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                             cwd=cwd)
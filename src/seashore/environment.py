@@ -0,0 +1,108 @@
+# Copyright (c) Shopkick 2017
+# See LICENSE for details.
+"""
+Environment
+-----------
+
+Environment variables for subprocesses, shared copy-on-write between clones.
+
+An environment is a base dictionary, which is never modified and is shared
+by all copies, and a small delta of changes (including deletions).
+Copying an environment only copies the delta.
+The flat dictionary passed to subprocesses is built when first needed,
+and cached until the next change.
+
+:const:`MAX_DELTA` -- number of changes above which copying folds them into a new base
+"""
+import attr
+
+_DELETED = object()
+
+_MISSING = object()
+
+MAX_DELTA = 64
+
+@attr.s
+class Environment(object):
+
+    """
+    Environment variables, shared copy-on-write between copies.
+
+    :param base: dictionary of variables (not modified, and should not be modified)
+    """
+
+    _base = attr.ib()
+
+    _delta = attr.ib(default=attr.Factory(dict))
+
+    _flat = attr.ib(default=None, cmp=False, repr=False)
+
+    @property
+    def base(self):
+        """The dictionary of variables shared with copies"""
+        return self._base
+
+    @property
+    def changes(self):
+        """The number of variables set or deleted on top of the base"""
+        return len(self._delta)
+
+    def __getitem__(self, key):
+        value = self._delta.get(key, _MISSING)
+        if value is _MISSING:
+            return self._base[key]
+        if value is _DELETED:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key):
+        try:
+            self[key]
+        except KeyError:
+            return False
+        return True
+
+    def __setitem__(self, key, value):
+        self._delta[key] = value
+        self._flat = None
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        if key in self._base:
+            self._delta[key] = _DELETED
+        else:
+            del self._delta[key]
+        self._flat = None
+
+    def copy(self):
+        """
+        Copy the environment.
+
+        The base is shared, and only the changes are copied.
+        Once the changes grow too many, they are folded into a new base.
+
+        :returns: a new :code:`Environment`
+        """
+        if len(self._delta) > MAX_DELTA:
+            return Environment(base=self.flatten())
+        return Environment(base=self._base, delta=dict(self._delta), flat=self._flat)
+
+    def flatten(self):
+        """
+        Get all variables.
+
+        :returns: dictionary of variables (should not be modified)
+        """
+        if self._flat is None:
+            if not self._delta:
+                self._flat = self._base
+            else:
+                flat = dict(self._base)
+                for key, value in self._delta.items():
+                    if value is _DELETED:
+                        flat.pop(key, None)
+                    else:
+                        flat[key] = value
+                self._flat = flat
+        return self._flat
@@ -10,12 +10,21 @@ Construct command-line lists.
 """
 import functools
 
+try:
+    from functools import lru_cache
+except ImportError: # pragma: no cover
+    from backports.functools_lru_cache import lru_cache
+
+import importlib
+
 import six
 
 import singledispatch
 
 import attr
 
+from seashore import fanout, installplan, machines, pipworker, plan, resultcache, xargs
+
 NO_VALUE = object()
 
 @attr.s(frozen=True)
@@ -63,6 +72,14 @@ def _keyword_arguments_dict(value, key):
         yield key
         yield '{}={}'.format(in_k, thing)
 
+@lru_cache(maxsize=1024)
+def _option_name(key):
+    return '--' + key.replace('_', '-')
+
+@lru_cache(maxsize=1024)
+def _subcommand_name(attribute):
+    return attribute.rstrip('_').replace('_', '-')
+
 def cmd(binary, subcommand, *args, **kwargs):
     """
     Construct a command line for a "modern UNIX" command.
@@ -88,8 +105,7 @@ def cmd(binary, subcommand, *args, **kwargs):
     """
     ret = [binary, subcommand]
     for key, value in kwargs.items():
-        key = '--' + key.replace('_', '-')
-        ret.extend(_keyword_arguments(value, key))
+        ret.extend(_keyword_arguments(value, _option_name(key)))
     ret.extend(args)
     return ret
 
@@ -98,23 +114,140 @@ class _PreparedCommand(object):
 
     _cmd = attr.ib()
     _shell = attr.ib()
+    _cache_policy = attr.ib(default=None)
+    _timeout = attr.ib(default=None)
+    retry_policy = attr.ib(default=None)
+    _pip_workers = attr.ib(default=None, repr=False)
+
+    def _timed(self, kwargs):
+        if self._timeout is not None:
+            kwargs.setdefault('timeout', self._timeout)
+        return kwargs
+
+    def _retried(self, run, kwargs):
+        if self.retry_policy is None:
+            return run(**kwargs)
+        return self.retry_policy.call(run, kwargs)
+
+    def _batch_once(self, *args, **kwargs):
+        if self._cache_policy is not None:
+            return self._cache_policy.batch(self._shell, self._cmd, *args, **kwargs)
+        # A worker has no process to time out, or limit the output of
+        if self._pip_workers is not None and not args and not kwargs:
+            try:
+                return self._pip_workers.batch(self._shell, self._cmd)
+            except pipworker.WorkerUnavailable:
+                pass
+        return self._shell.batch(self._cmd, *args, **kwargs)
 
     def batch(self, *args, **kwargs):
-        """Run the shell's batch"""
-        return self._shell.batch(self._cmd, *args, **kwargs)
+        """Run the shell's batch (through the result cache, if cached; retried, if retrying)"""
+        return self._retried(functools.partial(self._batch_once, *args), self._timed(kwargs))
+
+    def with_retry(self, policy):
+        """
+        Return a command whose :code:`batch` and :code:`interactive`
+        (and their asynchronous versions) are retried when they fail.
+
+        :param policy: a :code:`retry.RetryPolicy`, or :code:`None` not to retry
+        :returns: a new prepared command
+        """
+        return attr.evolve(self, retry_policy=policy)
+
+    def cached(self, cache=None, env_keys=None, invalidation=None):
+        """
+        Return a command whose :code:`batch` results are cached.
+
+        Only use this for read-only commands, whose output depends only on
+        the arguments, working directory and environment.
+
+        :param cache: a :code:`resultcache.ResultCache` (default is the process-wide one)
+        :param env_keys: names of the environment variables which matter
+                         (default is all of them)
+        :param invalidation: function returning a hashable value which, when it changes,
+                             invalidates the results (for example, a file's modification time)
+        :returns: a new prepared command
+        """
+        if cache is None:
+            cache = resultcache.RESULTS
+        return attr.evolve(self, cache_policy=resultcache.CachePolicy(
+            cache=cache, env_keys=env_keys, invalidation=invalidation))
 
     def interactive(self, *args, **kwargs):
-        """Run the shell's interactive"""
-        return self._shell.interactive(self._cmd, *args, **kwargs)
+        """Run the shell's interactive (retried, if retrying)"""
+        return self._retried(functools.partial(self._shell.interactive, self._cmd, *args),
+                             self._timed(kwargs))
 
     def redirect(self, *args, **kwargs):
         """Run the shell's redirect"""
-        return self._shell.redirect(self._cmd, *args, **kwargs)
+        return self._shell.redirect(self._cmd, *args, **self._timed(kwargs))
 
     def popen(self, *args, **kwargs):
         """Run the shell's popen"""
         return self._shell.popen(self._cmd, *args, **kwargs)
 
+    def stream(self, *args, **kwargs):
+        """Run the shell's stream"""
+        return self._shell.stream(self._cmd, *args, **self._timed(kwargs))
+
+    def parse(self, *args, **kwargs):
+        """Run the shell's parse"""
+        return self._shell.parse(self._cmd, *args, **self._timed(kwargs))
+
+    def coprocess(self, *args, **kwargs):
+        """Run the shell's coprocess"""
+        return self._shell.coprocess(self._cmd, *args, **kwargs)
+
+    def acoprocess(self, *args, **kwargs):
+        """Run the shell's acoprocess"""
+        return self._shell.acoprocess(self._cmd, *args, **kwargs)
+
+    def xargs(self, args, concurrency=1, max_args=None, limit=None):
+        """
+        Run the command in batch mode with arguments appended, as many times as
+        needed for each run to fit in the kernel's limit, as :code:`xargs` does.
+
+        No command is run if there are no arguments.
+        Each run has a clone of the command's shell, so that runs at once
+        do not share one.
+
+        :param args: iterable of arguments to append
+        :param concurrency: maximum number of runs at once
+        :param max_args: maximum number of arguments per run (default is as many as fit)
+        :param limit: bytes of arguments and environment allowed
+                      (default is :code:`xargs.arg_max()` less :code:`xargs.HEADROOM`)
+        :returns: pair of the standard output, standard error of all runs, in order
+        :raises: :code:`ProcessError` with the return code of the first run which
+                 failed, after all runs ended, and the output and error of all runs;
+                 if that run could not start, what starting it raised
+        """
+        commands = [attr.evolve(self, cmd=list(self._cmd) + list(chunk), shell=self._shell.clone())
+                    for chunk in xargs.chunks(self._cmd, args, self._shell.environ(),
+                                              limit=limit, max_args=max_args)]
+        results = fanout.map_batch(commands, concurrency=concurrency, ordered=True)
+        return xargs.merge(list(results))
+
+    def reap_all(self):
+        """Kill the processes started by this command"""
+        return self._shell.reap_all()
+
+    def _aretried(self, run, kwargs):
+        if self.retry_policy is None:
+            return run(**kwargs)
+        # asyncio is Python 3 only, so only import it when asked to
+        asyncshell = importlib.import_module('seashore.asyncshell')
+        return asyncshell.retry_async(self.retry_policy, run, kwargs)
+
+    def abatch(self, *args, **kwargs):
+        """Run the shell's abatch (awaitable; retried, if retrying)"""
+        return self._aretried(functools.partial(self._shell.abatch, self._cmd, *args),
+                              self._timed(kwargs))
+
+    def ainteractive(self, *args, **kwargs):
+        """Run the shell's ainteractive (awaitable; retried, if retrying)"""
+        return self._aretried(functools.partial(self._shell.ainteractive, self._cmd, *args),
+                              self._timed(kwargs))
+
 
 @attr.s(frozen=True)
 class Command(object):
@@ -135,7 +268,11 @@ class Command(object):
         :returns: something that has methods :code:`batch`, :code:`interactive` and :code:`popen`
                   methods.
         """
-        return _ExecutoredCommand(executor, self._name)
+        bound_command = getattr(executor, '_bound_command', None)
+        if bound_command is None:
+            # Not an executor: other classes only need to have a prepare method
+            return _ExecutoredCommand(executor, self._name)
+        return bound_command(self._name)
 
     __get__ = bind
 
@@ -146,12 +283,49 @@ class _ExecutoredCommand(object):
 
     _name = attr.ib()
 
+    _partials = attr.ib(init=False, default=attr.Factory(dict), cmp=False, repr=False)
+
     def __call__(self, *args, **kwargs):
         return self._executor.prepare(self._name, *args, **kwargs)
 
     def __getattr__(self, subcommand):
-        subcommand = subcommand.rstrip('_').replace('_', '-')
-        return functools.partial(self._executor.prepare, self._name, subcommand)
+        if subcommand.startswith('_'):
+            raise AttributeError(subcommand)
+        try:
+            return self._partials[subcommand]
+        except KeyError:
+            ret = functools.partial(self._executor.prepare, self._name,
+                                    _subcommand_name(subcommand))
+            self._partials[subcommand] = ret
+            return ret
+
+@attr.s(frozen=True)
+class _CommandTemplate(object):
+
+    """
+    A command line whose options are computed once.
+
+    Calling the template prepares the command, with extra positional
+    arguments appended.
+    """
+
+    _prefix = attr.ib(convert=tuple)
+
+    _executor = attr.ib()
+
+    def argv(self, *args):
+        """
+        Build the argument list.
+
+        :param args: positional arguments (put last)
+        :returns: list of arguments
+        """
+        ret = list(self._prefix)
+        ret.extend(args)
+        return ret
+
+    def __call__(self, *args):
+        return self._executor.command(self.argv(*args))
 
 @attr.s(frozen=True)
 class Executor(object):
@@ -165,6 +339,17 @@ class Executor(object):
                   Should match the interface of :code:`Shell`.
     :param pypi: optional. An extra index URL.
     :param commands: optional. An iterable of strings which are commands to suppport.
+    :param pip_workers: optional. A :code:`pipworker.PipWorkerPool` which
+                        :code:`pip_install` tries before running pip as a subprocess.
+    :param machine_environments: optional. A :code:`machines.MachineEnvironments` cache
+                                 (default is the process-wide one).
+    :param cache_policy: optional. A :code:`resultcache.CachePolicy` for the
+                         :code:`batch` results of prepared commands (see :code:`cached`).
+    :param timeout: optional. Default timeout, in seconds, of prepared commands.
+    :param retry_policy: optional. A :code:`retry.RetryPolicy` for prepared commands
+                         (see :code:`with_retry`).
+    :param install_planner: optional. An :code:`installplan.InstallPlanner` which
+                            coalesces :code:`pip_install` and :code:`conda_install`.
 
     The default commands that are supported are :code:`git`, :code:`pip`, :code:`conda`,
     :code:`docker`, :code:`docker_machine`.
@@ -173,6 +358,13 @@ class Executor(object):
     _shell = attr.ib()
     _pypi = attr.ib(default=None)
     _commands = attr.ib(default=attr.Factory(set), convert=set)
+    _pip_workers = attr.ib(default=None)
+    _machine_environments = attr.ib(default=machines.ENVIRONMENTS)
+    _cache_policy = attr.ib(default=None)
+    _timeout = attr.ib(default=None)
+    _retry_policy = attr.ib(default=None)
+    _install_planner = attr.ib(default=None)
+    _bound = attr.ib(init=False, default=attr.Factory(dict), cmp=False, repr=False)
 
     git = Command('git')
     pip = Command('pip')
@@ -185,8 +377,14 @@ class Executor(object):
             raise AttributeError(name) # Reserved Python names not supported as commands
         if name not in self._commands:
             raise AttributeError(name)
-        name = name.replace('_', '-')
-        return Command(name).bind(self)
+        return self._bound_command(name.replace('_', '-'))
+
+    def _bound_command(self, name):
+        try:
+            return self._bound[name]
+        except KeyError:
+            ret = self._bound[name] = _ExecutoredCommand(self, name)
+            return ret
 
     def add_command(self, name):
         """
@@ -207,7 +405,23 @@ class Executor(object):
         :returns: something that supports batch/interactive/popen
         """
         return _PreparedCommand(cmd=cmd(command, subcommand, *args, **kwargs),
-                                shell=self._shell.clone())
+                                shell=self._shell.clone(), cache_policy=self._cache_policy,
+                                timeout=self._timeout, retry_policy=self._retry_policy)
+
+    def template(self, command, subcommand, *args, **kwargs):
+        """
+        Prepare a command template, for running the same command many times.
+
+        The options are turned into arguments once, when the template is built.
+        Calling the template with positional arguments prepares a command.
+
+        :param command: name of command (e.g., :code:`git`)
+        :param subcommand: name of sub-command (e.g., :code:`log`)
+        :param args: fixed positional arguments
+        :param kwargs: option arguments
+        :returns: a callable which returns something that supports batch/interactive/popen
+        """
+        return _CommandTemplate(prefix=cmd(command, subcommand, *args, **kwargs), executor=self)
 
     def command(self, args):
         """
@@ -216,24 +430,75 @@ class Executor(object):
         :param args: argument list
         :returns: something that supports batch/interactive/popen
         """
-        return _PreparedCommand(args, shell=self._shell.clone())
+        return _PreparedCommand(args, shell=self._shell.clone(),
+                                cache_policy=self._cache_policy, timeout=self._timeout,
+                                retry_policy=self._retry_policy)
+
+    def map_batch(self, commands, concurrency=fanout.DEFAULT_CONCURRENCY, # pylint: disable=too-many-arguments
+                  ordered=False, fail_fast=False, backend='thread', timeout=None, deadline=None):
+        """
+        Run many commands in batch mode, several at a time.
+
+        A failing command does not stop the others: its :code:`ProcessError`
+        is reported in its result, unless :code:`fail_fast` is set.
+
+        :param commands: iterable of prepared commands, or of raw argument lists
+        :param concurrency: maximum number of commands running at once
+        :param ordered: yield results in the order the commands were given,
+                        rather than as they finish
+        :param fail_fast: after the first failure, start no more commands and
+                          reap the running ones
+        :param backend: :code:`'thread'` or :code:`'async'` (Python 3.8+)
+        :param timeout: seconds after which to stop each command
+                        (default is the commands' own timeout)
+        :param deadline: seconds after which to stop all commands
+        :returns: iterator of :code:`fanout.BatchResult`
+        """
+        prepared = (self.command(command) if isinstance(command, (list, tuple)) else command
+                    for command in commands)
+        return fanout.map_batch(prepared, concurrency=concurrency, ordered=ordered,
+                                fail_fast=fail_fast, backend=backend, timeout=timeout,
+                                deadline=deadline)
+
+    def plan(self, concurrency=fanout.DEFAULT_CONCURRENCY):
+        """
+        Start a plan: steps which run after the steps they depend on,
+        with independent ones running at once.
+
+        :param concurrency: maximum number of steps running at once
+        :returns: :code:`plan.Plan`, whose steps may be given as argument lists
+        """
+        return plan.Plan(executor=self, concurrency=concurrency)
 
     def in_docker_machine(self, machine):
         """
         Return an executor where all docker commands would point at a specific Docker machine.
 
+        The machine's environment is cached (see :code:`machines.MachineEnvironments`),
+        so :code:`docker-machine` only runs when there is no valid cached one.
+
         :param machine: name of machine
         :returns: a new executor
         """
         new_shell = self._shell.clone()
+        env = self._machine_environments.get(machine,
+                                             functools.partial(self._machine_env, machine))
+        for key, value in env.items():
+            new_shell.setenv(key, value)
+        return attr.evolve(self, shell=new_shell)
+
+    def _machine_env(self, machine):
         output, _ignored = self.docker_machine.env(machine, shell='cmd').batch()
+        if isinstance(output, bytes):
+            output = output.decode('utf-8')
+        ret = {}
         for line in output.splitlines():
             directive, args = line.split(None, 1)
             if directive != 'SET':
                 continue
             key, value = args.split('=', 1)
-            new_shell.setenv(key, value)
-        return attr.assoc(self, _shell=new_shell)
+            ret[key] = value
+        return ret
 
     def patch_env(self, **kwargs):
         """
@@ -274,7 +539,132 @@ class Executor(object):
         except KeyError:
             new_path = envpath + '/bin'
         new_shell.setenv('PATH', new_path)
-        return attr.assoc(self, _shell=new_shell)
+        return attr.evolve(self, shell=new_shell)
+
+    def with_timeout(self, timeout):
+        """
+        Return an executor whose prepared commands time out by default.
+
+        A command still running after the timeout is stopped as :code:`Shell.reap_all`
+        would stop it, and :code:`ProcessTimeoutError` is raised.
+        An explicit :code:`timeout` argument overrides the default.
+
+        :param timeout: seconds, or :code:`None` for no timeout
+        :returns: a new executor
+        """
+        return attr.evolve(self, timeout=timeout)
+
+    def with_retry(self, policy):
+        """
+        Return an executor whose prepared commands are retried when they fail.
+
+        For example, to retry :code:`pip install` when the index is unreachable:
+
+        .. code::
+
+            xctr.with_retry(retry.RetryPolicy(max_attempts=5, stderr='Connection'))
+
+        :param policy: a :code:`retry.RetryPolicy`, or :code:`None` not to retry
+        :returns: a new executor
+        """
+        return attr.evolve(self, retry_policy=policy)
+
+    def with_pip_workers(self, pool=None):
+        """
+        Return an executor which runs :code:`pip_install` in warm pip workers.
+
+        The workers run pip in-process, avoiding the cost of starting Python
+        for every install. If a worker cannot run a command, it is run as
+        a subprocess as usual.
+
+        Installs in a worker are retried like other commands (see :code:`with_retry`).
+        With a timeout (see :code:`with_timeout`), pip runs as a subprocess,
+        so that it can be stopped. Installs in a worker start no process,
+        so the shell's hooks get no :code:`instrument.ProcessRecord` of them.
+
+        :param pool: a :code:`pipworker.PipWorkerPool` (default is a new one)
+        :returns: a new executor
+        """
+        if pool is None:
+            pool = pipworker.PipWorkerPool()
+        return attr.evolve(self, pip_workers=pool)
+
+    def cached(self, cache=None, env_keys=None, invalidation=None):
+        """
+        Return an executor whose prepared commands' :code:`batch` results are cached.
+
+        Only use this for read-only commands, such as :code:`git rev-parse`
+        or :code:`pip freeze`. :code:`pip_install` and :code:`conda_install`
+        are never cached.
+
+        :param cache: a :code:`resultcache.ResultCache` (default is the process-wide one)
+        :param env_keys: names of the environment variables which matter
+                         (default is all of them)
+        :param invalidation: function returning a hashable value which, when it changes,
+                             invalidates the results (for example, a file's modification time)
+        :returns: a new executor
+        """
+        if cache is None:
+            cache = resultcache.RESULTS
+        return attr.evolve(self, cache_policy=resultcache.CachePolicy(
+            cache=cache, env_keys=env_keys, invalidation=invalidation))
+
+    def with_install_planner(self, planner=None):
+        """
+        Return an executor whose installs go through an install planner.
+
+        :code:`pip_install` and :code:`conda_install` still wait for their result,
+        so only a planner with a window merges installs from different threads;
+        any planner merges them with installs requested by
+        :code:`pip_install_later` and :code:`conda_install_later`.
+
+        :param planner: an :code:`installplan.InstallPlanner` (default is a new one)
+        :returns: a new executor
+        """
+        if planner is None:
+            planner = installplan.InstallPlanner()
+        return attr.evolve(self, install_planner=planner)
+
+    def _install_key(self, tool, *options):
+        def _get(name):
+            try:
+                return self._shell.getenv(name)
+            except KeyError:
+                return None
+        return ((tool, _get('VIRTUAL_ENV'), _get('CONDA_PREFIX'), _get('PATH'),
+                 self._shell.getcwd()) + options)
+
+    def _planned(self, key, pkg_ids, install):
+        if self._install_planner is None:
+            raise ValueError('no install planner', self)
+        return self._install_planner.submit(key, pkg_ids, install)
+
+    def pip_install_later(self, pkg_ids, index_url=None):
+        """
+        Request a pip install, to be merged with others for the same environment and index.
+
+        :param pkg_ids: an list of package names
+        :param index_url: (optional) an extra PyPI-compatible index
+        :returns: :code:`installplan.PlannedInstall`
+        :raises: :code:`ValueError` if the executor has no install planner
+        """
+        if index_url is None:
+            index_url = self._pypi
+        return self._planned(self._install_key('pip', index_url), pkg_ids,
+                             lambda merged: self._pip_install(merged, index_url))
+
+    def conda_install_later(self, pkg_ids, channels=None):
+        """
+        Request a conda install, to be merged with others for the same environment and channels.
+
+        :param pkg_ids: an list of package names
+        :param channels: (optional) a list of channels to install from
+        :returns: :code:`installplan.PlannedInstall`
+        :raises: :code:`ValueError` if the executor has no install planner
+        """
+        channels = list(channels or [])
+        return self._planned(self._install_key('conda', tuple(channels)), pkg_ids,
+                             lambda merged: self._conda_install(merged, channels))
 
     def pip_install(self, pkg_ids, index_url=None):
         """
@@ -284,6 +674,11 @@ class Executor(object):
         :param index_url: (optional) an extra PyPI-compatible index
         :raises: :code:`ProcessError` if the installation fails
         """
+        if self._install_planner is not None:
+            return self.pip_install_later(pkg_ids, index_url).result()
+        return self._pip_install(pkg_ids, index_url)
+
+    def _pip_install(self, pkg_ids, index_url):
         if index_url is None:
             index_url = self._pypi
         if index_url is not None:
@@ -292,7 +687,7 @@ class Executor(object):
         else:
             kwargs = {}
         mycmd = self.pip.install(*pkg_ids, **kwargs)
-        return mycmd.batch()
+        return attr.evolve(mycmd, cache_policy=None, pip_workers=self._pip_workers).batch()
 
     def conda_install(self, pkg_ids, channels=None):
         """
@@ -302,6 +697,11 @@ class Executor(object):
         :param channels: (optional) a list of channels to install from
         :raises: :code:`ProcessError` if the installation fails
         """
+        if self._install_planner is not None:
+            return self.conda_install_later(pkg_ids, channels).result()
+        return self._conda_install(pkg_ids, channels)
+
+    def _conda_install(self, pkg_ids, channels):
         mycmd = self.conda.install(quiet=NO_VALUE, yes=NO_VALUE, show_channel_urls=NO_VALUE,
                                    channel=(channels or []), *pkg_ids)
-        return mycmd.batch()
+        return attr.evolve(mycmd, cache_policy=None).batch()
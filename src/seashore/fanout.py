@@ -0,0 +1,343 @@
+# Copyright (c) Shopkick 2017
+# See LICENSE for details.
+"""
+Fan-out
+-------
+
+Run many prepared commands at once, with bounded concurrency.
+
+Commands with a retry policy are retried by the fan-out itself:
+while a command waits to be retried, other commands run in its place.
+
+:const:`DEFAULT_CONCURRENCY` -- how many commands run at once, unless told otherwise
+
+:const:`DONE` -- put on the results queue by a runner once all its commands are done
+"""
+import heapq
+import importlib
+import itertools
+import sys
+import threading
+
+import attr
+
+from six.moves import queue
+
+from seashore import capture
+from seashore.shell import ProcessError, ProcessTimeoutError
+
+DEFAULT_CONCURRENCY = 8
+
+DONE = object()
+
+@attr.s(frozen=True)
+class BatchResult(object):
+
+    """
+    The result of one command in a fan-out.
+
+    :param index: position of the command in the iterable that was passed in
+    :param command: the prepared command
+    :param output: standard output (:code:`None` if the command failed)
+    :param error: standard error (:code:`None` if the command failed)
+    :param exception: the :code:`ProcessError` if the command failed, or whatever
+                      else was raised running it (such as :code:`OSError`
+                      for a missing executable)
+    """
+
+    index = attr.ib()
+    command = attr.ib()
+    output = attr.ib(default=None)
+    error = attr.ib(default=None)
+    exception = attr.ib(default=None)
+
+    @property
+    def succeeded(self):
+        """Whether the command succeeded"""
+        return self.exception is None
+
+@attr.s(frozen=True)
+class Limits(object):
+
+    """
+    Time limits of a fan-out, shared by its runners.
+
+    :param timeout: seconds each command may run
+    :param deadline: :code:`capture.clock()` value by which all commands must be done
+    :param total: seconds all commands may run, for error reporting
+    """
+
+    timeout = attr.ib(default=None)
+    deadline = attr.ib(default=None)
+    total = attr.ib(default=None)
+
+    def expired(self):
+        """Whether the deadline has passed"""
+        return self.deadline is not None and capture.clock() >= self.deadline
+
+    def kwargs(self):
+        """Keyword arguments for a command's :code:`batch`, when starting it now"""
+        timeouts = [self.timeout] if self.timeout is not None else []
+        if self.deadline is not None:
+            timeouts.append(max(self.deadline - capture.clock(), 0))
+        if not timeouts:
+            return {}
+        return dict(timeout=min(timeouts))
+
+    def expired_result(self, index, command):
+        """The result of a command not started before the deadline"""
+        return BatchResult(index=index, command=command,
+                           exception=ProcessTimeoutError(None, b'', b'', timeout=self.total))
+
+@attr.s(frozen=True)
+class Attempt(object):
+
+    """
+    One attempt at running a command.
+
+    :param index: position of the command in the iterable that was passed in
+    :param command: the prepared command, without its retry policy
+    :param policy: the command's retry policy (:code:`None` if it is not retried)
+    :param started: :code:`capture.clock()` when the first attempt started
+    :param number: number of the attempt, starting at 1
+    """
+
+    index = attr.ib()
+    command = attr.ib()
+    policy = attr.ib()
+    started = attr.ib()
+    number = attr.ib(default=1)
+
+    def kwargs(self, limits):
+        """
+        Keyword arguments for the command's :code:`batch`, when starting it now.
+
+        :param limits: the fan-out's :code:`Limits`
+        :returns: dictionary
+        """
+        kwargs = limits.kwargs()
+        if self.policy is None:
+            return kwargs
+        return self.policy.attempt_kwargs(kwargs, capture.clock() - self.started)
+
+    def retry_delay(self, result, limits):
+        """
+        Decide whether to retry the command.
+
+        :param result: the :code:`BatchResult` of this attempt
+        :param limits: the fan-out's :code:`Limits`
+        :returns: seconds to wait before the next attempt, or :code:`None` not to retry
+        """
+        if self.policy is None or not isinstance(result.exception, ProcessError):
+            return None
+        now = capture.clock()
+        delay = self.policy.backoff(self.number, result.exception, now - self.started)
+        if delay is not None and limits.deadline is not None and now + delay >= limits.deadline:
+            return None
+        return delay
+
+    def again(self):
+        """
+        The next attempt at the same command.
+
+        :returns: :code:`Attempt`
+        """
+        return attr.evolve(self, number=self.number + 1)
+
+def first_attempt(index, command):
+    """
+    The first attempt at running a command of a fan-out.
+
+    The fan-out retries the command itself, so the attempt's command has no retry policy.
+
+    :param index: position of the command in the iterable that was passed in
+    :param command: the prepared command
+    :returns: :code:`Attempt`
+    """
+    policy = getattr(command, 'retry_policy', None)
+    if policy is not None:
+        command = command.with_retry(None)
+    return Attempt(index=index, command=command, policy=policy, started=capture.clock())
+
+def _result(index, command, run):
+    try:
+        output, error = run()
+    except Exception as exc: # pylint: disable=broad-except
+        return BatchResult(index=index, command=command, exception=exc)
+    return BatchResult(index=index, command=command, output=output, error=error)
+
+@attr.s
+class _ThreadRunner(object):
+
+    """
+    Run commands in a pool of threads, one :code:`batch` per thread at a time.
+    """
+
+    _commands = attr.ib()
+    _concurrency = attr.ib()
+    _results = attr.ib()
+    _limits = attr.ib(default=attr.Factory(Limits))
+
+    _cancelled = attr.ib(init=False, default=attr.Factory(threading.Event))
+    _lock = attr.ib(init=False, default=attr.Factory(threading.Lock))
+    _changed = attr.ib(init=False, default=None)
+    _running = attr.ib(init=False, default=attr.Factory(dict))
+    _retries = attr.ib(init=False, default=attr.Factory(list))
+    _sequence = attr.ib(init=False, default=attr.Factory(itertools.count))
+    _exhausted = attr.ib(init=False, default=False)
+    _threads = attr.ib(init=False, default=attr.Factory(list))
+    _live = attr.ib(init=False, default=0)
+
+    def __attrs_post_init__(self):
+        self._changed = threading.Condition(self._lock)
+
+    def start(self):
+        """Start the worker threads"""
+        self._live = self._concurrency
+        for _ in range(self._concurrency):
+            thread = threading.Thread(target=self._work)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def _next(self):
+        """The next attempt to run: a retry that is due, or a new command"""
+        with self._lock:
+            while not self._cancelled.is_set():
+                now = capture.clock()
+                if self._retries and self._retries[0][0] <= now:
+                    attempt = heapq.heappop(self._retries)[2]
+                elif not self._exhausted:
+                    try:
+                        index, command = next(self._commands)
+                    except StopIteration:
+                        self._exhausted = True
+                        continue
+                    attempt = first_attempt(index, command)
+                elif self._retries:
+                    self._changed.wait(self._retries[0][0] - now)
+                    continue
+                else:
+                    return None
+                self._running[attempt.index] = attempt.command
+                return attempt
+            return None
+
+    def _run(self, attempt):
+        """Run an attempt, returning its result, or :code:`None` if it is to be retried"""
+        if self._limits.expired():
+            return self._limits.expired_result(attempt.index, attempt.command)
+        kwargs = attempt.kwargs(self._limits)
+        result = _result(attempt.index, attempt.command,
+                         lambda: attempt.command.batch(**kwargs))
+        delay = attempt.retry_delay(result, self._limits)
+        if delay is None:
+            return result
+        with self._lock:
+            heapq.heappush(self._retries, (capture.clock() + delay, next(self._sequence),
+                                           attempt.again()))
+            self._changed.notify()
+        return None
+
+    def _work(self):
+        try:
+            while True:
+                attempt = self._next()
+                if attempt is None:
+                    break
+                try:
+                    result = self._run(attempt)
+                finally:
+                    with self._lock:
+                        del self._running[attempt.index]
+                if result is not None:
+                    self._results.put(result)
+        finally:
+            with self._lock:
+                self._live -= 1
+                if self._live == 0:
+                    self._results.put(DONE)
+
+    def cancel(self):
+        """Start no more commands, and reap the running ones"""
+        self._cancelled.set()
+        with self._lock:
+            self._changed.notify_all()
+            running = list(self._running.values())
+        for command in running:
+            command.reap_all()
+
+    def join(self):
+        """Wait for all worker threads to finish"""
+        for thread in self._threads:
+            thread.join()
+
+def _ordered(results):
+    pending = {}
+    next_index = 0
+    for result in results:
+        pending[result.index] = result
+        while next_index in pending:
+            yield pending.pop(next_index)
+            next_index += 1
+    for index in sorted(pending):
+        yield pending[index]
+
+def _drain(results, runner, fail_fast):
+    while True:
+        result = results.get()
+        if result is DONE:
+            return
+        if fail_fast and not result.succeeded:
+            runner.cancel()
+            yield result
+            return
+        yield result
+
+def _make_runner(backend, commands, concurrency, results, limits):
+    if backend == 'thread':
+        return _ThreadRunner(commands, concurrency, results, limits)
+    if backend == 'async':
+        if sys.version_info < (3, 8):
+            # Before 3.8, only an event loop in the main thread can wait for processes
+            raise ValueError('the async backend needs Python 3.8 or later', backend)
+        # asyncio is Python 3 only, so only import it when asked to
+        asyncshell = importlib.import_module('seashore.asyncshell')
+        return asyncshell.AsyncRunner(commands, concurrency, results, limits)
+    raise ValueError('unknown backend', backend)
+
+def map_batch(commands, concurrency=DEFAULT_CONCURRENCY, # pylint: disable=too-many-arguments
+              ordered=False, fail_fast=False, backend='thread', timeout=None, deadline=None):
+    """
+    Run prepared commands in batch mode, several at a time.
+
+    :param commands: iterable of prepared commands
+    :param concurrency: maximum number of commands running at once
+    :param ordered: yield results in the order the commands were given,
+                    rather than as they finish
+    :param fail_fast: after the first failure, start no more commands and reap
+                      the running ones
+    :param backend: :code:`'thread'` runs each :code:`batch` in a thread pool;
+                    :code:`'async'` runs :code:`abatch` on a single event loop,
+                    in a thread of its own (Python 3.8+)
+    :param timeout: seconds after which to stop each command
+                    (default is the commands' own timeout)
+    :param deadline: seconds after which to stop all commands; commands not
+                     started by then fail with a :code:`ProcessTimeoutError`
+                     whose return code is :code:`None`
+    :returns: iterator of :code:`BatchResult`
+    """
+    limits = Limits(timeout=timeout, deadline=None if deadline is None else
+                    capture.clock() + deadline, total=deadline)
+    results = queue.Queue()
+    runner = _make_runner(backend, enumerate(commands), concurrency, results, limits)
+    runner.start()
+    try:
+        stream = _drain(results, runner, fail_fast)
+        if ordered:
+            stream = _ordered(stream)
+        for result in stream:
+            yield result
+    finally:
+        runner.cancel()
+        runner.join()
@@ -0,0 +1,486 @@
+# Copyright (c) Shopkick 2017
+# See LICENSE for details.
+"""
+Fork server
+-----------
+
+Starting processes from a small helper process.
+
+Forking a large Python process copies its page tables, and every page
+either side writes to afterwards is copied. A :code:`ForkserverLauncher`
+starts a helper once: a Python interpreter without :code:`site`, which only
+imports what it needs. Every process after that is forked by the helper,
+and its standard streams are passed to it over a Unix socket
+(with :code:`SCM_RIGHTS`). The helper reports when each process started,
+and when it exited, with its resource usage.
+
+The helper ignores :code:`SIGINT`, so that an interrupt from the terminal
+reaches the processes it started, but not the helper. Those processes get
+the default signal handling back, as with :code:`subprocess.Popen`.
+
+Processes started by the helper are not our children, so only the helper can
+wait for them: if it dies, how they ended is lost, and they are reported as
+having exited with :const:`LOST_RETURNCODE` once they are gone.
+If it dies while starting a process, the process may have been started, so
+the launch fails rather than being retried with another helper.
+
+:const:`LOST_RETURNCODE` -- return code of processes whose helper died before they did
+
+Requires Python 3.
+"""
+import collections
+import errno
+import itertools
+import json
+import os
+import socket
+import struct
+import subprocess
+import sys
+import threading
+
+import attr
+
+from seashore import launch
+
+HELPER_SOURCE = r'''
+import array, json, os, select, signal, socket, struct, sys
+
+SIGNALS = [getattr(signal, name) for name in ('SIGINT', 'SIGPIPE', 'SIGXFSZ', 'SIGCHLD')
+           if hasattr(signal, name)]
+
+def main(fileno):
+    os.set_inheritable(fileno, False)
+    sock = socket.socket(fileno=fileno)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    wakeup_read, wakeup_write = os.pipe()
+    os.set_blocking(wakeup_read, False)
+    os.set_blocking(wakeup_write, False)
+    signal.set_wakeup_fd(wakeup_write)
+    signal.signal(signal.SIGCHLD, lambda signum, frame: None)
+    fds_size = socket.CMSG_SPACE(3 * array.array('i').itemsize)
+
+    def send(message):
+        data = json.dumps(message).encode('utf-8')
+        sock.sendall(struct.pack('!I', len(data)) + data)
+
+    def read_exactly(size, data=b''):
+        while len(data) < size:
+            more = sock.recv(size - len(data))
+            if not more:
+                raise EOFError()
+            data += more
+        return data
+
+    def reap():
+        while True:
+            try:
+                pid, status, rusage = os.wait4(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            send(['exited', pid, status, rusage.ru_utime, rusage.ru_stime, rusage.ru_maxrss])
+
+    def child(request, fds):
+        for signum in SIGNALS:
+            signal.signal(signum, signal.SIG_DFL)
+        signal.set_wakeup_fd(-1)
+        if request['session']:
+            os.setsid()
+        elif request['group'] is not None:
+            os.setpgid(0, request['group'])
+        # Move the descriptors out of the way before putting them in place
+        high = [os.dup(fd) for fd in fds]
+        for target, fd in enumerate(high):
+            os.dup2(fd, target)
+        if request['cwd'] is not None:
+            os.chdir(request['cwd'])
+        env = dict((os.fsencode(key), os.fsencode(value))
+                   for key, value in request['env'].items())
+        os.execve(os.fsencode(request['path']), [os.fsencode(arg) for arg in request['argv']],
+                  env)
+
+    def spawn(request, fds):
+        error_read, error_write = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            try:
+                child(request, fds)
+            except OSError as exc:
+                os.write(error_write, str(exc.errno).encode('ascii'))
+            finally:
+                os._exit(255)
+        os.close(error_write)
+        error = b''
+        while True:
+            data = os.read(error_read, 64)
+            if not data:
+                break
+            error += data
+        os.close(error_read)
+        if error:
+            os.waitpid(pid, 0)
+            send(['failed', request['id'], int(error)])
+        else:
+            send(['started', request['id'], pid])
+
+    while True:
+        readable = select.select([sock, wakeup_read], [], [])[0]
+        if wakeup_read in readable:
+            try:
+                while os.read(wakeup_read, 512):
+                    pass
+            except BlockingIOError:
+                pass
+        if sock in readable:
+            header, ancillary, _flags, _address = sock.recvmsg(
+                4, fds_size, getattr(socket, 'MSG_CMSG_CLOEXEC', 0))
+            if not header:
+                break
+            fds = array.array('i')
+            for level, kind, data in ancillary:
+                if level == socket.SOL_SOCKET and kind == socket.SCM_RIGHTS:
+                    fds.frombytes(data[:len(data) - len(data) % fds.itemsize])
+            try:
+                size, = struct.unpack('!I', read_exactly(4, header))
+                request = json.loads(read_exactly(size).decode('utf-8'))
+                spawn(request, fds)
+            finally:
+                for fd in fds:
+                    os.close(fd)
+        reap()
+
+main(int(sys.argv[1]))
+'''
+
+LOST_RETURNCODE = 255
+
+_FORKABLE = frozenset(['stdin', 'stdout', 'stderr', 'cwd', 'env', 'start_new_session',
+                       'process_group'])
+
+class _HelperGone(OSError):
+    pass
+
+_Usage = collections.namedtuple('_Usage', 'ru_utime ru_stime ru_maxrss')
+
+@attr.s
+class ForkserverProcess(launch.SpawnedProcess):
+
+    """
+    A process started by a fork server's helper.
+
+    Supports the parts of the :code:`subprocess.Popen` interface
+    that :code:`Shell` uses.
+    """
+
+    launched_by = attr.ib(init=False, default='forkserver')
+    _status = attr.ib(init=False, default=None, repr=False)
+    _rusage = attr.ib(init=False, default=None, repr=False)
+    _exited = attr.ib(init=False, default=attr.Factory(threading.Event), repr=False)
+    _lost = attr.ib(init=False, default=False, repr=False)
+
+    def set_exited(self, status, rusage):
+        """
+        Record how the process ended, as reported by the helper.
+
+        :param status: wait status
+        :param rusage: resource usage
+        """
+        self._status, self._rusage = status, rusage
+        self._exited.set()
+
+    def set_lost(self):
+        """
+        Record that the helper died before the process, so how it ends cannot be known.
+        """
+        self._lost = True
+        self._exited.set()
+
+    def _gone(self):
+        try:
+            os.kill(self.pid, 0)
+        except OSError as exc:
+            return exc.errno == errno.ESRCH
+        return False
+
+    def _waitpid(self, options):
+        if self.returncode is not None:
+            return self.returncode
+        if options & os.WNOHANG:
+            if not self._exited.is_set():
+                return None
+        else:
+            self._exited.wait()
+        if not self._lost:
+            self.returncode = launch.returncode(self._status)
+        elif self._gone() or not options & os.WNOHANG:
+            while not self._gone():
+                self._exited.wait(0.05)
+            # The helper died, and we can't know how the process ended
+            self.returncode = LOST_RETURNCODE
+        return self.returncode
+
+    def wait4(self):
+        """
+        Wait for the process to end, collecting its resource usage.
+
+        :returns: pair of return code, resource usage
+                  (:code:`None` if the helper died first)
+        """
+        return self._waitpid(0), self._rusage
+
+@attr.s
+class _Helper(object):
+
+    """
+    The helper process, and our end of its socket.
+    """
+
+    proc = attr.ib()
+    sock = attr.ib()
+
+    _ids = attr.ib(init=False, default=attr.Factory(itertools.count))
+    _send_lock = attr.ib(init=False, default=attr.Factory(threading.Lock))
+    _lock = attr.ib(init=False, default=attr.Factory(threading.Lock))
+    _replies = attr.ib(init=False, default=attr.Factory(dict))
+    _children = attr.ib(init=False, default=attr.Factory(dict))
+    _early_exits = attr.ib(init=False, default=attr.Factory(dict))
+    dead = attr.ib(init=False, default=False)
+
+    @classmethod
+    def start(cls, python):
+        """Start the helper, and the thread reading what it says"""
+        ours, theirs = socket.socketpair(socket.AF_UNIX, socket.SOCK_STREAM)
+        popen_kwargs = dict(close_fds=True)
+        # Python 3 only, like the rest of this module
+        popen_kwargs['pass_fds'] = [theirs.fileno()]
+        try:
+            proc = subprocess.Popen([python, '-S', '-c', HELPER_SOURCE, str(theirs.fileno())],
+                                    **popen_kwargs)
+        except BaseException:
+            ours.close()
+            raise
+        finally:
+            theirs.close()
+        helper = cls(proc=proc, sock=ours)
+        thread = threading.Thread(target=helper.listen)
+        thread.daemon = True
+        thread.start()
+        return helper
+
+    def _read_exactly(self, size):
+        data = b''
+        while len(data) < size:
+            more = self.sock.recv(size - len(data))
+            if not more:
+                raise EOFError()
+            data += more
+        return data
+
+    def listen(self):
+        """Follow what the helper says until it dies (runs in a thread of its own)"""
+        try:
+            while True:
+                size, = struct.unpack('!I', self._read_exactly(4))
+                message = json.loads(self._read_exactly(size).decode('utf-8'))
+                self._dispatch(message)
+        except (EOFError, OSError):
+            pass
+        with self._lock:
+            self.dead = True
+            replies = list(self._replies.values())
+            children = list(self._children.values())
+            self._children.clear()
+        for reply in replies:
+            reply['event'].set()
+        for child in children:
+            child.set_lost()
+        self.proc.wait()
+
+    def _dispatch(self, message):
+        kind = message[0]
+        if kind == 'exited':
+            pid, status, utime, stime, maxrss = message[1:]
+            usage = _Usage(ru_utime=utime, ru_stime=stime, ru_maxrss=maxrss)
+            with self._lock:
+                child = self._children.pop(pid, None)
+                if child is None:
+                    self._early_exits[pid] = (status, usage)
+            if child is not None:
+                child.set_exited(status, usage)
+            return
+        with self._lock:
+            reply = self._replies.get(message[1])
+        if reply is not None:
+            reply['message'] = message
+            reply['event'].set()
+
+    def spawn(self, request, fds):
+        """
+        Ask the helper to start a process.
+
+        :param request: dictionary describing the process
+        :param fds: the process's standard input, output and error
+        :returns: process id
+        :raises: :code:`_HelperGone` if the request could not be sent,
+                 :code:`OSError` if the process could not be started
+        """
+        reply = dict(event=threading.Event(), message=None)
+        with self._lock:
+            if self.dead:
+                raise _HelperGone(errno.EPIPE, 'fork server helper is gone')
+            request['id'] = next(self._ids)
+            self._replies[request['id']] = reply
+        try:
+            data = json.dumps(request).encode('utf-8')
+            try:
+                with self._send_lock:
+                    self.sock.sendmsg([struct.pack('!I', len(data)) + data],
+                                      [(socket.SOL_SOCKET, socket.SCM_RIGHTS,
+                                        struct.pack('3i', *fds))])
+            except (IOError, OSError, socket.error) as exc:
+                if exc.errno not in (errno.EPIPE, errno.ECONNRESET):
+                    raise
+                raise _HelperGone(exc.errno, 'fork server helper is gone')
+            reply['event'].wait()
+        finally:
+            with self._lock:
+                del self._replies[request['id']]
+        message = reply['message']
+        if message is None:
+            # The process may have been started, so it must not be started again
+            raise OSError(errno.EPIPE, 'fork server helper died while starting process',
+                          request['argv'][0])
+        if message[0] == 'failed':
+            code = message[2]
+            raise OSError(code, os.strerror(code), request['argv'][0])
+        return message[2]
+
+    def adopt(self, child):
+        """Start following a process the helper started"""
+        with self._lock:
+            early = self._early_exits.pop(child.pid, None)
+            if early is None and self.dead:
+                child.set_lost()
+            elif early is None:
+                self._children[child.pid] = child
+        if early is not None:
+            child.set_exited(*early)
+
+    def close(self):
+        """Ask the helper to exit, and wait for it"""
+        try:
+            self.sock.shutdown(socket.SHUT_WR)
+        except OSError: # pragma: no cover
+            pass
+        self.proc.wait()
+        self.sock.close()
+
+def available():
+    """
+    Whether processes can be started from a helper here,
+    rather than falling back to another launcher.
+
+    :returns: bool
+    """
+    return hasattr(socket.socket, 'sendmsg') and hasattr(socket, 'AF_UNIX')
+
+def _can_fork(kwargs):
+    if not available():
+        return False # pragma: no cover
+    if not _FORKABLE.issuperset(kwargs):
+        return False
+    return kwargs.get('stdin') != subprocess.STDOUT
+
+def _request(command, kwargs):
+    env = kwargs.get('env')
+    if env is None:
+        env = os.environ
+    return dict(path=launch.resolve(command[0], env),
+                argv=[os.fsdecode(arg) for arg in command],
+                env=dict((os.fsdecode(key), os.fsdecode(value)) for key, value in env.items()),
+                cwd=None if kwargs.get('cwd') is None else os.fsdecode(kwargs['cwd']),
+                session=bool(kwargs.get('start_new_session')),
+                group=kwargs.get('process_group'))
+
+@attr.s
+class ForkserverLauncher(object):
+
+    """
+    Start processes from a helper process.
+
+    The helper is started the first time a process is launched,
+    and again if it dies.
+    Options other than standard streams, environment, working directory,
+    and a new session or process group fall back to another launcher.
+
+    :param python: Python interpreter to run the helper with
+                   (default is the one running this)
+    :param fallback: launcher for everything else (default is a :code:`PopenLauncher`)
+    """
+
+    _python = attr.ib(default=sys.executable)
+    _fallback = attr.ib(default=attr.Factory(launch.PopenLauncher))
+
+    counts = attr.ib(init=False, default=attr.Factory(collections.Counter))
+
+    _helper = attr.ib(init=False, default=None, repr=False)
+    _lock = attr.ib(init=False, default=attr.Factory(threading.Lock), repr=False)
+
+    @property
+    def helper_process(self):
+        """The running helper process (:code:`None` until a process is launched)"""
+        with self._lock:
+            return None if self._helper is None else self._helper.proc
+
+    def _get_helper(self, gone=None):
+        with self._lock:
+            if self._helper is None or self._helper.dead or self._helper is gone:
+                self._helper = _Helper.start(self._python)
+            return self._helper
+
+    def launch(self, command, **kwargs):
+        """
+        Start a process.
+
+        :param command: list of arguments
+        :param kwargs: keyword arguments, as for :code:`subprocess.Popen`
+        :returns: a :code:`ForkserverProcess`, or whatever the fallback launcher returns
+        """
+        if not _can_fork(kwargs):
+            proc = self._fallback.launch(command, **kwargs)
+            self.counts[proc.launched_by] += 1
+            return proc
+        parent_ends = {}
+        to_close = []
+        try:
+            fds = [0, 1, 2]
+            for child_fd, child_end in launch.child_streams(kwargs, parent_ends, to_close):
+                fds[child_fd] = child_end
+            request = _request(command, kwargs)
+            helper = self._get_helper()
+            try:
+                pid = helper.spawn(request, fds)
+            except _HelperGone:
+                # It died before getting the request: start another one
+                helper = self._get_helper(gone=helper)
+                pid = helper.spawn(request, fds)
+        except BaseException:
+            for stream in parent_ends.values():
+                stream.close()
+            raise
+        finally:
+            for descriptor in to_close:
+                os.close(descriptor)
+        self.counts['forkserver'] += 1
+        proc = ForkserverProcess(args=command, pid=pid, **parent_ends)
+        helper.adopt(proc)
+        return proc
+
+    def close(self):
+        """Stop the helper (processes it started keep running)"""
+        with self._lock:
+            helper, self._helper = self._helper, None
+        if helper is not None:
+            helper.close()
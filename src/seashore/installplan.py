@@ -0,0 +1,187 @@
+# Copyright (c) Shopkick 2017
+# See LICENSE for details.
+"""
+Install plan
+------------
+
+Coalesce package installs requested for the same environment.
+
+Every :code:`pip install` or :code:`conda install` resolves dependencies,
+which often costs more than the installing itself. When several parts of
+a job ask for packages for the same environment, an :code:`InstallPlanner`
+collects the requests, and runs one install of all of the packages,
+per environment and index (or channels).
+
+Requests are collected until their results are needed, until a window of time
+has passed since the first one, or until the end of a :code:`with` block.
+If a merged install fails, each request in it is installed on its own, so that
+each requester gets the result of its own packages.
+"""
+import collections
+import threading
+
+import attr
+
+from seashore.shell import ProcessError
+
+@attr.s
+class PlannedInstall(object):
+
+    """
+    The result of a requested install, once it has run.
+    """
+
+    _planner = attr.ib(repr=False)
+    key = attr.ib()
+    pkg_ids = attr.ib()
+    _install = attr.ib(repr=False)
+
+    _done = attr.ib(init=False, default=attr.Factory(threading.Event), repr=False)
+    _result = attr.ib(init=False, default=None, repr=False)
+    _exception = attr.ib(init=False, default=None, repr=False)
+
+    def install(self, pkg_ids):
+        """
+        Install packages with the function this request was submitted with.
+
+        :param pkg_ids: list of package names (this request's, and the ones merged with it)
+        :returns: pair of standard output, standard error
+        """
+        return self._install(pkg_ids)
+
+    def set_result(self, result):
+        """
+        Record the result of the install, once it has run.
+
+        :param result: pair of standard output, standard error
+        """
+        self._result = result
+        self._done.set()
+
+    def set_exception(self, exception):
+        """
+        Record the failure of the install, once it has run.
+
+        :param exception: what the install raised
+        """
+        self._exception = exception
+        self._done.set()
+
+    def done(self):
+        """Whether the install has run"""
+        return self._done.is_set()
+
+    def result(self, timeout=None):
+        """
+        Get the result of the install, running it now if nothing else will.
+
+        :param timeout: seconds to wait for an install with a window to run
+                        (default is to wait forever)
+        :returns: pair of standard output, standard error of the install
+        :raises: :code:`ProcessError` if installing the packages failed,
+                 :code:`RuntimeError` if the timeout passed first
+        """
+        if not self.done() and self._planner.window is None:
+            self._planner.flush(self.key)
+        if not self._done.wait(timeout):
+            raise RuntimeError('install did not run in time', self.key, self.pkg_ids)
+        if self._exception is not None:
+            raise self._exception
+        return self._result
+
+def _merged(requests):
+    ret = []
+    seen = set()
+    for request in requests:
+        for pkg_id in request.pkg_ids:
+            if pkg_id not in seen:
+                seen.add(pkg_id)
+                ret.append(pkg_id)
+    return ret
+
+@attr.s
+class InstallPlanner(object):
+
+    """
+    Collect install requests, and run one install per key.
+
+    :param window: seconds to collect requests for a key, from the first one,
+                   before installing (default is to collect them until a result
+                   is needed, or until :code:`flush`)
+
+    Used as a context manager, pending installs are run when the block ends.
+    """
+
+    window = attr.ib(default=None)
+
+    _pending = attr.ib(init=False, default=attr.Factory(collections.OrderedDict))
+    _lock = attr.ib(init=False, default=attr.Factory(threading.Lock))
+
+    def submit(self, key, pkg_ids, install):
+        """
+        Request an install.
+
+        :param key: hashable key of the environment and options to install with;
+                    requests with the same key are merged
+        :param pkg_ids: list of package names
+        :param install: function which installs a list of packages,
+                        returning a pair of standard output, standard error
+                        (the one of the first request for a key is used)
+        :returns: :code:`PlannedInstall`
+        """
+        planned = PlannedInstall(self, key, list(pkg_ids), install)
+        with self._lock:
+            requests = self._pending.setdefault(key, [])
+            requests.append(planned)
+            first = len(requests) == 1
+        if first and self.window is not None:
+            timer = threading.Timer(self.window, self._flush_batch, args=(key, requests))
+            timer.daemon = True
+            timer.start()
+        return planned
+
+    def flush(self, key=None):
+        """
+        Run pending installs.
+
+        :param key: key to run the installs of (default is all keys)
+        """
+        with self._lock:
+            if key is None:
+                batches = list(self._pending.values())
+                self._pending.clear()
+            else:
+                batches = [self._pending.pop(key, [])]
+        for requests in batches:
+            if requests:
+                self._run(requests)
+
+    def _flush_batch(self, key, requests):
+        with self._lock:
+            if self._pending.get(key) is not requests:
+                return # Already flushed
+            del self._pending[key]
+        self._run(requests)
+
+    def _run(self, requests):
+        try:
+            result = requests[0].install(_merged(requests))
+        except ProcessError as exc:
+            if len(requests) == 1:
+                requests[0].set_exception(exc)
+                return
+            for request in requests:
+                self._run([request])
+            return
+        except Exception as exc: # pylint: disable=broad-except
+            for request in requests:
+                request.set_exception(exc)
+            return
+        for request in requests:
+            request.set_result(result)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.flush()
@@ -0,0 +1,221 @@
+# Copyright (c) Shopkick 2017
+# See LICENSE for details.
+"""
+Instrument
+----------
+
+Records of what each process cost.
+
+Every process a :code:`Shell` runs to completion produces a :code:`ProcessRecord`,
+with timings, CPU time and memory from :code:`os.wait4`, and the number of
+bytes read from it. Records are passed to the shell's hooks: any callable
+taking a record, such as a :code:`LoggingSink` or a :code:`Histogram`.
+"""
+import bisect
+import collections
+import errno
+import logging
+import os
+import sys
+import threading
+
+import attr
+
+from seashore import capture, launch
+
+DEFAULT_BUCKETS = (0.001, 0.01, 0.1, 1, 10, 100)
+
+@attr.s(frozen=True)
+class ProcessRecord(object):
+
+    """
+    What running a process cost.
+
+    Fields which could not be measured are :code:`None`: CPU time and memory
+    when the platform (or, for :code:`asyncio`, the event loop) does not
+    give a resource usage, and output sizes when the output was not read by us.
+
+    :param argv: list of arguments
+    :param cwd: working directory
+    :param returncode: return code
+    :param wall_time: seconds from starting the process until it was waited for
+    :param spawn_latency: seconds the launcher took to start the process
+    :param user_time: seconds of user CPU time
+    :param system_time: seconds of system CPU time
+    :param max_rss: maximum resident set size, in kilobytes
+    :param stdout_bytes: bytes read from standard output
+    :param stderr_bytes: bytes read from standard error
+    """
+
+    argv = attr.ib()
+    cwd = attr.ib()
+    returncode = attr.ib()
+    wall_time = attr.ib()
+    spawn_latency = attr.ib()
+    user_time = attr.ib(default=None)
+    system_time = attr.ib(default=None)
+    max_rss = attr.ib(default=None)
+    stdout_bytes = attr.ib(default=None)
+    stderr_bytes = attr.ib(default=None)
+
+@attr.s(frozen=True)
+class _Launch(object):
+
+    """
+    When and how a process was started.
+    """
+
+    argv = attr.ib()
+    cwd = attr.ib()
+    started = attr.ib()
+    spawn_latency = attr.ib()
+
+def launched(proc, argv, cwd, started):
+    """
+    Note how a process was started, for its record.
+
+    :param proc: the process
+    :param argv: list of arguments
+    :param cwd: working directory
+    :param started: the :code:`capture.clock()` just before starting the process
+    """
+    proc.launch_info = _Launch(argv=list(argv), cwd=cwd, started=started,
+                               spawn_latency=capture.clock() - started)
+
+def _max_rss(rusage):
+    if sys.platform == 'darwin': # pragma: no cover
+        return rusage.ru_maxrss // 1024
+    return rusage.ru_maxrss
+
+def wait(proc):
+    """
+    Wait for a process, collecting its resource usage.
+
+    Processes whose class has a :code:`wait4` method are waited on with it;
+    others are waited on with :code:`os.wait4` where available.
+
+    :param proc: the process
+    :returns: pair of return code, resource usage (or :code:`None` if unavailable)
+    """
+    wait4 = getattr(proc, 'wait4', None)
+    if wait4 is not None:
+        return wait4()
+    if proc.returncode is not None or not hasattr(os, 'wait4'):
+        return proc.wait(), None
+    while True:
+        try:
+            _pid, status, rusage = os.wait4(proc.pid, 0)
+        except OSError as exc:
+            if exc.errno == errno.EINTR: # pragma: no cover
+                continue
+            if exc.errno != errno.ECHILD: # pragma: no cover
+                raise
+            # Somebody else reaped the process
+            return proc.wait(), None
+        break
+    proc.returncode = launch.returncode(status)
+    return proc.returncode, rusage
+
+def record(proc, returncode, rusage=None, stdout_bytes=None, stderr_bytes=None):
+    """
+    Make the record of a finished process.
+
+    :param proc: the process, as started by :code:`Shell.popen`
+    :param returncode: its return code
+    :param rusage: its resource usage, if known
+    :param stdout_bytes: bytes read from standard output, if read
+    :param stderr_bytes: bytes read from standard error, if read
+    :returns: :code:`ProcessRecord`
+    """
+    info = proc.launch_info
+    kwargs = {}
+    if rusage is not None:
+        kwargs.update(user_time=rusage.ru_utime, system_time=rusage.ru_stime,
+                      max_rss=_max_rss(rusage))
+    return ProcessRecord(argv=info.argv, cwd=info.cwd, returncode=returncode,
+                         wall_time=capture.clock() - info.started, spawn_latency=info.spawn_latency,
+                         stdout_bytes=stdout_bytes, stderr_bytes=stderr_bytes, **kwargs)
+
+@attr.s
+class LoggingSink(object):
+
+    """
+    Hook logging every record.
+
+    :param logger: where to log (default is the :code:`seashore.instrument` logger)
+    :param level: logging level
+    """
+
+    _logger = attr.ib(default=attr.Factory(lambda: logging.getLogger(__name__)))
+    _level = attr.ib(default=logging.DEBUG)
+
+    def __call__(self, process_record):
+        self._logger.log(self._level,
+                         '%s exited %s after %.3fs (spawn %.3fs, user %ss, sys %ss, '
+                         'max rss %skB, out %sB, err %sB)',
+                         ' '.join(process_record.argv), process_record.returncode,
+                         process_record.wall_time, process_record.spawn_latency,
+                         process_record.user_time, process_record.system_time,
+                         process_record.max_rss, process_record.stdout_bytes,
+                         process_record.stderr_bytes)
+
+@attr.s
+class _Summary(object):
+
+    """
+    Aggregated records of one program.
+    """
+
+    counts = attr.ib()
+    calls = attr.ib(default=0)
+    failures = attr.ib(default=0)
+    wall_time = attr.ib(default=0.0)
+    cpu_time = attr.ib(default=0.0)
+    max_rss = attr.ib(default=0)
+
+@attr.s
+class Histogram(object):
+
+    """
+    Hook aggregating records in memory, per program.
+
+    Wall times are counted in buckets: the count at index :code:`i` is of
+    processes which took at most :code:`buckets[i]` seconds
+    (and more than the previous bucket); the last count is of the slower ones.
+
+    :param buckets: sorted upper bounds of the wall time buckets, in seconds
+    """
+
+    _buckets = attr.ib(default=DEFAULT_BUCKETS, convert=tuple)
+
+    _summaries = attr.ib(init=False, default=attr.Factory(dict))
+
+    _lock = attr.ib(init=False, default=attr.Factory(threading.Lock), repr=False)
+
+    def __call__(self, process_record):
+        program = os.path.basename(process_record.argv[0]) if process_record.argv else ''
+        with self._lock:
+            summary = self._summaries.get(program)
+            if summary is None:
+                summary = self._summaries[program] = _Summary(
+                    counts=[0] * (len(self._buckets) + 1))
+            summary.counts[bisect.bisect_left(self._buckets, process_record.wall_time)] += 1
+            summary.calls += 1
+            summary.failures += process_record.returncode != 0
+            summary.wall_time += process_record.wall_time
+            summary.cpu_time += ((process_record.user_time or 0) +
+                                 (process_record.system_time or 0))
+            summary.max_rss = max(summary.max_rss, process_record.max_rss or 0)
+
+    def summary(self):
+        """
+        Get the aggregated records.
+
+        :returns: ordered dictionary mapping program names (most total wall time first)
+                  to dictionaries with :code:`calls`, :code:`failures`, :code:`wall_time`,
+                  :code:`cpu_time`, :code:`max_rss` and the bucket :code:`counts`
+        """
+        with self._lock:
+            ordered = sorted(self._summaries.items(), key=lambda item: -item[1].wall_time)
+            return collections.OrderedDict((program, attr.asdict(summary))
+                                           for program, summary in ordered)
@@ -0,0 +1,293 @@
+# Copyright (c) Shopkick 2017
+# See LICENSE for details.
+"""
+Launch
+------
+
+Starting processes.
+
+A :code:`Shell` hands the actual starting of processes to a launcher.
+The default launcher uses :code:`subprocess.Popen`.
+:code:`SpawnLauncher` uses :code:`os.posix_spawn` when the requested options
+allow it, which avoids copying the page tables of a large parent process.
+
+Every process returned by a launcher has a :code:`launched_by` attribute,
+naming the path that started it.
+"""
+import collections
+import errno
+import os
+import signal
+import subprocess
+import time
+
+import attr
+
+from seashore import capture
+
+@attr.s
+class PopenLauncher(object):
+
+    """
+    Start processes with :code:`subprocess.Popen`.
+    """
+
+    counts = attr.ib(init=False, default=attr.Factory(collections.Counter))
+
+    def launch(self, command, **kwargs):
+        """
+        Start a process.
+
+        :param command: list of arguments
+        :param kwargs: keyword arguments passed to :code:`subprocess.Popen`
+        :returns: a :code:`subprocess.Popen`
+        """
+        proc = subprocess.Popen(command, **kwargs)
+        proc.launched_by = 'popen'
+        self.counts['popen'] += 1
+        return proc
+
+def returncode(status):
+    """
+    The return code of a process, as :code:`subprocess` reports it.
+
+    :param status: exit status, as returned by :code:`os.waitpid`
+    :returns: exit code, or the negated number of the signal that killed the process
+    """
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+
+@attr.s
+class SpawnedProcess(object):
+
+    """
+    A process started by :code:`os.posix_spawn`.
+
+    Supports the parts of the :code:`subprocess.Popen` interface
+    that :code:`Shell` uses.
+    """
+
+    args = attr.ib()
+    pid = attr.ib()
+    stdin = attr.ib(default=None)
+    stdout = attr.ib(default=None)
+    stderr = attr.ib(default=None)
+    returncode = attr.ib(init=False, default=None)
+    launched_by = attr.ib(init=False, default='posix_spawn')
+
+    def _waitpid(self, options):
+        if self.returncode is not None:
+            return self.returncode
+        try:
+            pid, status = os.waitpid(self.pid, options)
+        except OSError as exc: # pragma: no cover
+            if exc.errno != errno.ECHILD:
+                raise
+            # Somebody else reaped the process, and we can't know how it ended
+            pid, status = self.pid, 0
+        if pid == self.pid:
+            self.returncode = returncode(status)
+        return self.returncode
+
+    def wait4(self):
+        """
+        Wait for the process to end, collecting its resource usage.
+
+        :returns: pair of return code, resource usage
+                  (:code:`None` if the process was already waited for)
+        """
+        if self.returncode is not None:
+            return self.returncode, None
+        _pid, status, rusage = os.wait4(self.pid, 0)
+        self.returncode = returncode(status)
+        return self.returncode, rusage
+
+    def poll(self):
+        """
+        Check whether the process has ended.
+
+        :returns: the return code, or :code:`None` if still running
+        """
+        return self._waitpid(os.WNOHANG)
+
+    def wait(self, timeout=None):
+        """
+        Wait for the process to end.
+
+        :param timeout: seconds to wait
+        :returns: the return code
+        :raises: :code:`subprocess.TimeoutExpired` if the timeout passes first
+        """
+        if timeout is None:
+            return self._waitpid(0)
+        deadline = time.time() + timeout
+        delay = 0.0005
+        while self.poll() is None:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                raise subprocess.TimeoutExpired(self.args, timeout)
+            time.sleep(min(delay, remaining))
+            delay = min(delay * 2, 0.05)
+        return self.returncode
+
+    def send_signal(self, signum):
+        """
+        Send a signal to the process, if it is still running.
+
+        :param signum: signal number
+        """
+        if self.poll() is None:
+            os.kill(self.pid, signum)
+
+    def terminate(self):
+        """Send :code:`SIGTERM`"""
+        self.send_signal(signal.SIGTERM)
+
+    def kill(self):
+        """Send :code:`SIGKILL`"""
+        self.send_signal(signal.SIGKILL)
+
+    def communicate(self, input=None): # pylint: disable=redefined-builtin
+        """
+        Send input, read output until the end, and wait for the process.
+
+        :param input: bytes to send to standard input
+        :returns: pair of standard output, standard error
+        """
+        if self.stdin is not None:
+            if input:
+                self.stdin.write(input)
+            self.stdin.close()
+        streams = dict((name, stream)
+                       for name, stream in (('stdout', self.stdout), ('stderr', self.stderr))
+                       if stream is not None)
+        contents = capture.collect(streams)
+        self.wait()
+        return contents.get('stdout'), contents.get('stderr')
+
+_STREAMS = (('stdin', 0, 'wb'), ('stdout', 1, 'rb'), ('stderr', 2, 'rb'))
+
+_SPAWNABLE = frozenset(['stdin', 'stdout', 'stderr', 'cwd', 'env', 'start_new_session',
+                        'process_group'])
+
+def child_streams(kwargs, parent_ends, to_close):
+    """
+    Make the child's ends of the standard streams asked for.
+
+    :param kwargs: keyword arguments, as for :code:`subprocess.Popen`
+    :param parent_ends: dictionary to add our ends of pipes to, by stream name
+    :param to_close: list to add descriptors to close once the child has started to
+    :returns: list of pairs of the child's descriptor, and ours to give it
+    """
+    ret = []
+    for name, child_fd, mode in _STREAMS:
+        value = kwargs.get(name)
+        if value is None:
+            continue
+        if value == subprocess.PIPE:
+            read_fd, write_fd = os.pipe()
+            child_end, parent_end = ((read_fd, write_fd) if mode == 'wb'
+                                     else (write_fd, read_fd))
+            to_close.append(child_end)
+            parent_ends[name] = os.fdopen(parent_end, mode)
+        elif value == subprocess.DEVNULL:
+            child_end = os.open(os.devnull, os.O_RDWR)
+            to_close.append(child_end)
+        elif value == subprocess.STDOUT:
+            child_end = dict(ret).get(1, 1)
+        elif isinstance(value, int):
+            child_end = value
+        else:
+            child_end = value.fileno()
+        ret.append((child_fd, child_end))
+    return ret
+
+def resolve(name, env):
+    """
+    Find an executable, as :code:`execvpe` would.
+
+    :param name: name of the executable, or path to it
+    :param env: environment variables dictionary, whose :code:`PATH` is searched
+    :returns: path to the executable
+    :raises: :code:`OSError` if it is not found
+    """
+    name = os.fsdecode(name)
+    if os.sep in name:
+        return name
+    for directory in os.get_exec_path(env):
+        path = os.path.join(directory, name)
+        if os.path.isfile(path) and os.access(path, os.X_OK):
+            return path
+    raise OSError(errno.ENOENT, os.strerror(errno.ENOENT), name)
+
+def _can_spawn(kwargs):
+    if not hasattr(os, 'posix_spawn'):
+        return False # pragma: no cover
+    if not _SPAWNABLE.issuperset(kwargs):
+        return False
+    if kwargs.get('stdin') == subprocess.STDOUT:
+        return False
+    cwd = kwargs.get('cwd')
+    return cwd is None or os.path.normpath(cwd) == os.getcwd()
+
+@attr.s
+class SpawnLauncher(object):
+
+    """
+    Start processes with :code:`os.posix_spawn` where possible.
+
+    :code:`posix_spawn` is used when only standard streams, environment,
+    a new session or process group, and a working directory equal to ours
+    are requested.
+    Anything else (other :code:`subprocess.Popen` options, a different
+    working directory, or a platform without :code:`posix_spawn`) falls back
+    to another launcher.
+
+    Unlike :code:`subprocess.Popen`, file descriptors are not explicitly closed
+    in the child. Python creates them non-inheritable, so only descriptors
+    explicitly made inheritable leak into children.
+
+    :param fallback: launcher for everything else (default is a :code:`PopenLauncher`)
+    """
+
+    _fallback = attr.ib(default=attr.Factory(PopenLauncher))
+
+    counts = attr.ib(init=False, default=attr.Factory(collections.Counter))
+
+    def launch(self, command, **kwargs):
+        """
+        Start a process.
+
+        :param command: list of arguments
+        :param kwargs: keyword arguments, as for :code:`subprocess.Popen`
+        :returns: a :code:`SpawnedProcess`, or whatever the fallback launcher returns
+        """
+        if not _can_spawn(kwargs):
+            proc = self._fallback.launch(command, **kwargs)
+            self.counts[proc.launched_by] += 1
+            return proc
+        env = kwargs.get('env')
+        if env is None:
+            env = os.environ
+        parent_ends = {}
+        to_close = []
+        try:
+            file_actions = [(os.POSIX_SPAWN_DUP2, child_end, child_fd) for child_fd, child_end
+                            in child_streams(kwargs, parent_ends, to_close)]
+            spawn_kwargs = {}
+            if kwargs.get('start_new_session'):
+                spawn_kwargs['setsid'] = True
+            if kwargs.get('process_group') is not None:
+                spawn_kwargs['setpgroup'] = kwargs['process_group']
+            pid = os.posix_spawn(resolve(command[0], env), command, env,
+                                 file_actions=file_actions, **spawn_kwargs)
+        except BaseException:
+            for stream in parent_ends.values():
+                stream.close()
+            raise
+        finally:
+            for descriptor in to_close:
+                os.close(descriptor)
+        self.counts['posix_spawn'] += 1
+        return SpawnedProcess(args=command, pid=pid, **parent_ends)
@@ -0,0 +1,165 @@
+# Copyright (c) Shopkick 2017
+# See LICENSE for details.
+"""
+Machines
+--------
+
+Cache the environments of Docker machines.
+
+Finding out a Docker machine's environment means running
+:code:`docker-machine env`, which is slow.
+The parsed environments are cached per machine name, for a limited time.
+Concurrent lookups of the same machine share one run of :code:`docker-machine`.
+Optionally, the cache is also kept in a file, so that short-lived processes
+can share it. Failing to write the file does not fail a lookup.
+
+:const:`DEFAULT_TTL` -- seconds a cached environment stays valid
+:const:`ENVIRONMENTS` -- the process-wide cache used by default
+"""
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+import attr
+
+from seashore import capture
+
+DEFAULT_TTL = 300
+
+_LOGGER = logging.getLogger(__name__)
+
+@attr.s
+class _InFlight(object):
+
+    """
+    A lookup in progress, which other threads can wait for.
+    """
+
+    event = attr.ib(default=attr.Factory(threading.Event))
+    result = attr.ib(default=None)
+    error = attr.ib(default=None)
+
+@attr.s
+class MachineEnvironments(object):
+
+    """
+    Cache of Docker machine environments.
+
+    :param ttl: seconds a cached environment stays valid
+    :param path: optional file in which to also keep the cache
+    :param clock: function returning the current time (default is a monotonic
+                  clock, so that setting the time of day does not affect expiry)
+    :param wall_clock: function returning the time of day, which entries in the
+                       file are timed with, since they are shared between processes
+    """
+
+    _ttl = attr.ib(default=DEFAULT_TTL)
+    _path = attr.ib(default=None)
+    _clock = attr.ib(default=capture.clock, repr=False)
+    _wall_clock = attr.ib(default=time.time, repr=False)
+
+    _entries = attr.ib(init=False, default=attr.Factory(dict), repr=False)
+    _in_flight = attr.ib(init=False, default=attr.Factory(dict), repr=False)
+    _lock = attr.ib(init=False, default=attr.Factory(threading.Lock), repr=False)
+
+    def _fresh(self, entry, clock):
+        return entry is not None and 0 <= clock() - entry['time'] < self._ttl
+
+    def _read_file(self):
+        try:
+            with open(self._path) as cache_file:
+                return json.load(cache_file)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def _write_file(self, machine, entry):
+        entries = self._read_file()
+        if entry is None:
+            entries.pop(machine, None)
+        else:
+            entries[machine] = entry
+        directory = os.path.dirname(os.path.abspath(self._path))
+        descriptor, temp_path = tempfile.mkstemp(dir=directory, prefix='.machines')
+        with os.fdopen(descriptor, 'w') as temp_file:
+            json.dump(entries, temp_file)
+        os.rename(temp_path, self._path)
+
+    def _cached(self, machine):
+        entry = self._entries.get(machine)
+        if self._fresh(entry, self._clock):
+            return entry['env']
+        if self._path is None:
+            return None
+        entry = self._read_file().get(machine)
+        if not self._fresh(entry, self._wall_clock):
+            return None
+        age = self._wall_clock() - entry['time']
+        self._entries[machine] = dict(time=self._clock() - age, env=entry['env'])
+        return entry['env']
+
+    def get(self, machine, load):
+        """
+        Get the environment of a machine.
+
+        :param machine: name of the machine
+        :param load: function returning the machine's environment as a dictionary,
+                     called if there is no valid cached one
+        :returns: dictionary of environment variables
+        """
+        with self._lock:
+            env = self._cached(machine)
+            if env is not None:
+                return dict(env)
+            in_flight = self._in_flight.get(machine)
+            owner = in_flight is None
+            if owner:
+                in_flight = self._in_flight[machine] = _InFlight()
+        if not owner:
+            in_flight.event.wait()
+            if in_flight.result is None:
+                raise in_flight.error or RuntimeError('lookup interrupted', machine)
+            return dict(in_flight.result)
+        try:
+            in_flight.result = load()
+        except Exception as exc:
+            in_flight.error = exc
+            raise
+        finally:
+            try:
+                with self._lock:
+                    del self._in_flight[machine]
+                    if in_flight.result is not None:
+                        self._entries[machine] = dict(time=self._clock(), env=in_flight.result)
+                        if self._path is not None:
+                            self._try_write_file(machine, in_flight.result)
+            finally:
+                in_flight.event.set()
+        return dict(in_flight.result)
+
+    def _try_write_file(self, machine, env):
+        try:
+            self._write_file(machine, dict(time=self._wall_clock(), env=env))
+        except Exception: # pylint: disable=broad-except
+            _LOGGER.warning('could not write machine environments to %s', self._path,
+                            exc_info=True)
+
+    def invalidate(self, machine=None):
+        """
+        Forget cached environments.
+
+        :param machine: name of machine to forget (default is to forget all of them)
+        """
+        with self._lock:
+            if machine is None:
+                self._entries.clear()
+                if self._path is not None and os.path.exists(self._path):
+                    os.remove(self._path)
+                return
+            self._entries.pop(machine, None)
+            if self._path is not None:
+                self._write_file(machine, None)
+
+ENVIRONMENTS = MachineEnvironments()
@@ -0,0 +1,82 @@
+# Copyright (c) Shopkick 2017
+# See LICENSE for details.
+"""
+Parsers
+-------
+
+Incremental parsers for the output of subprocesses, for :code:`Shell.parse`.
+
+A parser is a callable taking an iterator of bytes chunks, as they are read,
+and returning an iterable of parsed objects. Records are split out of the
+chunks as they arrive, so memory use is bounded by the longest record,
+not by the whole output.
+"""
+import json
+
+from seashore import capture
+
+def split(separator):
+    """
+    Parser splitting the output into records ending with a separator.
+
+    The separator is not included in the records.
+    A last record with no separator after it is still returned.
+
+    :param separator: bytes ending each record
+    :returns: parser yielding bytes records
+    """
+    if not separator:
+        raise ValueError('empty separator')
+    def _parse(chunks):
+        pending = bytearray()
+        for chunk in chunks:
+            pending.extend(chunk)
+            start = 0
+            end = pending.find(separator)
+            while end != -1:
+                yield bytes(pending[start:end])
+                start = end + len(separator)
+                end = pending.find(separator, start)
+            del pending[:start]
+        if pending:
+            yield bytes(pending)
+    return _parse
+
+def nul_records(chunks):
+    """
+    Parse NUL-terminated records, as printed by :code:`git status -z`
+    or :code:`find -print0`.
+
+    :param chunks: iterator of bytes
+    :returns: iterator of bytes records
+    """
+    return split(b'\0')(chunks)
+
+def lines(encoding='utf-8'):
+    """
+    Parser splitting the output into lines.
+
+    :param encoding: encoding to decode lines with, or :code:`None` to keep bytes
+    :returns: parser yielding lines, without their line endings
+    """
+    def _parse(chunks):
+        for line in capture.iter_lines(chunks):
+            line = line.rstrip(b'\r\n')
+            yield line if encoding is None else line.decode(encoding)
+    return _parse
+
+def json_lines(chunks, encoding='utf-8'):
+    """
+    Parse one JSON document per line, as printed by :code:`docker ps --format '{{json .}}'`.
+
+    Blank lines are skipped.
+
+    :param chunks: iterator of bytes
+    :param encoding: encoding of the documents
+    :returns: iterator of parsed documents
+    :raises: :code:`ValueError` on a line that is not valid JSON
+    """
+    for line in capture.iter_lines(chunks):
+        line = line.strip()
+        if line:
+            yield json.loads(line.decode(encoding))
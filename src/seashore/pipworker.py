@@ -0,0 +1,275 @@
+# Copyright (c) Shopkick 2017
+# See LICENSE for details.
+"""
+Pip workers
+-----------
+
+Keep a warm Python process per interpreter, which runs pip in-process.
+
+Starting Python and importing pip dominates the time of small
+:code:`pip install` runs. A worker is started once per interpreter
+(that is, per virtual environment and :code:`PATH`), and is sent each pip
+command line, with its environment and working directory, over a pipe.
+
+The worker is started with :code:`python -c`, so seashore does not need to be
+installed in the target environment. If the worker dies or cannot run a
+command, :code:`WorkerUnavailable` is raised, and callers should fall back to
+running pip as a subprocess.
+
+Workers are started on the shell of the first command that needs them, so
+that shell's :code:`reap_all` stops them; :code:`PipWorkerPool.close` stops
+them all. Since pip's modules stay imported between commands, the worker
+re-reads the installed distributions before each one, but a command which
+changes pip itself retires its worker.
+"""
+import base64
+import json
+import struct
+import subprocess
+import threading
+
+import attr
+
+from seashore.shell import ProcessError
+
+WORKER_SOURCE = r'''
+import base64, importlib, json, os, struct, sys, tempfile, traceback
+
+def pip_main(argv):
+    try:
+        from pip._internal.cli.main import main
+    except ImportError:
+        try:
+            from pip._internal import main
+        except ImportError:
+            from pip import main
+    return main(argv)
+
+def refresh():
+    # Installs by earlier commands change what is on sys.path
+    if hasattr(importlib, 'invalidate_caches'):
+        importlib.invalidate_caches()
+    for name in ('pip._vendor.pkg_resources', 'pkg_resources'):
+        module = sys.modules.get(name)
+        if module is not None and hasattr(module, '_initialize_master_working_set'):
+            module._initialize_master_working_set()
+
+def run(request):
+    refresh()
+    saved_env = dict(os.environ)
+    saved_cwd = os.getcwd()
+    out, err = tempfile.TemporaryFile(), tempfile.TemporaryFile()
+    sys.stdout.flush()
+    sys.stderr.flush()
+    saved_fds = os.dup(1), os.dup(2)
+    os.dup2(out.fileno(), 1)
+    os.dup2(err.fileno(), 2)
+    crashed = False
+    try:
+        os.environ.clear()
+        os.environ.update(request['env'])
+        os.chdir(request['cwd'])
+        try:
+            code = pip_main(request['argv'])
+        except SystemExit as exc:
+            code = exc.code
+        except Exception:
+            traceback.print_exc()
+            crashed = True
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os.dup2(saved_fds[0], 1)
+        os.dup2(saved_fds[1], 2)
+        for fd in saved_fds:
+            os.close(fd)
+        os.environ.clear()
+        os.environ.update(saved_env)
+        os.chdir(saved_cwd)
+    if crashed:
+        return dict(crashed=True)
+    if code is None:
+        code = 0
+    elif not isinstance(code, int):
+        err.write(str(code).encode('utf-8'))
+        code = 1
+    out.seek(0)
+    err.seek(0)
+    return dict(returncode=code,
+                stdout=base64.b64encode(out.read()).decode('ascii'),
+                stderr=base64.b64encode(err.read()).decode('ascii'))
+
+def main():
+    proto_in = os.fdopen(os.dup(0), 'rb')
+    proto_out = os.fdopen(os.dup(1), 'wb')
+    devnull = os.open(os.devnull, os.O_RDWR)
+    os.dup2(devnull, 0)
+    os.dup2(devnull, 1)
+    while True:
+        header = proto_in.read(4)
+        if len(header) < 4:
+            return
+        size, = struct.unpack('>I', header)
+        response = run(json.loads(proto_in.read(size).decode('utf-8')))
+        data = json.dumps(response).encode('utf-8')
+        proto_out.write(struct.pack('>I', len(data)) + data)
+        proto_out.flush()
+
+main()
+'''
+
+class WorkerUnavailable(Exception):
+
+    """
+    The worker could not run the command; run it as a subprocess instead.
+    """
+
+def _read_exactly(stream, size):
+    data = stream.read(size)
+    if len(data) != size:
+        raise WorkerUnavailable('worker closed its pipe')
+    return data
+
+def touches_pip(argv):
+    """
+    Whether a pip command line installs or removes pip itself.
+
+    :param argv: list of arguments, starting with :code:`pip`
+    :returns: bool
+    """
+    return any(arg == 'pip' or arg.startswith(('pip=', 'pip<', 'pip>', 'pip[', 'pip~', 'pip!'))
+               for arg in argv[2:])
+
+@attr.s
+class _Worker(object):
+
+    """
+    A running worker process.
+    """
+
+    _proc = attr.ib()
+
+    _lock = attr.ib(init=False, default=attr.Factory(threading.Lock))
+
+    @property
+    def pid(self):
+        """The worker's process id"""
+        return self._proc.pid
+
+    def request(self, argv, env, cwd):
+        """
+        Run pip in the worker.
+
+        :param argv: pip arguments (not including :code:`pip` itself)
+        :param env: environment variables dictionary
+        :param cwd: working directory
+        :returns: tuple of return code, standard output, standard error
+        :raises: :code:`WorkerUnavailable` if the worker could not run the command
+        """
+        data = json.dumps(dict(argv=list(argv), env=dict(env), cwd=cwd)).encode('utf-8')
+        with self._lock:
+            try:
+                self._proc.stdin.write(struct.pack('>I', len(data)) + data)
+                self._proc.stdin.flush()
+                size, = struct.unpack('>I', _read_exactly(self._proc.stdout, 4))
+                response = json.loads(_read_exactly(self._proc.stdout, size).decode('utf-8'))
+            except (IOError, OSError, ValueError) as exc:
+                raise WorkerUnavailable(exc)
+        if response.get('crashed'):
+            raise WorkerUnavailable('pip crashed in the worker')
+        return (response['returncode'], base64.b64decode(response['stdout']),
+                base64.b64decode(response['stderr']))
+
+    def close(self):
+        """Ask the worker to exit, and wait for it"""
+        self._proc.stdin.close()
+        self._proc.stdout.close()
+        self._proc.wait()
+
+def _key(shell):
+    def _get(name):
+        try:
+            return shell.getenv(name)
+        except KeyError:
+            return None
+    return _get('VIRTUAL_ENV'), _get('PATH')
+
+@attr.s
+class PipWorkerPool(object):
+
+    """
+    Warm pip workers, one per interpreter.
+
+    Workers are keyed by the :code:`VIRTUAL_ENV` and :code:`PATH` of the shell
+    asking, so the :code:`python` they run is the one that would run :code:`pip`.
+    A command that installs or removes pip itself retires its worker.
+
+    :param python: name of the Python executable to start workers with
+    """
+
+    _python = attr.ib(default='python')
+
+    _workers = attr.ib(init=False, default=attr.Factory(dict))
+
+    _lock = attr.ib(init=False, default=attr.Factory(threading.Lock))
+
+    def _get_worker(self, shell, key):
+        with self._lock:
+            worker = self._workers.get(key)
+            if worker is None:
+                try:
+                    proc = shell.popen([self._python, '-c', WORKER_SOURCE],
+                                       stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+                except OSError as exc:
+                    raise WorkerUnavailable(exc)
+                worker = self._workers[key] = _Worker(proc)
+            return worker
+
+    def _retire(self, key, worker):
+        with self._lock:
+            if self._workers.get(key) is worker:
+                del self._workers[key]
+        try:
+            worker.close()
+        except (IOError, OSError): # pragma: no cover
+            pass
+
+    def batch(self, shell, command):
+        """
+        Run a pip command line in a worker, like :code:`Shell.batch`.
+
+        :param shell: the shell whose environment and working directory to use
+        :param command: list of arguments, starting with :code:`pip`
+        :returns: pair of standard output, standard error
+        :raises: :code:`ProcessError` if pip fails,
+                 :code:`WorkerUnavailable` if the worker cannot run it
+        """
+        key = _key(shell)
+        worker = self._get_worker(shell, key)
+        try:
+            retcode, output, error = worker.request(command[1:], shell.environ(),
+                                                    shell.getcwd())
+        except WorkerUnavailable:
+            self._retire(key, worker)
+            raise
+        if touches_pip(command):
+            self._retire(key, worker)
+        if retcode != 0:
+            raise ProcessError(retcode, output, error)
+        return output, error
+
+    def pids(self):
+        """
+        Process ids of the running workers.
+
+        :returns: list of process ids
+        """
+        with self._lock:
+            return [worker.pid for worker in self._workers.values()]
+
+    def close(self):
+        """Stop all workers"""
+        with self._lock:
+            workers = list(self._workers.items())
+        for key, worker in workers:
+            self._retire(key, worker)
@@ -0,0 +1,268 @@
+# Copyright (c) Shopkick 2017
+# See LICENSE for details.
+"""
+Plan
+----
+
+Run steps which depend on each other, with independent ones running at once.
+
+A :code:`Plan` is built step by step: each step has a name, something to run
+(a prepared command, whose :code:`batch` is run, or a function taking no
+arguments, such as a :code:`functools.partial` of :code:`Executor.pip_install`),
+and the names of the steps it runs after. Steps can only run after steps
+which were added before them, so a plan never has cycles.
+
+Running a plan runs every step whose dependencies have succeeded, up to
+a concurrency limit. A failed step does not stop the others, but steps which
+depend on it, directly or not, are skipped. The :code:`PlanReport` has
+the timings of each step, and the critical path: the chain of steps
+which the plan's run time was spent waiting on.
+"""
+import collections
+import threading
+
+import attr
+
+from seashore import capture, fanout
+
+@attr.s(frozen=True)
+class StepResult(object):
+
+    """
+    The result of a step.
+
+    :param name: name of the step
+    :param value: what the step returned (for a command, the pair of
+                  standard output, standard error)
+    :param exception: the exception, if the step failed
+    :param started: :code:`capture.clock()` when the step started
+    :param finished: :code:`capture.clock()` when the step finished
+    :param skipped_after: name of the failed step because of which
+                          this one was skipped, if it was
+    """
+
+    name = attr.ib()
+    value = attr.ib(default=None, repr=False)
+    exception = attr.ib(default=None)
+    started = attr.ib(default=None)
+    finished = attr.ib(default=None)
+    skipped_after = attr.ib(default=None)
+
+    @property
+    def succeeded(self):
+        """Whether the step ran, and succeeded"""
+        return self.exception is None and self.skipped_after is None
+
+    @property
+    def duration(self):
+        """Seconds the step ran for (0 if it was skipped)"""
+        if self.started is None:
+            return 0
+        return self.finished - self.started
+
+@attr.s(frozen=True)
+class PlanReport(object):
+
+    """
+    What happened when running a plan.
+
+    :param results: ordered dictionary of step names to :code:`StepResult`,
+                    in the order steps were added
+    :param elapsed: seconds the plan ran for
+    :param critical_path: list of names of the steps, each of which the next
+                          one waited for, ending with the last step to finish
+    """
+
+    results = attr.ib()
+    elapsed = attr.ib()
+    critical_path = attr.ib()
+
+    @property
+    def succeeded(self):
+        """Whether every step succeeded"""
+        return all(result.succeeded for result in self.results.values())
+
+    def failed(self):
+        """
+        Steps which ran and failed.
+
+        :returns: list of :code:`StepResult`
+        """
+        return [result for result in self.results.values() if result.exception is not None]
+
+    def skipped(self):
+        """
+        Steps which were not run, because a step they depend on failed.
+
+        :returns: list of :code:`StepResult`
+        """
+        return [result for result in self.results.values() if result.skipped_after is not None]
+
+    def raise_for_failure(self):
+        """
+        Raise the exception of the first step which failed, if any.
+        """
+        failed = self.failed()
+        if failed:
+            raise failed[0].exception
+
+def _critical_path(steps, results):
+    ran = [result for result in results.values() if result.started is not None]
+    if not ran:
+        return []
+    last = max(ran, key=lambda result: result.finished)
+    ret = [last.name]
+    while True:
+        before = [results[name] for name in steps[ret[0]].after]
+        if not before:
+            break
+        ret.insert(0, max(before, key=lambda result: result.finished).name)
+    return ret
+
+@attr.s(frozen=True)
+class _Step(object):
+
+    """
+    A step, as added to a plan.
+    """
+
+    name = attr.ib()
+    action = attr.ib()
+    after = attr.ib(convert=tuple)
+
+def _perform(action):
+    """Run a step's action (a prepared command's batch, or a callable), returning what it returns"""
+    if hasattr(action, 'batch'):
+        return action.batch()
+    return action()
+
+@attr.s
+class _Run(object):
+
+    """
+    The state of one run of a plan, shared by its worker threads.
+    """
+
+    _steps = attr.ib()
+    _dependents = attr.ib()
+
+    results = attr.ib(init=False, default=attr.Factory(dict))
+    _waiting_on = attr.ib(init=False, default=attr.Factory(dict))
+    _ready = attr.ib(init=False, default=attr.Factory(collections.deque))
+    _running = attr.ib(init=False, default=0)
+    _changed = attr.ib(init=False, default=attr.Factory(threading.Condition))
+
+    def __attrs_post_init__(self):
+        for step in self._steps.values():
+            self._waiting_on[step.name] = len(step.after)
+            if not step.after:
+                self._ready.append(step)
+
+    def _next(self):
+        """The next step to run, or :code:`None` once there are none left"""
+        with self._changed:
+            while not self._ready:
+                if self._running == 0:
+                    return None
+                self._changed.wait()
+            self._running += 1
+            return self._ready.popleft()
+
+    def _skip(self, name, failed):
+        for dependent in self._dependents[name]:
+            if dependent not in self.results:
+                self.results[dependent] = StepResult(name=dependent, skipped_after=failed)
+                self._skip(dependent, failed)
+
+    def _done(self, result):
+        with self._changed:
+            self._running -= 1
+            self.results[result.name] = result
+            if result.succeeded:
+                for dependent in self._dependents[result.name]:
+                    self._waiting_on[dependent] -= 1
+                    if self._waiting_on[dependent] == 0 and dependent not in self.results:
+                        self._ready.append(self._steps[dependent])
+            else:
+                self._skip(result.name, result.name)
+            self._changed.notify_all()
+
+    def work(self):
+        """Run steps until there are none left"""
+        while True:
+            step = self._next()
+            if step is None:
+                return
+            started = capture.clock()
+            try:
+                value = _perform(step.action)
+            except Exception as exc: # pylint: disable=broad-except
+                result = StepResult(name=step.name, exception=exc, started=started,
+                                    finished=capture.clock())
+            else:
+                result = StepResult(name=step.name, value=value, started=started,
+                                    finished=capture.clock())
+            self._done(result)
+
+@attr.s
+class Plan(object):
+
+    """
+    Steps, and the steps they run after.
+
+    :param executor: executor to prepare steps given as argument lists with
+    :param concurrency: maximum number of steps running at once
+    """
+
+    _executor = attr.ib(default=None, repr=False)
+    concurrency = attr.ib(default=fanout.DEFAULT_CONCURRENCY)
+
+    _steps = attr.ib(init=False, default=attr.Factory(collections.OrderedDict))
+
+    def add(self, name, action, after=()):
+        """
+        Add a step.
+
+        :param name: name of the step
+        :param action: a prepared command, an argument list (if the plan has
+                       an executor), or a function taking no arguments
+        :param after: names of steps to run this one after
+        :returns: the name, so that it can be passed to later steps' :code:`after`
+        :raises: :code:`ValueError` if the name is taken, or a step to run
+                 after has not been added
+        """
+        if name in self._steps:
+            raise ValueError('duplicate step', name)
+        for before in after:
+            if before not in self._steps:
+                raise ValueError('unknown step', before)
+        if isinstance(action, (list, tuple)):
+            if self._executor is None:
+                raise ValueError('argument lists need a plan with an executor', name)
+            action = self._executor.command(action)
+        self._steps[name] = _Step(name=name, action=action, after=after)
+        return name
+
+    def run(self):
+        """
+        Run the steps.
+
+        :returns: :code:`PlanReport`
+        """
+        dependents = dict((name, []) for name in self._steps)
+        for step in self._steps.values():
+            for before in step.after:
+                dependents[before].append(step.name)
+        state = _Run(self._steps, dependents)
+        started = capture.clock()
+        threads = []
+        for _ in range(min(self.concurrency, len(self._steps))):
+            thread = threading.Thread(target=state.work)
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+        results = collections.OrderedDict((name, state.results[name]) for name in self._steps)
+        return PlanReport(results=results, elapsed=capture.clock() - started,
+                          critical_path=_critical_path(self._steps, results))
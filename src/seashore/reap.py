@@ -0,0 +1,217 @@
+# Copyright (c) Shopkick 2017
+# See LICENSE for details.
+"""
+Reap
+----
+
+Stopping processes, as gently as possible.
+
+Every live process gets :code:`SIGINT` at the same time, and they are
+all waited on together until the grace period ends.
+Only the ones still running get :code:`SIGTERM`, and after another grace
+period, :code:`SIGKILL`.
+
+Signals to a process with a :code:`tree` (see :code:`seashore.tree`) go to
+every process in the tree, and whatever is left of the tree once the process
+has stopped is killed.
+
+:const:`DEFAULT_GRACE_PERIODS` -- seconds to wait after :code:`SIGINT` and after :code:`SIGTERM`
+
+:const:`SIGNALS` -- names and numbers of the signals sent, in order
+"""
+import os
+import select
+import signal
+import time
+
+import attr
+
+from seashore import capture, tree
+
+DEFAULT_GRACE_PERIODS = (3, 3)
+
+SIGNALS = (('SIGINT', signal.SIGINT), ('SIGTERM', signal.SIGTERM), ('SIGKILL', signal.SIGKILL))
+
+_MAX_POLL_INTERVAL = 0.05
+
+@attr.s(frozen=True)
+class ReapReport(object):
+
+    """
+    What happened to each process.
+
+    :param stages: dictionary mapping process ids to the stage in which the process
+                   was found to have exited: :code:`'exited'` if it was no longer running,
+                   otherwise the name of the last signal it was sent
+    """
+
+    stages = attr.ib(default=attr.Factory(dict))
+
+    def pids(self, stage):
+        """
+        Processes which exited at a given stage.
+
+        :param stage: :code:`'exited'`, :code:`'SIGINT'`, :code:`'SIGTERM'` or :code:`'SIGKILL'`
+        :returns: sorted list of process ids
+        """
+        return sorted(pid for pid, pid_stage in self.stages.items() if pid_stage == stage)
+
+def _peek(pid):
+    """
+    Check whether a child has exited without reaping it, where :code:`os.waitid` allows.
+
+    :returns: whether it has exited, or :code:`None` if that cannot be told this way
+    """
+    if not hasattr(os, 'waitid'): # pragma: no cover
+        return None
+    try:
+        return os.waitid(os.P_PID, pid, os.WEXITED | os.WNOHANG | os.WNOWAIT) is not None
+    except OSError:
+        return None
+
+def _reaped(pid):
+    """
+    Check whether an asyncio process has exited: its event loop's child watcher
+    may already have reaped it, or the loop may not be running to notice.
+    """
+    try:
+        return os.waitpid(pid, os.WNOHANG)[0] != 0
+    except OSError:
+        return True
+
+def _exited(proc):
+    """
+    Check whether a process has exited, without reaping it if possible,
+    so whoever waits for it can still collect its resource usage.
+    """
+    if proc.returncode is not None:
+        return True
+    if isinstance(proc, tree.ProcessTree):
+        return proc.poll() is not None
+    exited = _peek(proc.pid)
+    if exited is not None:
+        return exited
+    if not hasattr(proc, 'poll'):
+        return _reaped(proc.pid)
+    return proc.poll() is not None
+
+def _pidfd(proc):
+    if isinstance(proc, tree.ProcessTree):
+        return None # Its process is gone, and its process id may be reused
+    try:
+        return os.pidfd_open(proc.pid)
+    except (AttributeError, OSError):
+        return None
+
+def _watch(procs):
+    """
+    Watch the file descriptors of processes which can have one.
+
+    :returns: pair of a poll object (:code:`None` if there is nothing to watch)
+              and the file descriptors, which the caller closes
+    """
+    pidfds = [pidfd for pidfd in (_pidfd(proc) for proc in procs) if pidfd is not None]
+    if not pidfds:
+        return None, pidfds
+    # Process file descriptors only exist on Linux, which always has poll
+    poller = select.poll()
+    for pidfd in pidfds:
+        poller.register(pidfd, select.POLLIN)
+    return poller, pidfds
+
+def wait_all(procs, timeout):
+    """
+    Wait, up to a single deadline, for processes to end.
+
+    Uses process file descriptors where available, and polling otherwise.
+
+    Processes are not reaped, so that whoever waits for them
+    can still collect their resource usage.
+
+    :param procs: list of processes
+    :param timeout: seconds to wait (:code:`None` to wait until they have all ended)
+    :returns: list of processes still running after the timeout
+    """
+    deadline = None if timeout is None else capture.clock() + timeout
+    live = [proc for proc in procs if not _exited(proc)]
+    poller, pidfds = _watch(live)
+    try:
+        polled = len(pidfds) < len(live)
+        watched = len(pidfds)
+        interval = 0.0005
+        while live:
+            remaining = None if deadline is None else deadline - capture.clock()
+            if remaining is not None and remaining <= 0:
+                break
+            if polled:
+                wait_for = interval if remaining is None else min(interval, remaining)
+            else:
+                wait_for = remaining
+            if watched:
+                for pidfd, _events in poller.poll(None if wait_for is None else wait_for * 1000):
+                    poller.unregister(pidfd)
+                    watched -= 1
+                    # Whoever reaps the process may not have noticed yet
+                    polled = True
+            else:
+                time.sleep(wait_for)
+            interval = min(interval * 2, _MAX_POLL_INTERVAL)
+            live = [proc for proc in live if not _exited(proc)]
+    finally:
+        for pidfd in pidfds:
+            os.close(pidfd)
+    return live
+
+def signal_tree(proc, signum):
+    """
+    Send a signal to a process, or to its whole tree if it has one.
+
+    :param proc: the process
+    :param signum: signal number
+    """
+    process_tree = getattr(proc, 'tree', None)
+    if process_tree is not None:
+        process_tree.send_signal(signum)
+    else:
+        proc.send_signal(signum)
+
+def kill_leftovers(procs):
+    """
+    Kill what is left of the trees of processes which have stopped.
+
+    :param procs: iterable of processes
+    """
+    for proc in procs:
+        process_tree = getattr(proc, 'tree', None)
+        if process_tree is not None:
+            process_tree.kill()
+
+def reap(procs, grace_periods=DEFAULT_GRACE_PERIODS):
+    """
+    Kill, as gently as possible, a set of processes.
+
+    :param procs: iterable of processes
+    :param grace_periods: seconds to wait after :code:`SIGINT` and after :code:`SIGTERM`
+    :returns: :code:`ReapReport`
+    """
+    procs = list(procs)
+    stages = {}
+    live = []
+    for proc in procs:
+        if not _exited(proc):
+            live.append(proc)
+        else:
+            stages[proc.pid] = 'exited'
+    for (name, signum), grace in zip(SIGNALS, tuple(grace_periods) + (None,)):
+        if not live:
+            break
+        for proc in live:
+            signal_tree(proc, signum)
+        remaining = wait_all(live, grace)
+        still_running = set(id(proc) for proc in remaining)
+        for proc in live:
+            if id(proc) not in still_running:
+                stages[proc.pid] = name
+        live = remaining
+    kill_leftovers(procs)
+    return ReapReport(stages=stages)
@@ -0,0 +1,509 @@
+# Copyright (c) Shopkick 2017
+# See LICENSE for details.
+"""
+Replay
+------
+
+Record what commands did, and play it back without running them.
+
+A :code:`RecordingShell` wraps a shell, and adds every :code:`batch`,
+:code:`interactive` and :code:`redirect` run (its arguments, working
+directory, a digest of its environment, output and return code) to a
+:code:`Cassette`, which can be saved to a file of JSON lines.
+
+A :code:`ReplayShell` serves those results without starting any process.
+Tests and dry runs of code built on an :code:`Executor` can use one
+instead of a :code:`Shell`.
+
+Matching is strict by default: the arguments, working directory and
+environment digest must all be the same, and each recorded run is served
+once, in the order it was recorded. Lenient matching falls back to
+the arguments alone, and serves the last matching run again once they have
+all been served.
+
+Only the output written to pipes is recorded, so :code:`redirect` and
+:code:`interactive` are replayed with their return code alone.
+Other ways of running processes (:code:`popen`, :code:`stream`,
+and asynchronous runs) are passed through by a :code:`RecordingShell`
+without being recorded.
+"""
+import base64
+import collections
+import io
+import json
+import os
+import threading
+
+import attr
+import six
+
+from seashore.resultcache import _env_digest
+from seashore.shell import ProcessError, ProcessTimeoutError
+
+FORMAT_VERSION = 1
+
+class NoRecording(LookupError):
+
+    """
+    A replay shell was asked to run something that was not recorded.
+    """
+
+@attr.s(frozen=True)
+class Interaction(object):
+
+    """
+    A recorded run.
+
+    :param mode: :code:`'batch'`, :code:`'interactive'` or :code:`'redirect'`
+    :param argv: tuple of arguments
+    :param cwd: working directory
+    :param env: digest of the environment
+    :param returncode: return code
+    :param stdout: standard output (:code:`None` if not captured)
+    :param stderr: standard error (:code:`None` if not captured)
+    :param timeout: the timeout, if the run was stopped because of it
+    """
+
+    mode = attr.ib()
+    argv = attr.ib(convert=tuple)
+    cwd = attr.ib()
+    env = attr.ib()
+    returncode = attr.ib(default=0)
+    stdout = attr.ib(default=None, repr=False)
+    stderr = attr.ib(default=None, repr=False)
+    timeout = attr.ib(default=None)
+
+    def strict_key(self):
+        """Key matched by strict replay"""
+        return (self.mode, self.argv, self.cwd, self.env)
+
+    def lenient_key(self):
+        """Key matched by lenient replay"""
+        return (self.mode, self.argv)
+
+    def play(self):
+        """
+        Do what the recorded run did.
+
+        :returns: pair of standard output, standard error, for batch runs
+        :raises: :code:`ProcessError`, or :code:`ProcessTimeoutError`, as the run did
+        """
+        args = (self.returncode,)
+        if self.stdout is not None or self.stderr is not None:
+            args += (self.stdout, self.stderr)
+        if self.timeout is not None:
+            raise ProcessTimeoutError(*args, timeout=self.timeout)
+        if self.returncode != 0:
+            raise ProcessError(*args)
+        if self.mode == 'batch':
+            return self.stdout, self.stderr
+        return None
+
+def _encode(interaction):
+    ret = dict(mode=interaction.mode, argv=list(interaction.argv), cwd=interaction.cwd,
+               env=interaction.env)
+    if interaction.returncode != 0:
+        ret['returncode'] = interaction.returncode
+    if interaction.timeout is not None:
+        ret['timeout'] = interaction.timeout
+    streams = dict((name, value) for name, value in (('stdout', interaction.stdout),
+                                                     ('stderr', interaction.stderr))
+                   if value is not None)
+    if not streams:
+        return ret
+    if all(isinstance(value, six.text_type) for value in streams.values()):
+        ret['encoding'] = 'text'
+    else:
+        try:
+            streams = dict((name, value.decode('utf-8')) for name, value in streams.items())
+            ret['encoding'] = 'utf-8'
+        except UnicodeDecodeError:
+            streams = dict((name, base64.b64encode(value).decode('ascii'))
+                           for name, value in streams.items())
+            ret['encoding'] = 'base64'
+    ret.update(streams)
+    return ret
+
+def _decode(entry):
+    encoding = entry.get('encoding')
+    streams = {}
+    for name in ('stdout', 'stderr'):
+        value = entry.get(name)
+        if value is None or encoding == 'text':
+            streams[name] = value
+        elif encoding == 'utf-8':
+            streams[name] = value.encode('utf-8')
+        else:
+            streams[name] = base64.b64decode(value.encode('ascii'))
+    return Interaction(mode=entry['mode'], argv=entry['argv'], cwd=entry['cwd'],
+                       env=entry['env'], returncode=entry.get('returncode', 0),
+                       timeout=entry.get('timeout'), **streams)
+
+@attr.s
+class Cassette(object):
+
+    """
+    Recorded runs, in the order they were recorded.
+
+    :param env_keys: names of the environment variables which matter
+                     when matching (default is all of them); recording
+                     only the ones which matter makes a cassette usable
+                     on other machines
+    :param interactions: list of :code:`Interaction`
+    """
+
+    env_keys = attr.ib(default=None)
+    interactions = attr.ib(default=attr.Factory(list))
+
+    _lock = attr.ib(init=False, default=attr.Factory(threading.Lock), repr=False, cmp=False)
+
+    def env_digest(self, env):
+        """
+        Compute the digest of an environment, as recorded.
+
+        :param env: dictionary of environment variables
+        :returns: string
+        """
+        return _env_digest(env, self.env_keys)
+
+    def add(self, interaction):
+        """
+        Add a run.
+
+        :param interaction: :code:`Interaction`
+        """
+        with self._lock:
+            self.interactions.append(interaction)
+
+    def index(self, strict=True):
+        """
+        Index the runs by the key they are matched by.
+
+        :param strict: whether to index by the strict key, or the lenient one
+        :returns: dictionary of keys to lists of runs, in the order recorded
+        """
+        ret = collections.defaultdict(list)
+        with self._lock:
+            interactions = list(self.interactions)
+        for interaction in interactions:
+            key = interaction.strict_key() if strict else interaction.lenient_key()
+            ret[key].append(interaction)
+        return dict(ret)
+
+    def save(self, path):
+        """
+        Save to a file, as one JSON object per line.
+
+        :param path: file name
+        """
+        with self._lock:
+            interactions = list(self.interactions)
+        with io.open(path, 'w', encoding='utf-8') as cassette_file:
+            header = {'seashore-cassette': FORMAT_VERSION, 'env_keys': self.env_keys}
+            for entry in [header] + [_encode(interaction) for interaction in interactions]:
+                cassette_file.write(six.text_type(json.dumps(entry, sort_keys=True,
+                                                             separators=(',', ':'))))
+                cassette_file.write(u'\n')
+
+    @classmethod
+    def load(cls, path):
+        """
+        Load from a file written by :code:`save`.
+
+        :param path: file name
+        :returns: :code:`Cassette`
+        :raises: :code:`ValueError` if the file is not a cassette this version can read
+        """
+        with io.open(path, encoding='utf-8') as cassette_file:
+            entries = [json.loads(line) for line in cassette_file if line.strip()]
+        if not entries or entries[0].get('seashore-cassette') != FORMAT_VERSION:
+            raise ValueError('not a cassette', path)
+        env_keys = entries[0].get('env_keys')
+        return cls(env_keys=env_keys, interactions=[_decode(entry) for entry in entries[1:]])
+
+def _recorded(value):
+    if value is None or isinstance(value, six.text_type):
+        return value
+    return bytes(value)
+
+@attr.s
+class RecordingShell(object):
+
+    """
+    A shell which records what it runs.
+
+    :param shell: the shell which runs things (such as a :code:`Shell`)
+    :param cassette: the :code:`Cassette` to record to (shared with clones)
+    """
+
+    _shell = attr.ib()
+    cassette = attr.ib(default=attr.Factory(Cassette))
+
+    def _record(self, mode, command, cwd, **kwargs):
+        if cwd is None:
+            cwd = self._shell.getcwd()
+        interaction = Interaction(mode=mode, argv=command, cwd=cwd,
+                                  env=self.cassette.env_digest(self._shell.environ()),
+                                  **kwargs)
+        self.cassette.add(interaction)
+
+    def _run(self, mode, run, command, cwd):
+        try:
+            ret = run()
+        except ProcessError as exc:
+            self._record(mode, command, cwd, returncode=exc.returncode,
+                         stdout=_recorded(getattr(exc, 'output', None)),
+                         stderr=_recorded(getattr(exc, 'error', None)),
+                         timeout=getattr(exc, 'timeout', None))
+            raise
+        if ret is None:
+            self._record(mode, command, cwd)
+        else:
+            stdout, stderr = ret
+            self._record(mode, command, cwd, stdout=_recorded(stdout),
+                         stderr=_recorded(stderr))
+        return ret
+
+    def batch(self, command, cwd=None, timeout=None, **kwargs):
+        """
+        Run a process in batch mode, and record it.
+
+        :param command: list of arguments
+        :param cwd: current working directory (default is the shell's)
+        :param timeout: seconds after which to stop the process
+        :param kwargs: passed to the shell's :code:`batch`
+        :returns: pair of standard output, standard error
+        """
+        return self._run('batch', lambda: self._shell.batch(command, cwd=cwd, timeout=timeout,
+                                                            **kwargs),
+                         command, cwd)
+
+    def interactive(self, command, cwd=None, timeout=None):
+        """
+        Run a process in interactive mode, and record its return code.
+
+        :param command: list of arguments
+        :param cwd: current working directory (default is the shell's)
+        :param timeout: seconds after which to stop the process
+        """
+        return self._run('interactive', lambda: self._shell.interactive(command, cwd=cwd,
+                                                                        timeout=timeout),
+                         command, cwd)
+
+    def redirect(self, command, outfp, errfp, cwd=None, timeout=None): # pylint: disable=too-many-arguments
+        """
+        Run a process with its output going to files, and record its return code.
+
+        :param command: list of arguments
+        :param outfp: output file object
+        :param errfp: error file object
+        :param cwd: current working directory (default is the shell's)
+        :param timeout: seconds after which to stop the process
+        """
+        return self._run('redirect', lambda: self._shell.redirect(command, outfp, errfp,
+                                                                  cwd=cwd, timeout=timeout),
+                         command, cwd)
+
+    def popen(self, command, **kwargs):
+        """Start a process, without recording it"""
+        return self._shell.popen(command, **kwargs)
+
+    def stream(self, command, **kwargs):
+        """Stream the output of a process, without recording it"""
+        return self._shell.stream(command, **kwargs)
+
+    def parse(self, command, parser, **kwargs):
+        """Parse the output of a process, without recording it"""
+        return self._shell.parse(command, parser, **kwargs)
+
+    def abatch(self, command, **kwargs):
+        """Run a process asynchronously, without recording it"""
+        return self._shell.abatch(command, **kwargs)
+
+    def ainteractive(self, command, **kwargs):
+        """Run a process interactively and asynchronously, without recording it"""
+        return self._shell.ainteractive(command, **kwargs)
+
+    def reap_all(self):
+        """Reap the wrapped shell's processes"""
+        return self._shell.reap_all()
+
+    def setenv(self, key, val):
+        """Set an environment variable"""
+        self._shell.setenv(key, val)
+
+    def getenv(self, key):
+        """Get an environment variable"""
+        return self._shell.getenv(key)
+
+    def environ(self):
+        """Get the whole environment"""
+        return self._shell.environ()
+
+    def getcwd(self):
+        """Get the working directory"""
+        return self._shell.getcwd()
+
+    def chdir(self, path):
+        """Change the working directory"""
+        self._shell.chdir(path)
+
+    def clone(self):
+        """
+        Clone the shell object.
+
+        :returns: a recording shell wrapping a clone of the shell,
+                  recording to the same cassette
+        """
+        return attr.evolve(self, shell=self._shell.clone())
+
+@attr.s
+class _Playback(object):
+
+    """
+    The indexed runs of a cassette, and how many of each have been served,
+    shared by clones.
+    """
+
+    strict_index = attr.ib()
+    lenient_index = attr.ib()
+    served = attr.ib(default=attr.Factory(collections.Counter))
+    lock = attr.ib(default=attr.Factory(threading.Lock))
+
+    @classmethod
+    def from_cassette(cls, cassette):
+        """Index a cassette"""
+        return cls(strict_index=cassette.index(strict=True),
+                   lenient_index=cassette.index(strict=False))
+
+    def serve(self, key, strict, reuse):
+        """
+        Get the next run for a key.
+
+        :param key: the strict or lenient key of the run
+        :param strict: whether the key is strict
+        :param reuse: whether to serve the last run again once all have been served
+        :returns: :code:`Interaction`, or :code:`None`
+        """
+        interactions = (self.strict_index if strict else self.lenient_index).get(key)
+        if not interactions:
+            return None
+        with self.lock:
+            served = self.served[key]
+            if served < len(interactions):
+                self.served[key] += 1
+                return interactions[served]
+        return interactions[-1] if reuse else None
+
+@attr.s
+class ReplayShell(object):
+
+    """
+    A shell which plays back recorded runs, without starting processes.
+
+    :param cassette: the :code:`Cassette` to play back
+    :param strict: whether to require the working directory and
+                   environment to match, and each run to be served only once
+    :param cwd: working directory (default is the process's)
+    :param env: environment variables dict (default is a copy of the process's)
+    """
+
+    cassette = attr.ib()
+    strict = attr.ib(default=True)
+    _cwd = attr.ib(default=attr.Factory(os.getcwd))
+    _env = attr.ib(default=attr.Factory(lambda: dict(os.environ)), convert=dict)
+
+    _playback = attr.ib(default=None, repr=False, cmp=False)
+
+    def __attrs_post_init__(self):
+        if self._playback is None:
+            self._playback = _Playback.from_cassette(self.cassette)
+
+    def _lookup(self, mode, command, cwd):
+        if cwd is None:
+            cwd = self._cwd
+        strict_key = (mode, tuple(command), cwd, self.cassette.env_digest(self._env))
+        interaction = self._playback.serve(strict_key, strict=True, reuse=not self.strict)
+        if interaction is None and not self.strict:
+            interaction = self._playback.serve((mode, tuple(command)), strict=False,
+                                               reuse=True)
+        if interaction is None:
+            raise NoRecording(mode, list(command), cwd)
+        return interaction
+
+    def batch(self, command, cwd=None, **_kwargs):
+        """
+        Play back a batch run.
+
+        :param command: list of arguments
+        :param cwd: current working directory (default is the shell's)
+        :returns: pair of standard output, standard error
+        :raises: :code:`ProcessError` if the run failed,
+                 :code:`NoRecording` if there is no matching run
+        """
+        return self._lookup('batch', command, cwd).play()
+
+    def interactive(self, command, cwd=None, **_kwargs):
+        """
+        Play back an interactive run.
+
+        :param command: list of arguments
+        :param cwd: current working directory (default is the shell's)
+        :raises: :code:`ProcessError` if the run failed,
+                 :code:`NoRecording` if there is no matching run
+        """
+        self._lookup('interactive', command, cwd).play()
+
+    def redirect(self, command, _outfp, _errfp, cwd=None, **_kwargs):
+        """
+        Play back a redirected run (nothing is written to the files).
+
+        :param command: list of arguments
+        :param cwd: current working directory (default is the shell's)
+        :raises: :code:`ProcessError` if the run failed,
+                 :code:`NoRecording` if there is no matching run
+        """
+        self._lookup('redirect', command, cwd).play()
+
+    def popen(self, command, **_kwargs): # pylint: disable=no-self-use
+        """
+        Refuse to start a process.
+
+        :raises: :code:`NoRecording`
+        """
+        raise NoRecording('popen', list(command))
+
+    def reap_all(self):
+        """Do nothing: there are no processes"""
+
+    def setenv(self, key, val):
+        """Set an environment variable"""
+        if val is None:
+            self._env.pop(key, None)
+            return
+        self._env[str(key)] = str(val)
+
+    def getenv(self, key):
+        """Get an environment variable"""
+        return self._env[key]
+
+    def environ(self):
+        """Get the whole environment"""
+        return self._env
+
+    def getcwd(self):
+        """Get the working directory"""
+        return self._cwd
+
+    def chdir(self, path):
+        """Change the working directory"""
+        self._cwd = os.path.join(self._cwd, path)
+
+    def clone(self):
+        """
+        Clone the shell object.
+
+        :returns: a replay shell with a copy of the environment,
+                  sharing which runs have been served
+        """
+        return attr.evolve(self, env=dict(self._env))
@@ -0,0 +1,211 @@
+# Copyright (c) Shopkick 2017
+# See LICENSE for details.
+"""
+Result cache
+------------
+
+Cache the output of read-only commands, such as :code:`git rev-parse HEAD`.
+
+Results are keyed by the argument list, the working directory, a digest of
+the environment (or of just the variables that matter), and an optional
+invalidation key -- for example, the modification time of :code:`.git/HEAD`.
+Output limits are part of the key too, since they change what a run returns.
+Only successful results are cached, and not output which spilled to a
+temporary file, since whoever gets it may close it.
+
+:const:`RESULTS` -- the process-wide cache used by default
+"""
+import collections
+import hashlib
+import json
+import threading
+
+import attr
+
+from seashore import capture
+
+DEFAULT_MAX_ENTRIES = 256
+
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+def _text(value):
+    if isinstance(value, bytes):
+        return value.decode('utf-8', 'replace')
+    return value
+
+def _env_digest(env, env_keys):
+    # The same whether names and values are bytes or text, so that
+    # digests saved by Python 2 and 3 match
+    if env_keys is None:
+        items = sorted(env.items())
+    else:
+        items = [(key, env.get(key)) for key in sorted(env_keys)]
+    digest = hashlib.sha1()
+    for key, value in items:
+        digest.update(json.dumps([_text(key), _text(value)]).encode('ascii'))
+    return digest.hexdigest()
+
+@attr.s
+class ResultCache(object):
+
+    """
+    Least-recently-used cache of command results.
+
+    :param max_entries: maximum number of results kept
+    :param max_bytes: maximum total size of outputs and errors kept
+    :param ttl: seconds a result stays valid (default is forever)
+    :param clock: function returning the current time in seconds
+                  (default is a monotonic clock where available)
+
+    The :code:`hits`, :code:`misses` and :code:`evictions` counters show
+    how many processes the cache saved.
+    """
+
+    _max_entries = attr.ib(default=DEFAULT_MAX_ENTRIES)
+    _max_bytes = attr.ib(default=DEFAULT_MAX_BYTES)
+    _ttl = attr.ib(default=None)
+    _clock = attr.ib(default=capture.clock, repr=False)
+
+    hits = attr.ib(init=False, default=0)
+    misses = attr.ib(init=False, default=0)
+    evictions = attr.ib(init=False, default=0)
+
+    _entries = attr.ib(init=False, default=attr.Factory(collections.OrderedDict), repr=False)
+    _size = attr.ib(init=False, default=0)
+    _lock = attr.ib(init=False, default=attr.Factory(threading.Lock), repr=False)
+
+    def key(self, shell, command, cwd=None, env_keys=None, invalidation=None): # pylint: disable=too-many-arguments,no-self-use
+        """
+        Compute the key of a command.
+
+        :param shell: the shell which would run the command
+        :param command: list of arguments
+        :param cwd: current working directory (default is the shell's)
+        :param env_keys: names of the environment variables which matter
+                         (default is all of them)
+        :param invalidation: function returning a hashable value which, when it changes,
+                             invalidates the results
+        :returns: a hashable key
+        """
+        if cwd is None:
+            cwd = shell.getcwd()
+        token = invalidation() if invalidation is not None else None
+        return (tuple(command), cwd, _env_digest(shell.environ(), env_keys), token)
+
+    def get(self, key):
+        """
+        Get a cached result.
+
+        :param key: key, as returned by :code:`key`
+        :returns: pair of standard output, standard error, or :code:`None` if not cached
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self._ttl is not None:
+                if self._clock() - entry[0] >= self._ttl:
+                    self._remove(key)
+                    entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries[key] = self._entries.pop(key)
+            return entry[1]
+
+    def put(self, key, result):
+        """
+        Cache a result.
+
+        Results larger than the whole cache are not kept.
+
+        :param key: key, as returned by :code:`key`
+        :param result: pair of standard output, standard error
+        """
+        size = sum(len(part) for part in result)
+        if size > self._max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (self._clock(), result, size)
+            self._size += size
+            while len(self._entries) > self._max_entries or self._size > self._max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _remove(self, key):
+        _time, _result, size = self._entries.pop(key)
+        self._size -= size
+
+    def batch(self, shell, command, cwd=None, env_keys=None, invalidation=None, **kwargs): # pylint: disable=too-many-arguments
+        """
+        Run a command in batch mode, unless its result is cached.
+
+        :param shell: the shell to run the command in
+        :param command: list of arguments
+        :param cwd: current working directory (default is the shell's)
+        :param env_keys: names of the environment variables which matter
+                         (default is all of them)
+        :param invalidation: function returning a hashable value which, when it changes,
+                             invalidates the results
+        :param kwargs: passed to the shell's :code:`batch`
+        :returns: pair of standard output, standard error
+        :raises: :code:`ProcessError` if the command fails (failures are not cached)
+        """
+        key = self.key(shell, command, cwd=cwd, env_keys=env_keys, invalidation=invalidation)
+        key += (kwargs.get('max_output'), kwargs.get('output_policy', 'raise'))
+        result = self.get(key)
+        if result is None:
+            result = tuple(shell.batch(command, cwd=cwd, **kwargs))
+            if not any(isinstance(part, capture.SpilledOutput) for part in result):
+                self.put(key, result)
+        return result
+
+    def clear(self):
+        """Forget all results (the counters are kept)"""
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def stats(self):
+        """
+        Get the cache's counters.
+
+        :returns: dictionary with :code:`hits`, :code:`misses`, :code:`evictions`,
+                  and the current number of :code:`entries` and :code:`bytes`
+        """
+        with self._lock:
+            return dict(hits=self.hits, misses=self.misses, evictions=self.evictions,
+                        entries=len(self._entries), bytes=self._size)
+
+@attr.s(frozen=True)
+class CachePolicy(object):
+
+    """
+    How a prepared command uses a result cache.
+
+    :param cache: the :code:`ResultCache`
+    :param env_keys: names of the environment variables which matter
+                     (default is all of them)
+    :param invalidation: function returning a hashable value which, when it changes,
+                         invalidates the results
+    """
+
+    cache = attr.ib()
+    env_keys = attr.ib(default=None)
+    invalidation = attr.ib(default=None)
+
+    def batch(self, shell, command, cwd=None, **kwargs):
+        """
+        Run a command in batch mode, unless its result is cached.
+
+        :param shell: the shell to run the command in
+        :param command: list of arguments
+        :param cwd: current working directory (default is the shell's)
+        :param kwargs: passed to the shell's :code:`batch`
+        :returns: pair of standard output, standard error
+        """
+        return self.cache.batch(shell, command, cwd=cwd, env_keys=self.env_keys,
+                                invalidation=self.invalidation, **kwargs)
+
+RESULTS = ResultCache()
@@ -0,0 +1,154 @@
+# Copyright (c) Shopkick 2017
+# See LICENSE for details.
+"""
+Retry
+-----
+
+Retrying commands which fail for reasons that go away,
+such as :code:`pip install`, :code:`docker pull` or :code:`git fetch`
+under network trouble.
+
+A :code:`RetryPolicy` says which failures are worth retrying (by return code,
+and by a regular expression searched in the standard error), how many attempts
+to make, how long to wait in between (growing exponentially, with jitter
+so that many failing commands do not retry in lockstep), and by when
+to give up altogether.
+"""
+import random
+import re
+import time
+
+import attr
+import six
+
+from seashore import capture
+from seashore.shell import ProcessError, ProcessTimeoutError
+
+def _error_text(exc):
+    error = getattr(exc, 'error', None)
+    if hasattr(error, 'tobytes'):
+        error = error.tobytes()
+    return error
+
+@attr.s(frozen=True)
+class RetryPolicy(object):
+
+    """
+    When, and how, to retry a failed command.
+
+    :param max_attempts: maximum number of attempts, including the first one
+    :param returncodes: return codes worth retrying (default is any failure)
+    :param stderr: regular expression; only failures whose standard error
+                   contains a match are retried (default is not to look).
+                   Failures whose standard error was not captured, such as
+                   those of :code:`interactive`, never match.
+    :param timeouts: whether to retry attempts which timed out
+    :param initial_delay: seconds to wait before the first retry
+    :param factor: how much longer to wait before each next retry
+    :param max_delay: longest wait between attempts, in seconds
+    :param jitter: fraction of each wait which is random:
+                   0 waits exactly, 1 waits anywhere between 0 and the full wait
+    :param deadline: seconds, from the first attempt, after which not to retry;
+                     attempts are given a timeout so as not to run past it
+    """
+
+    max_attempts = attr.ib(default=3)
+    returncodes = attr.ib(default=None)
+    stderr = attr.ib(default=None)
+    timeouts = attr.ib(default=False)
+    initial_delay = attr.ib(default=0.5)
+    factor = attr.ib(default=2.0)
+    max_delay = attr.ib(default=30.0)
+    jitter = attr.ib(default=0.5)
+    deadline = attr.ib(default=None)
+    _random = attr.ib(default=random, cmp=False, repr=False)
+
+    def matches(self, exc):
+        """
+        Check whether a failure is worth retrying.
+
+        :param exc: the :code:`ProcessError`
+        :returns: boolean
+        """
+        if isinstance(exc, ProcessTimeoutError):
+            return self.timeouts and exc.returncode is not None
+        if self.returncodes is not None and exc.returncode not in self.returncodes:
+            return False
+        if self.stderr is None:
+            return True
+        error = _error_text(exc)
+        if error is None:
+            return False
+        pattern = self.stderr
+        if isinstance(error, bytes) and isinstance(pattern, six.text_type):
+            pattern = pattern.encode('utf-8')
+        elif isinstance(error, six.text_type) and isinstance(pattern, bytes):
+            pattern = pattern.decode('utf-8')
+        return re.search(pattern, error) is not None
+
+    def delay(self, attempt):
+        """
+        Seconds to wait after a failed attempt.
+
+        :param attempt: number of the attempt which failed, starting at 1
+        :returns: seconds
+        """
+        full = min(self.initial_delay * self.factor ** (attempt - 1), self.max_delay)
+        return full * (1 - self.jitter * self._random.random())
+
+    def backoff(self, attempt, exc, elapsed):
+        """
+        Decide whether to retry a failed attempt.
+
+        :param attempt: number of the attempt which failed, starting at 1
+        :param exc: the :code:`ProcessError`
+        :param elapsed: seconds since the first attempt started
+        :returns: seconds to wait before retrying, or :code:`None` not to retry
+        """
+        if attempt >= self.max_attempts or not self.matches(exc):
+            return None
+        delay = self.delay(attempt)
+        if self.deadline is not None and elapsed + delay >= self.deadline:
+            return None
+        return delay
+
+    def attempt_kwargs(self, kwargs, elapsed):
+        """
+        Keyword arguments for an attempt, so that it does not run past the deadline.
+
+        :param kwargs: keyword arguments of the command
+        :param elapsed: seconds since the first attempt started
+        :returns: new keyword arguments
+        """
+        if self.deadline is None:
+            return kwargs
+        remaining = max(self.deadline - elapsed, 0)
+        timeout = kwargs.get('timeout')
+        ret = dict(kwargs)
+        ret['timeout'] = remaining if timeout is None else min(timeout, remaining)
+        return ret
+
+    def call(self, run, kwargs, sleep=time.sleep):
+        """
+        Run a command, retrying it as the policy says.
+
+        Waits between attempts by sleeping; :code:`fanout.map_batch`
+        and :code:`abatch` wait without holding up a thread.
+
+        :param run: function running the command once, with keyword arguments
+        :param kwargs: keyword arguments for :code:`run`
+        :param sleep: function to wait a number of seconds
+        :returns: whatever :code:`run` returns
+        :raises: the :code:`ProcessError` of the last attempt
+        """
+        started = capture.clock()
+        attempt = 1
+        while True:
+            try:
+                return run(**self.attempt_kwargs(kwargs, capture.clock() - started))
+            except ProcessError as exc:
+                delay = self.backoff(attempt, exc, capture.clock() - started)
+                if delay is None:
+                    raise
+            sleep(delay)
+            attempt += 1
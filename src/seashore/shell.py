@@ -6,28 +6,40 @@ Shell
 Running subprocesses with a shell-like interface.
 '''
 import contextlib
+import functools
+import importlib
+import io
 import os
-import tempfile
-import time
+import shutil
 import signal
 import subprocess
+import threading
 
 import attr
+import six
+
+from seashore import capture, environment, instrument, launch, reap, tree
 
 class ProcessError(Exception):
 
     """
     A process has exited with non-zero status.
+
+    :param args: return code, and optionally standard output and standard error
+    :param record: the :code:`instrument.ProcessRecord` of the process, if any
     """
 
-    def __init__(self, *args):
+    def __init__(self, *args, **kwargs):
         super(ProcessError, self).__init__()
+        self.record = kwargs.pop('record', None)
+        if kwargs:
+            raise TypeError('unexpected keyword arguments', sorted(kwargs))
         self._args = args
         self.returncode = args[0]
         if len(self._args) > 1:
             self.output = args[1]
         if len(self._args) > 2:
-            self.error = args[1]
+            self.error = args[2]
 
     def __repr__(self):
         return 'ProcessError{}'.format(repr(self._args))
@@ -40,6 +52,133 @@ class ProcessError(Exception):
     def __iter__(self):
         return iter(self._args) # pragma: no cover
 
+class ProcessTimeoutError(ProcessError):
+
+    """
+    A process did not finish in time, and was stopped.
+
+    The process is stopped as :code:`Shell.reap_all` would stop it,
+    so the return code is usually that of a signal.
+    (Not named :code:`TimeoutError`, so as not to shadow the builtin.)
+
+    :param args: return code, and standard output and standard error read until then
+    :param timeout: the timeout, in seconds
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.timeout = kwargs.pop('timeout', None)
+        super(ProcessTimeoutError, self).__init__(*args, **kwargs)
+
+    def __repr__(self):
+        return 'ProcessTimeoutError{}'.format(repr(self._args + (self.timeout,)))
+
+    __str__ = __repr__
+
+class OutputTooLarge(ProcessError):
+
+    """
+    A process wrote more output than allowed, and was killed.
+
+    :param args: return code, standard output and standard error read until then
+    :param stream: name of the stream which was too large
+    :param limit: the limit, in bytes
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.stream = kwargs.pop('stream', None)
+        self.limit = kwargs.pop('limit', None)
+        super(OutputTooLarge, self).__init__(*args, **kwargs)
+
+    def __repr__(self):
+        return 'OutputTooLarge{}'.format(repr(self._args + (self.stream, self.limit)))
+
+    __str__ = __repr__
+
+class PipelineError(ProcessError):
+
+    """
+    A process in a pipeline has exited with non-zero status.
+
+    As with a shell's :code:`pipefail` option, the return code is that
+    of the last process in the pipeline to fail.
+
+    :param args: return code, and optionally standard output and standard error
+    :param statuses: return codes of all the processes, in pipeline order
+    :param records: the :code:`instrument.ProcessRecord` of all the processes
+    :param record: the :code:`instrument.ProcessRecord` of the last process to fail
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.statuses = kwargs.pop('statuses', ())
+        self.records = kwargs.pop('records', ())
+        super(PipelineError, self).__init__(*args, **kwargs)
+
+    def __repr__(self):
+        return 'PipelineError{}'.format(repr(self._args + (self.statuses,)))
+
+    __str__ = __repr__
+
+def _deadline(timeout):
+    if timeout is None:
+        return None
+    return capture.clock() + timeout
+
+def _output_size(contents):
+    return len(contents) + getattr(contents, 'dropped', 0)
+
+def _endpoint(value, mode, to_close):
+    """
+    Turn a pipeline's stdin/stdout/stderr argument into a :code:`subprocess` one.
+
+    :returns: pair of the argument, and the file object to relay through Python
+              (if it has no file descriptor)
+    """
+    if value is None:
+        return None, None
+    if isinstance(value, (six.text_type, bytes)):
+        value = open(value, mode)
+        to_close.append(value)
+        return value, None
+    try:
+        value.fileno()
+    except (AttributeError, io.UnsupportedOperation):
+        return subprocess.PIPE, value
+    if 'w' in mode:
+        value.flush()
+    return value, None
+
+def _feed(source, pipe):
+    try:
+        shutil.copyfileobj(source, pipe)
+    except (IOError, OSError): # pragma: no cover
+        pass # The process stopped reading
+    finally:
+        try:
+            pipe.close()
+        except (IOError, OSError): # pragma: no cover
+            pass
+
+def _read_output(stdout, relay, collect, spill_threshold):
+    """
+    Read the last process of a pipeline's standard output, if it is a pipe.
+
+    :returns: pair of the output (if collected), and its size (if read)
+    """
+    if collect:
+        output = capture.collect(dict(stdout=stdout), spill_threshold=spill_threshold)['stdout']
+        return output, len(output)
+    if relay is None:
+        return None, None
+    output_size = 0
+    for _name, data in capture.iter_chunks(dict(stdout=stdout)):
+        relay.write(data)
+        output_size += len(data)
+    return None, output_size
+
+def _check_isolate(_shell, _attribute, value):
+    if value is not None and value not in tree.ISOLATIONS:
+        raise ValueError('unknown isolation', value)
+
 @attr.s
 class Shell(object):
 
@@ -50,15 +189,42 @@ class Shell(object):
 
     :param cwd: current working directory (default is process's current working directory)
     :param env: environment variables dict (default is a copy of the process's environment)
+    :param spill_threshold: bytes of output, per stream, that :code:`batch` keeps in memory
+                            before moving to a temporary file
+    :param launcher: what starts processes (default is a :code:`launch.PopenLauncher`)
+    :param grace_periods: seconds :code:`reap_all` waits after :code:`SIGINT`
+                          and after :code:`SIGTERM`
+    :param hooks: list of callables, each called with the :code:`instrument.ProcessRecord`
+                  of every process run to completion (shared with clones)
+    :param isolate: start each process in a new process group (:code:`'group'`)
+                    or session (:code:`'session'`), so that stopping it stops
+                    the processes it started too (default is not to)
+    :param cgroup: a :code:`tree.Cgroup` (such as :code:`tree.writable_cgroup()`)
+                   under which each process gets a cgroup of its own
     """
 
     _procs = attr.ib(init=False, default=attr.Factory(list))
 
     _cwd = attr.ib(init=False, default=attr.Factory(os.getcwd))
 
-    _env = attr.ib(init=False, default=attr.Factory(lambda: dict(os.environ)))
+    _env = attr.ib(init=False,
+                   default=attr.Factory(lambda: environment.Environment(base=dict(os.environ))))
+
+    _spill_threshold = attr.ib(default=capture.DEFAULT_SPILL_THRESHOLD)
+
+    _launcher = attr.ib(default=attr.Factory(launch.PopenLauncher))
+
+    _grace_periods = attr.ib(default=reap.DEFAULT_GRACE_PERIODS, convert=tuple)
+
+    _hooks = attr.ib(default=attr.Factory(list), convert=list)
 
-    def redirect(self, command, outfp, errfp, cwd=None):
+    _isolate = attr.ib(default=None, validator=_check_isolate)
+
+    _cgroup = attr.ib(default=None)
+
+    _leftovers = attr.ib(init=False, default=attr.Factory(list))
+
+    def redirect(self, command, outfp, errfp, cwd=None, timeout=None): # pylint: disable=too-many-arguments
         """
         Run a process, while its standard error and output go to pre-existing files
 
@@ -66,52 +232,418 @@ class Shell(object):
         :param outfp: output file object
         :param errfp: error file object
         :param cwd: current working directory (default is to use the internal working directory)
-        :raises: :code:`ProcessError` with return code
+        :param timeout: seconds after which to stop the process (default is to wait forever)
+        :raises: :code:`ProcessError` with return code,
+                 :code:`ProcessTimeoutError` if the process was stopped
         """
+        deadline = _deadline(timeout)
         proc = self.popen(command, stdin=subprocess.PIPE, stdout=outfp, stderr=errfp, cwd=cwd)
-        proc.communicate('')
-        retcode = proc.wait()
-        if retcode != 0:
-            raise ProcessError(retcode)
-
-    def batch(self, command, cwd=None):
+        proc.stdin.close()
+        timed_out = self._timed_out(proc, deadline)
+        record = self._finish(proc)
+        if timed_out:
+            raise ProcessTimeoutError(record.returncode, timeout=timeout, record=record)
+        if record.returncode != 0:
+            raise ProcessError(record.returncode, record=record)
+
+    def batch(self, command, cwd=None, spill_threshold=None, max_output=None, # pylint: disable=too-many-arguments
+              output_policy='raise', timeout=None):
         """
         Run a process, wait until it ends and return the output and error
 
+        Output is read through pipes into memory.
+        Once a stream grows past the spill threshold, the rest of it goes
+        to a temporary file instead.
+
+        Output can be limited, per stream, so that a runaway process
+        costs bounded memory. Past :code:`max_output` bytes, the policy is one of:
+
+        * :code:`'raise'` -- kill the process, and raise :code:`OutputTooLarge`
+        * :code:`'truncate'` -- keep the first and last :code:`max_output / 2` bytes,
+          returning a :code:`capture.Truncated` with the number of bytes :code:`dropped`
+        * :code:`'spill'` -- keep the output in a temporary file, returning
+          a memory-mapped :code:`capture.SpilledOutput` (which should be closed)
+
         :param command: list of arguments
         :param cwd: current working directory (default is to use the internal working directory)
+        :param spill_threshold: bytes per stream to keep in memory (default is the shell's);
+                                0 always uses temporary files
+        :param max_output: bytes of output allowed per stream (default is no limit)
+        :param output_policy: :code:`'raise'`, :code:`'truncate'` or :code:`'spill'`
+        :param timeout: seconds after which to stop the process (default is to wait forever)
         :returns: pair of standard output, standard error
-        :raises: :code:`ProcessError` with (return code, standard output, standard error)
+        :raises: :code:`ProcessError` with (return code, standard output, standard error),
+                 :code:`ProcessTimeoutError` (with the output read until then)
+                 if the process was stopped
         """
-        with tempfile.NamedTemporaryFile() as stdout, \
-             tempfile.NamedTemporaryFile() as stderr:
-            proc = self.popen(command, stdin=subprocess.PIPE, stdout=stdout, stderr=stderr, cwd=cwd)
-            proc.communicate('')
-            retcode = proc.wait()
-            self._procs.remove(proc)
-            stdout.seek(0)
-            stderr.seek(0)
-            stdout_contents = stdout.read()
-            stderr_contents = stderr.read()
-            ## Log contents of stdout, stderr
-            if retcode != 0:
-                raise ProcessError(retcode, stdout_contents, stderr_contents)
-            else:
-                return stdout_contents, stderr_contents
-
-    def interactive(self, command, cwd=None):
+        if spill_threshold is None:
+            spill_threshold = self._spill_threshold
+        if output_policy not in capture.POLICIES:
+            raise ValueError('unknown output policy', output_policy)
+        deadline = _deadline(timeout)
+        proc = self.popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                          stderr=subprocess.PIPE, cwd=cwd)
+        proc.stdin.close()
+        try:
+            contents = capture.collect(dict(stdout=proc.stdout, stderr=proc.stderr),
+                                       spill_threshold=spill_threshold, max_output=max_output,
+                                       policy=output_policy, deadline=deadline)
+        except capture.OutputLimitExceeded as exc:
+            reap.signal_tree(proc, signal.SIGKILL)
+            record = self._finish(proc)
+            raise OutputTooLarge(record.returncode, exc.contents['stdout'],
+                                 exc.contents['stderr'], stream=exc.name, limit=max_output,
+                                 record=record)
+        except capture.DeadlineExceeded as exc:
+            reap.reap([proc], self._grace_periods)
+            record = self._finish(proc)
+            raise ProcessTimeoutError(record.returncode, exc.contents['stdout'],
+                                      exc.contents['stderr'], timeout=timeout, record=record)
+        stdout_contents, stderr_contents = contents['stdout'], contents['stderr']
+        timed_out = self._timed_out(proc, deadline)
+        record = self._finish(proc, stdout_bytes=_output_size(stdout_contents),
+                              stderr_bytes=_output_size(stderr_contents))
+        if timed_out:
+            raise ProcessTimeoutError(record.returncode, stdout_contents, stderr_contents,
+                                      timeout=timeout, record=record)
+        if record.returncode != 0:
+            raise ProcessError(record.returncode, stdout_contents, stderr_contents,
+                               record=record)
+        else:
+            return stdout_contents, stderr_contents
+
+    def interactive(self, command, cwd=None, timeout=None):
         """
         Run a process, while its standard output and error go directly to ours.
 
         :param command: list of arguments
         :param cwd: current working directory (default is to use the internal working directory)
-        :raises: :code:`ProcessError` with (return code, standard output, standard error)
+        :param timeout: seconds after which to stop the process (default is to wait forever)
+        :raises: :code:`ProcessError` with (return code, standard output, standard error),
+                 :code:`ProcessTimeoutError` if the process was stopped
         """
+        deadline = _deadline(timeout)
         proc = self.popen(command, cwd=cwd)
-        retcode = proc.wait()
+        timed_out = self._timed_out(proc, deadline)
+        record = self._finish(proc)
+        if timed_out:
+            raise ProcessTimeoutError(record.returncode, timeout=timeout, record=record)
+        if record.returncode != 0:
+            raise ProcessError(record.returncode, record=record)
+
+    def stream(self, command, cwd=None, chunk_size=None, stderr='tail', # pylint: disable=too-many-arguments
+               tail_size=capture.DEFAULT_TAIL_SIZE, timeout=None):
+        """
+        Run a process, and iterate over its output as it is produced.
+
+        The process is only read from when the iterator is advanced,
+        so a slow consumer slows down the process rather than
+        using up memory.
+        Closing the iterator early kills the process.
+
+        :param command: list of arguments
+        :param cwd: current working directory (default is to use the internal working directory)
+        :param chunk_size: if given, yield pieces of this size instead of lines
+        :param stderr: :code:`'tail'` keeps the end of standard error for error reporting;
+                       :code:`'interleave'` mixes it into the output
+        :param tail_size: how many bytes of standard error to keep
+        :param timeout: seconds after which to stop the process (default is to wait forever)
+        :returns: iterator of bytes
+        :raises: :code:`ProcessError` with (return code, empty output, end of standard error),
+                 once the output is exhausted;
+                 :code:`ProcessTimeoutError` if the process was stopped
+        """
+        if stderr == 'tail':
+            stderr_arg = subprocess.PIPE
+        elif stderr == 'interleave':
+            stderr_arg = subprocess.STDOUT
+        else:
+            raise ValueError('unknown stderr mode', stderr)
+        if chunk_size is None:
+            split = capture.iter_lines
+        else:
+            split = functools.partial(capture.iter_fixed, size=chunk_size)
+        deadline = _deadline(timeout)
+        proc = self.popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                          stderr=stderr_arg, cwd=cwd)
+        proc.stdin.close()
+        return self._stream(proc, split, capture.RingBuffer(tail_size), timeout, deadline)
+
+    def parse(self, command, parser, cwd=None, tail_size=capture.DEFAULT_TAIL_SIZE, # pylint: disable=too-many-arguments
+              timeout=None):
+        """
+        Run a process, and parse its output as it is produced.
+
+        The parser is run over the output as it arrives, so the
+        whole output is never in memory -- only the parsed objects.
+
+        :param command: list of arguments
+        :param parser: callable taking an iterator of bytes chunks, and returning
+                       an iterable of parsed objects (for example, one from :code:`parsers`)
+        :param cwd: current working directory (default is to use the internal working directory)
+        :param tail_size: how many bytes of standard error to keep
+        :param timeout: seconds after which to stop the process (default is to wait forever)
+        :returns: list of parsed objects
+        :raises: :code:`ProcessError` with (return code, empty output, end of standard error),
+                 :code:`ProcessTimeoutError` if the process was stopped,
+                 or whatever the parser raises (after killing the process)
+        """
+        deadline = _deadline(timeout)
+        proc = self.popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                          stderr=subprocess.PIPE, cwd=cwd)
+        proc.stdin.close()
+        return list(self._stream(proc, parser, capture.RingBuffer(tail_size), timeout,
+                                 deadline))
+
+    def coprocess(self, command, framing=None, cwd=None):
+        """
+        Keep a process running, to send it request after request.
+
+        The process is started on the first request, and again after it dies.
+
+        :param command: list of arguments
+        :param framing: how requests and responses are framed
+                        (default is :code:`coprocess.LINES`)
+        :param cwd: current working directory (default is to use the internal working directory)
+        :returns: :code:`coprocess.Coprocess`
+        """
+        # Imported here, since it builds on this module
+        coprocess = importlib.import_module('seashore.coprocess')
+        if framing is None:
+            framing = coprocess.LINES
+        return coprocess.Coprocess(coprocess.starter(self.popen, command, cwd=cwd),
+                                   framing=framing, grace_periods=self._grace_periods,
+                                   forget=self._forget)
+
+    def _stream(self, proc, split, tail, timeout=None, deadline=None): # pylint: disable=too-many-arguments
+        streams = dict(stdout=proc.stdout)
+        if proc.stderr is not None:
+            streams['stderr'] = proc.stderr
+        sizes = dict.fromkeys(streams, 0)
+        def _output():
+            for name, data in capture.iter_chunks(streams, deadline=deadline):
+                sizes[name] += len(data)
+                if name == 'stderr':
+                    tail.write(data)
+                else:
+                    yield data
+        pieces = iter(split(_output()))
+        finished = timed_out = False
+        try:
+            for piece in pieces:
+                yield piece
+            finished = True
+            timed_out = self._timed_out(proc, deadline)
+        except capture.DeadlineExceeded:
+            timed_out = True
+        finally:
+            if not finished:
+                if hasattr(pieces, 'close'):
+                    pieces.close()
+                for stream in streams.values():
+                    stream.close()
+                if timed_out:
+                    reap.reap([proc], self._grace_periods)
+                else:
+                    reap.signal_tree(proc, signal.SIGKILL)
+            record = self._finish(proc, stdout_bytes=sizes['stdout'],
+                                  stderr_bytes=sizes.get('stderr'))
+        if timed_out:
+            raise ProcessTimeoutError(record.returncode, b'', tail.getvalue(), timeout=timeout,
+                                      record=record)
+        if record.returncode != 0:
+            raise ProcessError(record.returncode, b'', tail.getvalue(), record=record)
+
+    def pipeline(self, commands, stdin=None, stdout=None, stderr=None, cwd=None): # pylint: disable=too-many-arguments
+        """
+        Run processes connected by pipes, like a shell pipeline.
+
+        Each process's standard output is an operating system pipe to the next one's
+        standard input, so data between processes never passes through Python.
+        Paths and real files are handed to the processes directly too;
+        only file-like objects with no file descriptor (such as :code:`io.BytesIO`)
+        are relayed by Python.
+
+        :param commands: list of commands, each a list of arguments
+        :param stdin: what the first process reads: a path, a file object,
+                      or :code:`None` for nothing
+        :param stdout: where the last process writes: a path, a file object,
+                       or :code:`None` to return the output
+        :param stderr: where every process's standard error goes: a path, a file object,
+                       or :code:`None` for ours
+        :param cwd: current working directory (default is to use the internal working directory)
+        :returns: the last process's standard output, if :code:`stdout` is :code:`None`
+        :raises: :code:`PipelineError` if any process fails
+        """
+        if not commands:
+            raise ValueError('empty pipeline')
+        to_close = []
+        try:
+            stdin_arg, stdin_relay = _endpoint(stdin, 'rb', to_close)
+            stdout_arg, stdout_relay = _endpoint(stdout, 'wb', to_close)
+            stderr_arg, _stderr_relay = _endpoint(stderr, 'wb', to_close)
+            if stdin_arg is None:
+                stdin_arg = subprocess.PIPE
+            if stdout_arg is None:
+                stdout_arg = subprocess.PIPE
+            if stderr_arg == subprocess.PIPE:
+                raise ValueError('stderr must have a file descriptor', stderr)
+            procs = self._start_pipeline(commands, stdin_arg, stdout_arg, stderr=stderr_arg,
+                                         cwd=cwd)
+            return self._run_pipeline(procs, stdin_relay, stdout_relay,
+                                      stdout_arg == subprocess.PIPE and stdout_relay is None)
+        finally:
+            for opened in to_close:
+                opened.close()
+
+    def _start_pipeline(self, commands, stdin, stdout, **kwargs):
+        procs = []
+        previous = stdin
+        try:
+            for index, command in enumerate(commands):
+                last = index == len(commands) - 1
+                proc = self.popen(command, stdin=previous,
+                                  stdout=stdout if last else subprocess.PIPE, **kwargs)
+                if procs:
+                    previous.close()
+                procs.append(proc)
+                previous = proc.stdout
+        except BaseException:
+            if procs and procs[-1].stdout is not None:
+                procs[-1].stdout.close()
+            for proc in procs:
+                proc.kill()
+                proc.wait()
+                self._procs.remove(proc)
+            raise
+        return procs
+
+    def _run_pipeline(self, procs, stdin_relay, stdout_relay, collect):
+        feeder = None
+        if procs[0].stdin is not None:
+            if stdin_relay is None:
+                procs[0].stdin.close()
+            else:
+                feeder = threading.Thread(target=_feed, args=(stdin_relay, procs[0].stdin))
+                feeder.daemon = True
+                feeder.start()
+        output, output_size = _read_output(procs[-1].stdout, stdout_relay, collect,
+                                           self._spill_threshold)
+        records = [self._finish(proc) for proc in procs[:-1]]
+        records.append(self._finish(procs[-1], stdout_bytes=output_size))
+        if feeder is not None:
+            feeder.join()
+        statuses = [record.returncode for record in records]
+        failed = [record for record in records if record.returncode != 0]
+        if failed:
+            args = (failed[-1].returncode,)
+            if collect:
+                args += (output, b'')
+            raise PipelineError(*args, statuses=statuses, records=records, record=failed[-1])
+        return output
+
+    def _timed_out(self, proc, deadline):
+        if deadline is None:
+            return False
+        if not reap.wait_all([proc], deadline - capture.clock()):
+            return False
+        reap.reap([proc], self._grace_periods)
+        return True
+
+    def _finish(self, proc, stdout_bytes=None, stderr_bytes=None):
+        retcode, rusage = instrument.wait(proc)
         self._procs.remove(proc)
-        if retcode != 0:
-            raise ProcessError(retcode)
+        self._untrack(proc)
+        record = instrument.record(proc, retcode, rusage, stdout_bytes, stderr_bytes)
+        self._notify(record)
+        return record
+
+    def _forget(self, proc):
+        if proc in self._procs:
+            self._procs.remove(proc)
+        self._untrack(proc)
+
+    def _untrack(self, proc):
+        process_tree = getattr(proc, 'tree', None)
+        if process_tree is None:
+            return
+        if process_tree.pids():
+            self._leftovers.append(process_tree)
+        else:
+            process_tree.close()
+
+    def _notify(self, record):
+        for hook in self._hooks:
+            hook(record)
+
+    def add_hook(self, hook):
+        """
+        Add a hook, called with the record of every process run to completion.
+
+        Hooks are shared with clones, including clones made before the hook was added.
+
+        :param hook: callable taking an :code:`instrument.ProcessRecord`
+        """
+        self._hooks.append(hook)
+
+    def abatch(self, command, cwd=None, spill_threshold=None, max_output=None, # pylint: disable=too-many-arguments
+               output_policy='raise', timeout=None):
+        """
+        Run a process in batch mode from an :code:`asyncio` event loop (Python 3.5+).
+
+        The process runs in an :code:`AsyncShell` with a copy of this shell's
+        environment and working directory, and is reaped by :code:`reap_all`
+        like the shell's own.
+
+        :param command: list of arguments
+        :param cwd: current working directory (default is to use the internal working directory)
+        :param spill_threshold: bytes per stream to keep in memory (default is the shell's)
+        :param max_output: bytes of output allowed per stream (default is no limit)
+        :param output_policy: :code:`'raise'`, :code:`'truncate'` or :code:`'spill'`
+        :param timeout: seconds after which to stop the process (default is to wait forever)
+        :returns: awaitable pair of standard output, standard error
+        :raises: :code:`ProcessError` with (return code, standard output, standard error),
+                 :code:`ProcessTimeoutError` if the process was stopped
+        """
+        return self._asynchronous().batch(command, cwd=cwd, spill_threshold=spill_threshold,
+                                          max_output=max_output, output_policy=output_policy,
+                                          timeout=timeout)
+
+    def ainteractive(self, command, cwd=None, timeout=None):
+        """
+        Run a process in interactive mode from an :code:`asyncio` event loop (Python 3.5+).
+
+        :param command: list of arguments
+        :param cwd: current working directory (default is to use the internal working directory)
+        :param timeout: seconds after which to stop the process (default is to wait forever)
+        :returns: awaitable
+        :raises: :code:`ProcessError` with return code,
+                 :code:`ProcessTimeoutError` if the process was stopped
+        """
+        return self._asynchronous().interactive(command, cwd=cwd, timeout=timeout)
+
+    def acoprocess(self, command, framing=None, cwd=None):
+        """
+        Keep a process running, to send it requests from an :code:`asyncio` event loop
+        (Python 3.5+).
+
+        :param command: list of arguments
+        :param framing: how requests and responses are framed
+                        (default is :code:`coprocess.LINES`)
+        :param cwd: current working directory (default is to use the internal working directory)
+        :returns: :code:`asyncshell.AsyncCoprocess`
+        """
+        return self._asynchronous().coprocess(command, framing=framing, cwd=cwd)
+
+    def _asynchronous(self):
+        # asyncio is Python 3 only, so only import it when asked to
+        asyncshell = importlib.import_module('seashore.asyncshell')
+        ret = asyncshell.AsyncShell(spill_threshold=self._spill_threshold,
+                                    grace_periods=self._grace_periods, hooks=(),
+                                    isolate=self._isolate, cgroup=self._cgroup)
+        # The processes are shared, so that reap_all and tree_stats see the ones it starts
+        return attr.assoc(ret, _hooks=self._hooks, _cwd=self._cwd, _env=self._env.copy(),
+                          _procs=self._procs, _leftovers=self._leftovers)
 
     def popen(self, command, **kwargs):
         """
@@ -119,16 +651,26 @@ class Shell(object):
 
         :param command: list of arguments
         :param kwargs: keyword arguments passed to :code:`subprocess.Popen`
-        :returns: a :code:`Process`
+        :returns: a :code:`Process`, as returned by the shell's launcher
         """
         if kwargs.get('cwd') is None:
             kwargs['cwd'] = self._cwd
         if kwargs.get('env') is None:
-            kwargs['env'] = self._env
-        proc = subprocess.Popen(command, **kwargs)
+            kwargs['env'] = self._env.flatten()
+        for key, value in tree.popen_kwargs(self._isolate).items():
+            kwargs.setdefault(key, value)
+        started = capture.clock()
+        proc = self._launcher.launch(command, **kwargs)
+        instrument.launched(proc, command, kwargs['cwd'], started)
+        self._track(proc)
         self._procs.append(proc)
         return proc
 
+    def _track(self, proc):
+        if self._isolate is None and self._cgroup is None:
+            return
+        proc.tree = tree.track(proc.pid, self._isolate is not None, self._cgroup)
+
     def setenv(self, key, val):
         """
         Set internal environment variable.
@@ -159,6 +701,22 @@ class Shell(object):
         """
         return self._env[key]
 
+    def environ(self):
+        """
+        Get the whole internal environment.
+
+        :returns: dictionary of all variables, which should not be modified
+        """
+        return self._env.flatten()
+
+    def getcwd(self):
+        """
+        Get internal current working directory.
+
+        :returns: the directory in which subprocesses will be run
+        """
+        return self._cwd
+
     def chdir(self, path):
         """
         Change internal current working directory.
@@ -174,30 +732,47 @@ class Shell(object):
         """
         Kill, as gently as possible, all processes.
 
-        Loop through all processes and try to kill them with
-        a sequence of :code:`SIGINT`, :code:`SIGTERM` and
-        :code:`SIGKILL`.
-        """
-        for proc in self._procs:
-            ret_code = proc.poll()
-            if ret_code is None:
-                proc.send_signal(signal.SIGINT)
-                time.sleep(3)
-            ret_code = ret_code or proc.poll()
-            if ret_code is None: # pragma: no coverage
-                proc.terminate()
-                time.sleep(3)
-            ret_code = ret_code or proc.poll() # pragma: no coverage
-            if ret_code is None: # pragma: no coverage
-                proc.kill()
+        All live processes are sent :code:`SIGINT` at once, and waited on together.
+        After the first grace period, those still running are sent :code:`SIGTERM`,
+        and after the second one, :code:`SIGKILL`.
+
+        For an isolating shell, this stops the processes they started too,
+        including those left by processes which have already been waited for.
+
+        :returns: :code:`reap.ReapReport` of the stage at which each process exited
+        """
+        leftovers = list(self._leftovers)
+        del self._leftovers[:]
+        report = reap.reap(self._procs + leftovers, self._grace_periods)
+        for process_tree in leftovers:
+            process_tree.close()
+        return report
+
+    def tree_stats(self):
+        """
+        What the shell's processes, and the processes they started, are using now.
+
+        Processes started by processes are only seen by an isolating shell.
+        Processes which were started by a process which has been waited for,
+        and are still running, are included.
+
+        :returns: :code:`tree.TreeStats`
+        """
+        trees = [getattr(proc, 'tree', None) or tree.ProcessTree(pid=proc.pid, grouped=False)
+                 for proc in self._procs] + self._leftovers
+        states = tree.scan() if trees else []
+        return tree.total(process_tree.stats(states) for process_tree in trees)
 
     def clone(self):
         """
         Clone the shell object.
 
-        :returns: a new Shell object with a copy of the environment dictionary
+        The environment is copied on write, so cloning is cheap
+        however many variables it has.
+
+        :returns: a new Shell object with a copy of the environment
         """
-        return attr.assoc(self, _env=dict(self._env), _procs=[])
+        return attr.assoc(self, _env=self._env.copy(), _procs=[], _leftovers=[])
 
 @contextlib.contextmanager
 def autoexit_code():
@@ -0,0 +1,180 @@
+# Copyright (c) Shopkick 2017
+# See LICENSE for details.
+"""Tests for seashore.asyncshell"""
+
+import sys
+import unittest
+
+from seashore import executor, parsers, shell
+
+try:
+    import asyncio
+    from seashore import asyncshell
+except (ImportError, SyntaxError): # pragma: no cover
+    asyncshell = None
+
+class LoopTest(unittest.TestCase):
+
+    """Tests running awaitables on an event loop of their own"""
+
+    def setUp(self):
+        """create an event loop, which can wait for processes"""
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        if sys.version_info < (3, 8):
+            # Until 3.8, only the loop the child watcher is attached to can wait for processes
+            asyncio.get_child_watcher().attach_loop(self.loop)
+        self.addCleanup(self.loop.close)
+        self.addCleanup(asyncio.set_event_loop, None)
+
+    def _run(self, awaitable):
+        """run an awaitable to completion"""
+        return self.loop.run_until_complete(awaitable)
+
+@unittest.skipIf(asyncshell is None, "asyncio not available")
+class AsyncShellTest(LoopTest):
+
+    """Tests for AsyncShell()"""
+
+    def setUp(self):
+        """create a new shell object"""
+        super(AsyncShellTest, self).setUp()
+        self.shell = asyncshell.AsyncShell()
+
+    def test_batch(self):
+        """batch mode returns contents of stdout/stderr from subprocesses"""
+        python_script = "import sys;sys.stdout.write('hello');sys.stderr.write('goodbye')"
+        out, err = self._run(self.shell.batch([sys.executable, '-c', python_script]))
+        self.assertEqual(out, b'hello')
+        self.assertEqual(err, b'goodbye')
+
+    def test_records(self):
+        """finished processes are recorded, without resource usage"""
+        records = []
+        self.shell.add_hook(records.append)
+        python_script = "import sys;sys.stdout.write('hello')"
+        self._run(self.shell.batch([sys.executable, '-c', python_script]))
+        self.assertEqual(len(records), 1)
+        record = records[0]
+        self.assertEqual((record.returncode, record.stdout_bytes, record.user_time),
+                         (0, 5, None))
+
+    def test_max_output(self):
+        """output limits apply to asynchronous batches"""
+        script = "import sys;sys.stdout.write('a' * 100000);sys.stdout.flush();input()"
+        with self.assertRaises(shell.OutputTooLarge) as context:
+            self._run(self.shell.batch([sys.executable, '-c', script], max_output=1000))
+        self.assertEqual(context.exception.stream, 'stdout')
+        truncating = self.shell.batch([sys.executable, '-c', script.replace('input()', '')],
+                                      max_output=10, output_policy='truncate')
+        out, _err = self._run(truncating)
+        self.assertEqual(out.dropped, 99990)
+
+    def test_timeout(self):
+        """asynchronous batches time out, keeping the output read until then"""
+        script = "import sys,time;sys.stdout.write('started');sys.stdout.flush();time.sleep(100)"
+        with self.assertRaises(shell.ProcessTimeoutError) as context:
+            self._run(self.shell.batch([sys.executable, '-c', script], timeout=1))
+        self.assertEqual((context.exception.output, context.exception.timeout),
+                         (b'started', 1))
+        with self.assertRaises(shell.ProcessTimeoutError):
+            self._run(self.shell.interactive(['sleep', '100'], timeout=0.1))
+        self.assertEqual(self._run(self.shell.reap_all()).stages, {})
+
+    def test_isolate(self):
+        """timeouts stop the processes an isolated process started"""
+        isolated = asyncshell.AsyncShell(grace_periods=(0.5, 0.5), isolate='session')
+        script = ("import subprocess,sys;subprocess.Popen(['sleep','100']);"
+                  "sys.stdout.write('started');sys.stdout.flush()")
+        with self.assertRaises(shell.ProcessTimeoutError) as context:
+            self._run(isolated.batch([sys.executable, '-c', script], timeout=0.5))
+        self.assertEqual(context.exception.output, b'started')
+        self._run(isolated.reap_all())
+        self.assertEqual(isolated.tree_stats().processes, 0)
+
+    def test_failed_batch(self):
+        """processes exiting with non-zero code raise in batch mode"""
+        python_script = "import sys;sys.stdout.write('hello');sys.exit(3)"
+        with self.assertRaises(shell.ProcessError) as context:
+            self._run(self.shell.batch([sys.executable, '-c', python_script]))
+        self.assertEqual(context.exception.returncode, 3)
+        self.assertEqual(context.exception.output, b'hello')
+
+    def test_concurrent(self):
+        """many processes run together on one event loop"""
+        python_script = "import sys,time;time.sleep(0.5);sys.stdout.write(sys.argv[1])"
+        results = self._run(asyncio.gather(*[
+            self.shell.batch([sys.executable, '-c', python_script, str(i)]) for i in range(10)]))
+        self.assertEqual([out for out, _err in results],
+                         [str(i).encode('ascii') for i in range(10)])
+
+    def test_failed_interactive(self):
+        """processes exiting with non-zero code raise in interactive mode"""
+        with self.assertRaises(shell.ProcessError):
+            self._run(self.shell.interactive([sys.executable, '-c', 'raise SystemExit(1)']))
+
+    def test_redirect(self):
+        """redirect sends output to a file"""
+        python_script = "import sys;sys.stdout.write('hello')"
+        with open('/dev/null', 'wb') as devnull:
+            self._run(self.shell.redirect([sys.executable, '-c', python_script], devnull, devnull))
+
+    def test_clone(self):
+        """cloned shells are still asynchronous, with a separate environment"""
+        new_shell = self.shell.clone()
+        new_shell.setenv('SPECIAL', 'lucy')
+        self.shell.setenv('SPECIAL', 'emett')
+        python_script = 'import sys,os;sys.stdout.write(os.environ["SPECIAL"])'
+        out, _ignored = self._run(new_shell.batch([sys.executable, '-c', python_script]))
+        self.assertEqual(out, b'lucy')
+
+    def test_stream(self):
+        """streaming is not supported, rather than failing on a coroutine"""
+        with self.assertRaises(TypeError):
+            self.shell.stream([sys.executable, '-c', ''])
+
+    def test_parse(self):
+        """parsing is not supported, rather than failing on a coroutine"""
+        with self.assertRaises(TypeError):
+            self.shell.parse([sys.executable, '-c', ''], parsers.lines())
+
+    def test_pipeline(self):
+        """pipelines are not supported, rather than failing on a coroutine"""
+        with self.assertRaises(TypeError):
+            self.shell.pipeline([[sys.executable, '-c', ''], [sys.executable, '-c', '']])
+
+    def test_reaper(self):
+        """killing a process terminates it with a negative signal"""
+        python_script = 'import time;time.sleep(100000)'
+        proc = self._run(self.shell.popen([sys.executable, '-c', python_script]))
+        self._run(self.shell.reap_all())
+        self.assertLess(self._run(proc.wait()), 0)
+
+@unittest.skipIf(asyncshell is None, "asyncio not available")
+class AsyncExecutorTest(LoopTest):
+
+    """Tests for awaitable prepared commands"""
+
+    def test_abatch(self):
+        """prepared commands on a regular shell can be awaited"""
+        xctr = executor.Executor(shell.Shell()).patch_env(SPECIAL='emett')
+        python_script = 'import sys,os;sys.stdout.write(os.environ["SPECIAL"])'
+        out, _err = self._run(xctr.command([sys.executable, '-c', python_script]).abatch())
+        self.assertEqual(out, b'emett')
+
+    def test_ainteractive(self):
+        """prepared commands on an async shell can be awaited interactively"""
+        xctr = executor.Executor(asyncshell.AsyncShell())
+        with self.assertRaises(shell.ProcessError):
+            self._run(xctr.command([sys.executable, '-c', 'raise SystemExit(1)']).ainteractive())
+
+    def test_reap_abatch(self):
+        """processes awaited on a regular shell are reaped with the shell's own"""
+        tracking = shell.Shell(grace_periods=(5, 5))
+        pending = self.loop.create_task(
+            tracking.abatch([sys.executable, '-c', 'import time;time.sleep(100000)']))
+        self._run(asyncio.sleep(0.5))
+        report = tracking.reap_all()
+        self.assertEqual(len(report.pids('SIGINT')), 1)
+        with self.assertRaises(shell.ProcessError):
+            self._run(pending)
@@ -0,0 +1,149 @@
+# Copyright (c) Shopkick 2017
+# See LICENSE for details.
+"""Tests for seashore.capture"""
+
+import os
+import unittest
+
+from seashore import capture
+
+def _pipe(content):
+    """make a pipe that holds content and is closed for writing"""
+    read_fd, write_fd = os.pipe()
+    os.write(write_fd, content)
+    os.close(write_fd)
+    return os.fdopen(read_fd, 'rb')
+
+class SinkTest(unittest.TestCase):
+
+    """Tests for the spilling sink"""
+
+    def test_in_memory(self):
+        """data under the threshold stays in memory"""
+        sink = capture.make_sink('stdout', spill_threshold=10)
+        sink.write(b'hello')
+        self.assertFalse(sink.spilled)
+        self.assertEqual(sink.getvalue(), b'hello')
+        sink.close()
+
+    def test_spill(self):
+        """data over the threshold moves to a file, and nothing is lost"""
+        sink = capture.make_sink('stdout', spill_threshold=10)
+        sink.write(b'hello')
+        sink.write(b'goodbye')
+        sink.write(b'!')
+        self.assertTrue(sink.spilled)
+        self.assertEqual(sink.getvalue(), b'hellogoodbye!')
+        sink.close()
+
+    def test_always_spill(self):
+        """a zero threshold spills on the first write"""
+        sink = capture.make_sink('stdout', spill_threshold=0)
+        sink.write(b'x')
+        self.assertTrue(sink.spilled)
+        self.assertEqual(sink.getvalue(), b'x')
+        sink.close()
+
+class LimitTest(unittest.TestCase):
+
+    """Tests for the output limit policies"""
+
+    def test_raise(self):
+        """writing past the limit raises"""
+        sink = capture.make_sink('stdout', max_output=5, policy='raise')
+        sink.write(b'hello')
+        with self.assertRaises(capture.OutputLimitExceeded) as context:
+            sink.write(b'!')
+        self.assertEqual(context.exception.name, 'stdout')
+        self.assertEqual(sink.getvalue(), b'hello')
+        sink.close()
+
+    def test_truncate(self):
+        """the head and tail are kept, and the bytes in between counted"""
+        sink = capture.make_sink('stdout', max_output=6, policy='truncate')
+        for piece in (b'ab', b'cdef', b'ghij', b'k'):
+            sink.write(piece)
+        value = sink.getvalue()
+        self.assertIsInstance(value, capture.Truncated)
+        self.assertEqual((value, value.dropped), (b'abcijk', 5))
+        sink.close()
+
+    def test_truncate_short(self):
+        """short outputs are returned whole"""
+        sink = capture.make_sink('stdout', max_output=6, policy='truncate')
+        sink.write(b'abcdef')
+        value = sink.getvalue()
+        self.assertEqual(value, b'abcdef')
+        self.assertNotIsInstance(value, capture.Truncated)
+
+    def test_spill(self):
+        """long outputs are memory-mapped"""
+        sink = capture.make_sink('stdout', max_output=4, policy='spill')
+        sink.write(b'abc')
+        sink.write(b'defgh')
+        with sink.getvalue() as value:
+            sink.close()
+            self.assertEqual(len(value), 8)
+            self.assertEqual((value[1:3], value.find(b'fg'), value.dropped), (b'bc', 5, 0))
+            self.assertEqual(value.tobytes(), b'abcdefgh')
+
+    def test_spill_short(self):
+        """short outputs stay in memory"""
+        sink = capture.make_sink('stdout', max_output=4, policy='spill')
+        sink.write(b'abc')
+        self.assertEqual(sink.getvalue(), b'abc')
+        sink.close()
+
+    def test_unknown(self):
+        """unknown policies are rejected"""
+        with self.assertRaises(ValueError):
+            capture.make_sink('stdout', max_output=4, policy='ignore')
+
+class CollectTest(unittest.TestCase):
+
+    """Tests for reading pipes"""
+
+    def test_collect(self):
+        """all streams are read to the end and closed"""
+        streams = dict(first=_pipe(b'one'), second=_pipe(b'two'))
+        contents = capture.collect(streams)
+        self.assertEqual(contents, dict(first=b'one', second=b'two'))
+        self.assertTrue(all(stream.closed for stream in streams.values()))
+
+    def test_iter_chunks(self):
+        """chunks are tagged with the name of their stream"""
+        chunks = list(capture.iter_chunks(dict(only=_pipe(b'abcdef')), chunk_size=4))
+        self.assertEqual(chunks, [('only', b'abcd'), ('only', b'ef')])
+
+class RingBufferTest(unittest.TestCase):
+
+    """Tests for the bounded tail buffer"""
+
+    def test_keeps_tail(self):
+        """only the last bytes are kept"""
+        ring = capture.RingBuffer(limit=5)
+        for data in (b'abc', b'defg', b'hi'):
+            ring.write(data)
+        self.assertEqual(ring.getvalue(), b'efghi')
+        ring.write(b'jklmnop')
+        self.assertEqual(ring.getvalue(), b'lmnop')
+
+    def test_empty(self):
+        """a zero-sized buffer keeps nothing"""
+        ring = capture.RingBuffer(limit=0)
+        ring.write(b'abc')
+        self.assertEqual(ring.getvalue(), b'')
+
+class SplitTest(unittest.TestCase):
+
+    """Tests for splitting streams of chunks"""
+
+    def test_lines(self):
+        """lines are reassembled across chunk boundaries"""
+        lines = list(capture.iter_lines([b'one\ntw', b'o\n', b'\nthree']))
+        self.assertEqual(lines, [b'one\n', b'two\n', b'\n', b'three'])
+
+    def test_fixed(self):
+        """pieces are all the same size, except maybe the last"""
+        pieces = list(capture.iter_fixed([b'abcde', b'f', b'ghij'], 4))
+        self.assertEqual(pieces, [b'abcd', b'efgh', b'ij'])
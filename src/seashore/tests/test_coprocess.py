@@ -0,0 +1,172 @@
+# Copyright (c) Shopkick 2017
+# See LICENSE for details.
+"""Tests for seashore.coprocess"""
+
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import unittest
+
+from seashore import coprocess, executor, shell
+from seashore.tests import test_asyncshell
+
+try:
+    import asyncio
+except ImportError: # pragma: no cover
+    asyncio = None
+
+UPPER = ("import os,sys\n"
+         "delimiter = b'\\0' if sys.argv[1:] == ['nul'] else b'\\n'\n"
+         "buf = b''\n"
+         "while True:\n"
+         "    data = os.read(0, 65536)\n"
+         "    if not data:\n"
+         "        break\n"
+         "    buf += data\n"
+         "    while delimiter in buf:\n"
+         "        request, buf = buf.split(delimiter, 1)\n"
+         "        if request == b'die':\n"
+         "            sys.exit(7)\n"
+         "        os.write(1, request.upper() + delimiter)\n")
+
+class FramingTest(unittest.TestCase):
+
+    """Tests for splitting responses"""
+
+    def test_partial(self):
+        """responses are only returned once whole"""
+        responses = coprocess.Responses(coprocess.GIT_CAT_FILE)
+        self.assertEqual(responses.feed(b'abc blob 5\nhel'), [])
+        obj = responses.feed(b'lo\nx missing\n')[0]
+        self.assertEqual((obj.oid, obj.type, obj.content), ('abc', 'blob', b'hello'))
+
+    def test_missing(self):
+        """missing objects are errors"""
+        responses = coprocess.Responses(coprocess.GIT_CAT_FILE).feed(b'x missing\n')
+        self.assertEqual(len(responses), 1)
+        self.assertIsInstance(responses[0], KeyError)
+
+    def test_delimited(self):
+        """delimited responses are split on the delimiter"""
+        responses = coprocess.Responses(coprocess.NUL)
+        self.assertEqual(responses.feed(b'a\0b'), [b'a'])
+        self.assertEqual(responses.feed(b'\0'), [b'b'])
+
+class CoprocessTest(unittest.TestCase):
+
+    """Tests for Shell.coprocess"""
+
+    def setUp(self):
+        """create a shell"""
+        self.shell = shell.Shell(grace_periods=(0.5, 0.5))
+
+    def _upper(self, *args, **kwargs):
+        """a coprocess upper-casing its requests"""
+        ret = self.shell.coprocess([sys.executable, '-c', UPPER] + list(args), **kwargs)
+        self.addCleanup(ret.close)
+        return ret
+
+    def test_lines(self):
+        """requests and responses are lines"""
+        upper = self._upper()
+        self.assertEqual(upper.request('hello'), b'HELLO')
+        self.assertEqual(upper.request(b'goodbye'), b'GOODBYE')
+        self.assertEqual(self.shell.tree_stats().processes, 1)
+
+    def test_pipelined(self):
+        """many requests can be in flight at once"""
+        upper = self._upper()
+        requests = ['request-{}'.format(index) * 100 for index in range(2000)]
+        self.assertEqual(upper.map(requests), [request.upper().encode('ascii')
+                                               for request in requests])
+
+    def test_nul(self):
+        """requests and responses can end with NUL"""
+        upper = self._upper('nul', framing=coprocess.NUL)
+        self.assertEqual(upper.map(['a\nb', 'c']), [b'A\nB', b'C'])
+
+    def test_threads(self):
+        """requests can be made from several threads"""
+        upper = self._upper()
+        results = {}
+        def _ask(index):
+            results[index] = upper.request('thread-{}'.format(index))
+        threads = [threading.Thread(target=_ask, args=(index,)) for index in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, dict((index, 'THREAD-{}'.format(index).encode('ascii'))
+                                       for index in range(20)))
+
+    def test_restart(self):
+        """requests in flight when the process dies fail, and it is started again"""
+        upper = self._upper()
+        dying = upper.submit('die')
+        with self.assertRaises(coprocess.CoprocessDied) as context:
+            dying.result()
+        self.assertEqual(context.exception.returncode, 7)
+        self.assertEqual(upper.request('again'), b'AGAIN')
+        self.assertEqual(upper.restarts, 1)
+        # The process which died is no longer tracked, only the running one
+        self.assertEqual(list(self.shell.reap_all().stages.values()), ['SIGINT'])
+
+    def test_closed(self):
+        """closed coprocesses take no more requests"""
+        upper = self._upper()
+        upper.request('hello')
+        upper.close()
+        self.assertEqual(list(self.shell.reap_all().stages.values()), ['exited'])
+        with self.assertRaises(ValueError):
+            upper.request('hello')
+
+    def test_prepared(self):
+        """prepared commands can be coprocesses"""
+        xctr = executor.Executor(self.shell)
+        with xctr.command([sys.executable, '-c', UPPER]).coprocess() as upper:
+            self.assertEqual(upper.request('hello'), b'HELLO')
+
+    @unittest.skipIf(not hasattr(shutil, 'which') or shutil.which('git') is None,
+                     "git not available")
+    def test_git_cat_file(self):
+        """git cat-file --batch responses are read by their size"""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        subprocess.check_call(['git', 'init', '-q', directory])
+        blob = subprocess.check_output(['git', 'hash-object', '-w', '--stdin'], cwd=directory,
+                                       input=b'line\n' * 10000).decode('ascii').strip()
+        self.shell.chdir(directory)
+        objects = self.shell.coprocess(['git', 'cat-file', '--batch'],
+                                       framing=coprocess.GIT_CAT_FILE)
+        self.addCleanup(objects.close)
+        answers = objects.map([blob])
+        self.assertEqual(len(answers), 1)
+        found = answers[0]
+        self.assertEqual((found.oid, found.type, found.content), (blob, 'blob', b'line\n' * 10000))
+        with self.assertRaises(KeyError):
+            objects.request('0' * 40)
+
+@unittest.skipIf(asyncio is None, "asyncio not available")
+class AsyncCoprocessTest(test_asyncshell.LoopTest):
+
+    """Tests for Shell.acoprocess"""
+
+    def test_pipelined(self):
+        """requests are pipelined from the event loop, and the process restarted"""
+        tracking = shell.Shell()
+        upper = tracking.acoprocess([sys.executable, '-c', UPPER])
+        run = self._run
+        try:
+            self.assertEqual(run(upper.map(['a', 'b', 'c'])), [b'A', b'B', b'C'])
+            dying = run(upper.submit('die'))
+            with self.assertRaises(coprocess.CoprocessDied):
+                run(dying)
+            self.assertEqual(run(upper.request('d')), b'D')
+            # Only the restarted process is still tracked by the calling shell
+            self.assertEqual(tracking.tree_stats().processes, 1)
+        finally:
+            run(upper.close())
+        self.assertEqual(upper.restarts, 1)
+        self.assertEqual(list(tracking.reap_all().stages.values()), ['exited'])
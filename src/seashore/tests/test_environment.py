@@ -0,0 +1,76 @@
+# Copyright (c) Shopkick 2017
+# See LICENSE for details.
+"""Tests for seashore.environment"""
+
+import unittest
+
+from seashore import environment
+
+class EnvironmentTest(unittest.TestCase):
+
+    """Tests for copy-on-write environments"""
+
+    def setUp(self):
+        """create an environment with a few variables"""
+        self.base = dict(HOME='/home/u', PATH='/bin', SHELL='/bin/sh')
+        self.env = environment.Environment(base=self.base)
+
+    def test_lookup(self):
+        """variables are found in the base"""
+        self.assertEqual(self.env['HOME'], '/home/u')
+        self.assertIn('PATH', self.env)
+        self.assertNotIn('EDITOR', self.env)
+
+    def test_copy_on_write(self):
+        """changes to a copy do not touch the original or the base"""
+        other = self.env.copy()
+        other['PATH'] = '/usr/bin'
+        other['EDITOR'] = 'vi'
+        del other['SHELL']
+        self.assertEqual(self.env.flatten(), self.base)
+        self.assertEqual(other.flatten(), dict(HOME='/home/u', PATH='/usr/bin', EDITOR='vi'))
+        self.assertEqual(self.base, dict(HOME='/home/u', PATH='/bin', SHELL='/bin/sh'))
+
+    def test_delete(self):
+        """deleted variables are gone, and can come back"""
+        del self.env['HOME']
+        self.assertNotIn('HOME', self.env)
+        with self.assertRaises(KeyError):
+            self.env['HOME'] # pylint: disable=pointless-statement
+        with self.assertRaises(KeyError):
+            del self.env['HOME']
+        self.env['HOME'] = '/root'
+        self.assertEqual(self.env.flatten()['HOME'], '/root')
+
+    def test_delete_added(self):
+        """deleting a variable that was only added removes it"""
+        self.env['EDITOR'] = 'vi'
+        del self.env['EDITOR']
+        self.assertEqual(self.env.flatten(), self.base)
+
+    def test_flatten_cached(self):
+        """the flat dictionary is reused until something changes"""
+        self.env['EDITOR'] = 'vi'
+        flat = self.env.flatten()
+        self.assertIs(self.env.flatten(), flat)
+        self.assertIs(self.env.copy().flatten(), flat)
+        self.env['EDITOR'] = 'emacs'
+        self.assertIsNot(self.env.flatten(), flat)
+        self.assertEqual(flat['EDITOR'], 'vi')
+
+    def test_copy_shares_base(self):
+        """copies share the base, however long the chain"""
+        env = self.env
+        for i in range(10):
+            env = env.copy()
+            env['VAR{}'.format(i)] = str(i)
+        self.assertIs(env.base, self.base)
+        self.assertEqual(env.changes, 10)
+
+    def test_compact(self):
+        """copies fold a large set of changes into a new base"""
+        for i in range(environment.MAX_DELTA + 1):
+            self.env['VAR{}'.format(i)] = str(i)
+        copied = self.env.copy()
+        self.assertEqual(copied.changes, 0)
+        self.assertEqual(copied.flatten(), self.env.flatten())
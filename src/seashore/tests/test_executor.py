@@ -13,11 +13,12 @@
 """Test seashore.executor"""
 
 import os
+import sys
 import unittest
 
 import attr
 
-from seashore import executor
+from seashore import executor, machines, shell
 
 @attr.s
 class DummyShell(object):
@@ -161,6 +162,21 @@ class ExecutorTest(unittest.TestCase):
                                                terminal=executor.NO_VALUE).batch()
         self.assertEquals(output, 'hello\r\n')
 
+    def test_in_docker_machine_cached(self):
+        """cached docker machine environments do not run docker-machine"""
+        environments = machines.MachineEnvironments()
+        environments.get('confluent', lambda: dict(DOCKER_TLS_VERIFY='1',
+                                                   DOCKER_HOST='tcp://192.168.99.103:2376',
+                                                   DOCKER_CERT_PATH='/Users/u/.docker/machine/'
+                                                                    'machines/confluent',
+                                                   DOCKER_MACHINE_NAME='confluent'))
+        new_executor = executor.Executor(self.shell, machine_environments=environments)
+        new_executor = new_executor.in_docker_machine('confluent')
+        output, _err = new_executor.docker.run('a-machine:a-tag', remove=executor.NO_VALUE,
+                                               interactive=executor.NO_VALUE,
+                                               terminal=executor.NO_VALUE).batch()
+        self.assertEqual(output, 'hello\r\n')
+
     def test_in_virtualenv(self):
         """calling in_virtualenv returns an executor that runs pip in a virtual env"""
         new_executor = self.executor.in_virtualenv('/appenv')
@@ -248,3 +264,51 @@ class ExecutorTest(unittest.TestCase):
         """using a trailing _ protects keywords"""
         output, _err = self.executor.docker.exec_('3433', 'echo', 'yay').batch()
         self.assertEquals(output, 'yay\r\n')
+
+    def test_template(self):
+        """templates compute the options once, and append positional arguments"""
+        template = self.executor.template('git', 'show', no_patch=None,
+                                          format=executor.Eq('%ct'))
+        self.assertEqual(template.argv('HEAD')[-1], 'HEAD')
+        self.assertEqual(template.argv(), template.argv())
+        output, _err = template().batch()
+        self.assertEqual(output, '1496798292')
+
+    def test_template_environment(self):
+        """templates run commands in the executor's shell"""
+        template = self.executor.in_virtualenv('/appenv').template('pip', 'install')
+        output, _err = template('a-local-package').batch()
+        self.assertEqual(output, 'a-local-package installed')
+
+    def test_bound_cached(self):
+        """commands and subcommands are bound once per executor"""
+        self.assertIs(self.executor.git, self.executor.git)
+        self.assertIs(self.executor.git.rev_parse, self.executor.git.rev_parse)
+        new_executor = self.executor.chdir('foo/bar')
+        self.assertIsNot(new_executor.git, self.executor.git)
+        output, _err = new_executor.git.rev_parse('HEAD').batch()
+        self.assertEqual(output, '777')
+
+    def test_bound_elsewhere(self):
+        """commands can be bound to other classes which prepare them"""
+        class Preparer(object):
+            """prepares commands by returning their arguments"""
+            git = executor.Command('git')
+            @staticmethod
+            def prepare(*args):
+                """return the arguments"""
+                return args
+        self.assertEqual(Preparer().git.rev_parse('HEAD'), ('git', 'rev-parse', 'HEAD'))
+
+    def test_with_timeout(self):
+        """prepared commands time out by default, unless told otherwise"""
+        xctr = executor.Executor(shell.Shell()).with_timeout(0.1)
+        with self.assertRaises(shell.ProcessTimeoutError):
+            xctr.command(['sleep', '100']).batch()
+        script = 'import time;time.sleep(0.5)'
+        xctr.command([sys.executable, '-c', script]).batch(timeout=None)
+
+    def test_private_subcommand(self):
+        """private names are not subcommands"""
+        with self.assertRaises(AttributeError):
+            self.executor.git._private # pylint: disable=pointless-statement,protected-access
@@ -0,0 +1,144 @@
+# Copyright (c) Shopkick 2017
+# See LICENSE for details.
+"""Tests for seashore.fanout"""
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+from seashore import executor, retry, shell
+
+# The asyncio backend needs Python 3.8 (see fanout.map_batch)
+HAS_ASYNC_BACKEND = sys.version_info >= (3, 8)
+
+SLEEP_AND_PRINT = "import sys,time;time.sleep(float(sys.argv[1]));sys.stdout.write(sys.argv[1])"
+
+def _sleeper(seconds):
+    """a command that sleeps, then prints how long it slept"""
+    return [sys.executable, '-c', SLEEP_AND_PRINT, str(seconds)]
+
+class MapBatchTest(unittest.TestCase):
+
+    """Tests for Executor.map_batch"""
+
+    backend = 'thread'
+
+    def setUp(self):
+        """build an executor with a real shell"""
+        if self.backend == 'async' and not HAS_ASYNC_BACKEND:
+            self.skipTest("async backend not available") # pragma: no cover
+        self.executor = executor.Executor(shell.Shell())
+
+    def test_completion_order(self):
+        """results come back as commands finish"""
+        commands = [_sleeper(0.6), _sleeper(0.0)]
+        results = list(self.executor.map_batch(commands, backend=self.backend))
+        self.assertEqual([result.index for result in results], [1, 0])
+        self.assertEqual(results[0].output, b'0.0')
+
+    def test_submission_order(self):
+        """ordered results come back in the order they were given"""
+        commands = [_sleeper(0.6), _sleeper(0.0)]
+        results = list(self.executor.map_batch(commands, ordered=True, backend=self.backend))
+        self.assertEqual([result.output for result in results], [b'0.6', b'0.0'])
+
+    def test_concurrency(self):
+        """commands run at the same time, up to the limit"""
+        commands = [_sleeper(0.5) for _ in range(4)]
+        start = time.time()
+        results = list(self.executor.map_batch(commands, concurrency=4, backend=self.backend))
+        self.assertLess(time.time() - start, 1.5)
+        self.assertEqual(len(results), 4)
+
+    def test_prepared(self):
+        """prepared commands are accepted"""
+        commands = [self.executor.command(_sleeper(0))]
+        results = list(self.executor.map_batch(commands, backend=self.backend))
+        self.assertTrue(results[0].succeeded)
+        self.assertEqual(results[0].command, commands[0])
+
+    def test_errors_collected(self):
+        """a failing command does not stop the others"""
+        commands = [[sys.executable, '-c', 'raise SystemExit(3)'], _sleeper(0)]
+        results = list(self.executor.map_batch(commands, ordered=True, backend=self.backend))
+        self.assertFalse(results[0].succeeded)
+        self.assertEqual(results[0].exception.returncode, 3)
+        self.assertTrue(results[1].succeeded)
+
+    def test_missing_executable(self):
+        """a command which cannot start is reported in its result"""
+        commands = [['no-such-binary-seashore'], _sleeper(0), _sleeper(0)]
+        results = list(self.executor.map_batch(commands, concurrency=1, ordered=True,
+                                               backend=self.backend))
+        self.assertEqual(len(results), 3)
+        self.assertIsInstance(results[0].exception, OSError)
+        self.assertTrue(results[1].succeeded and results[2].succeeded)
+
+    def test_fail_fast(self):
+        """fail fast stops after the first failure, and reaps the rest"""
+        commands = [_sleeper(100), [sys.executable, '-c', 'raise SystemExit(3)'],
+                    _sleeper(0)]
+        start = time.time()
+        results = list(self.executor.map_batch(commands, concurrency=2, fail_fast=True,
+                                               backend=self.backend))
+        self.assertLess(time.time() - start, 20)
+        self.assertEqual([result.index for result in results], [1])
+
+    def test_timeout(self):
+        """each command may be given a timeout"""
+        commands = [_sleeper(100), _sleeper(0)]
+        results = list(self.executor.map_batch(commands, ordered=True, timeout=0.5,
+                                               backend=self.backend))
+        self.assertIsInstance(results[0].exception, shell.ProcessTimeoutError)
+        self.assertTrue(results[1].succeeded)
+
+    def test_deadline(self):
+        """commands not started by the deadline are not started at all"""
+        commands = [_sleeper(100), _sleeper(0)]
+        start = time.time()
+        results = list(self.executor.map_batch(commands, concurrency=1, ordered=True,
+                                               deadline=0.5, backend=self.backend))
+        self.assertLess(time.time() - start, 20)
+        self.assertEqual([type(result.exception) for result in results],
+                         [shell.ProcessTimeoutError] * 2)
+        self.assertIsNone(results[1].exception.returncode)
+
+    def test_retry(self):
+        """commands waiting to be retried let others run"""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        script = ("import os,sys;path=sys.argv[1];failed=os.path.exists(path);"
+                  "open(path,'w').close();sys.exit(0 if failed else 3)")
+        policy = retry.RetryPolicy(initial_delay=1, jitter=0)
+        flaky = self.executor.command([sys.executable, '-c', script,
+                                       os.path.join(directory, 'flaky')]).with_retry(policy)
+        results = list(self.executor.map_batch([flaky, _sleeper(0)], concurrency=1,
+                                               backend=self.backend))
+        self.assertEqual([(result.index, result.succeeded) for result in results],
+                         [(1, True), (0, True)])
+
+class AsyncMapBatchTest(MapBatchTest):
+
+    """Tests for Executor.map_batch with the async backend"""
+
+    backend = 'async'
+
+class BackendTest(unittest.TestCase):
+
+    """Tests for backend selection"""
+
+    def test_unknown(self):
+        """unknown backends are rejected"""
+        xctr = executor.Executor(shell.Shell())
+        with self.assertRaises(ValueError):
+            list(xctr.map_batch([], backend='carrier-pigeon'))
+
+    @unittest.skipIf(HAS_ASYNC_BACKEND, "async backend available")
+    def test_async_unavailable(self):
+        """the async backend is rejected where its event loop cannot wait for processes"""
+        xctr = executor.Executor(shell.Shell())
+        with self.assertRaises(ValueError):
+            list(xctr.map_batch([], backend='async'))
@@ -0,0 +1,117 @@
+# Copyright (c) Shopkick 2017
+# See LICENSE for details.
+"""Tests for seashore.forkserver"""
+
+import os
+import signal
+import sys
+import tempfile
+import unittest
+
+from seashore import shell
+
+try:
+    from seashore import forkserver
+except (ImportError, SyntaxError): # pragma: no cover
+    forkserver = None
+
+@unittest.skipIf(forkserver is None or not forkserver.available(), "fork server not available")
+class ForkserverLauncherTest(unittest.TestCase):
+
+    """Tests for running a Shell with a ForkserverLauncher"""
+
+    def setUp(self):
+        """create a new shell object with a fork server launcher"""
+        self.records = []
+        self.launcher = forkserver.ForkserverLauncher()
+        self.addCleanup(self.launcher.close)
+        self.shell = shell.Shell(launcher=self.launcher, hooks=[self.records.append])
+
+    def test_batch(self):
+        """batch mode works, and goes through the fork server"""
+        python_script = "import sys;sys.stdout.write('hello');sys.stderr.write('goodbye')"
+        out, err = self.shell.batch([sys.executable, '-c', python_script])
+        self.assertEqual((out, err), (b'hello', b'goodbye'))
+        self.assertEqual(self.launcher.counts['forkserver'], 1)
+
+    def test_failed_batch(self):
+        """the return code of processes is reported by the helper"""
+        with self.assertRaises(shell.ProcessError) as context:
+            self.shell.batch([sys.executable, '-c', 'raise SystemExit(3)'])
+        self.assertEqual(context.exception.returncode, 3)
+
+    def test_missing(self):
+        """missing commands raise an OSError, like Popen"""
+        self.shell.setenv('PATH', '/nonexistent')
+        with self.assertRaises(OSError):
+            self.shell.batch(['no-such-command-seashore'])
+
+    def test_cwd(self):
+        """a different working directory does not need to fall back"""
+        self.shell.chdir('/')
+        out, _err = self.shell.batch([sys.executable, '-c',
+                                      'import os,sys;sys.stdout.write(os.getcwd())'])
+        self.assertEqual(out, b'/')
+        self.assertEqual(self.launcher.counts['forkserver'], 1)
+
+    def test_redirect(self):
+        """standard streams are passed to the helper, even when they are the same file"""
+        python_script = "import os;os.write(1, b'out');os.write(2, b'err')"
+        with tempfile.TemporaryFile() as output:
+            self.shell.redirect([sys.executable, '-c', python_script], output, output)
+            output.seek(0)
+            self.assertEqual(output.read(), b'outerr')
+        self.assertEqual(self.launcher.counts['forkserver'], 1)
+
+    def test_interactive(self):
+        """interactive mode works"""
+        self.shell.interactive([sys.executable, '-c', ''])
+        self.assertEqual(self.launcher.counts['forkserver'], 1)
+
+    def test_records(self):
+        """the helper reports resource usage"""
+        self.shell.batch([sys.executable, '-c', ''])
+        self.assertEqual(len(self.records), 1)
+        record = self.records[0]
+        self.assertEqual(record.returncode, 0)
+        self.assertGreater(record.max_rss, 0)
+
+    def test_reaper(self):
+        """processes can be reaped, and get SIGINT back"""
+        proc = self.shell.popen([sys.executable, '-c', 'import time;time.sleep(100000)'])
+        self.assertEqual(proc.launched_by, 'forkserver')
+        self.assertIsNone(proc.poll())
+        self.shell.reap_all()
+        self.assertLess(proc.wait(), 0)
+
+    def test_isolate(self):
+        """processes can be started in their own session"""
+        isolated = shell.Shell(launcher=self.launcher, isolate='session')
+        proc = isolated.popen([sys.executable, '-c', 'import time;time.sleep(100000)'])
+        self.assertEqual(os.getsid(proc.pid), proc.pid)
+        isolated.reap_all()
+
+    def test_restart(self):
+        """a helper which died is started again"""
+        self.shell.batch([sys.executable, '-c', ''])
+        helper = self.launcher.helper_process
+        helper.kill()
+        helper.wait()
+        out, _err = self.shell.batch([sys.executable, '-c', 'print(1)'])
+        self.assertEqual(out.strip(), b'1')
+        self.assertEqual(self.launcher.counts['forkserver'], 2)
+
+    def test_lost(self):
+        """processes outliving their helper have a distinct return code"""
+        proc = self.shell.popen([sys.executable, '-c', 'import time;time.sleep(100000)'])
+        helper = self.launcher.helper_process
+        helper.kill()
+        helper.wait()
+        os.kill(proc.pid, signal.SIGKILL)
+        self.assertEqual(proc.wait(), forkserver.LOST_RETURNCODE)
+
+    def test_fallback_options(self):
+        """unsupported options fall back to Popen"""
+        proc = self.shell.popen([sys.executable, '-c', ''], close_fds=False)
+        proc.wait()
+        self.assertEqual(proc.launched_by, 'popen')
@@ -0,0 +1,114 @@
+# Copyright (c) Shopkick 2017
+# See LICENSE for details.
+"""Tests for seashore.installplan"""
+
+import threading
+import unittest
+
+import attr
+
+from seashore import executor, installplan, shell
+
+@attr.s
+class InstallShell(object):
+
+    """Shell pretending to install packages, failing for packages named 'broken'"""
+
+    calls = attr.ib(default=attr.Factory(list))
+
+    _env = attr.ib(default=attr.Factory(dict))
+
+    _cwd = attr.ib(default='/')
+
+    _lock = attr.ib(default=attr.Factory(threading.Lock))
+
+    def clone(self):
+        """Return a copy of the shell, sharing the calls"""
+        return attr.evolve(self, env=dict(self._env))
+
+    def setenv(self, key, value):
+        """Set an environment variable"""
+        self._env[key] = value
+
+    def getenv(self, key):
+        """Get an environment variable"""
+        return self._env[key]
+
+    def getcwd(self):
+        """Get the working directory"""
+        return self._cwd
+
+    def batch(self, command, **_kwargs):
+        """(Pretend to) install packages"""
+        with self._lock:
+            self.calls.append(command)
+        if 'broken' in command:
+            raise shell.ProcessError(1, '', 'broken is broken')
+        return ' '.join(command), ''
+
+class InstallPlannerTest(unittest.TestCase):
+
+    """Tests for InstallPlanner"""
+
+    def setUp(self):
+        """create an executor with a planner, on a pretend shell"""
+        self.shell = InstallShell()
+        self.planner = installplan.InstallPlanner()
+        self.executor = executor.Executor(self.shell).with_install_planner(self.planner)
+
+    def test_merged(self):
+        """requests for the same environment are installed together"""
+        with self.planner:
+            first = self.executor.pip_install_later(['attrs', 'six'])
+            second = self.executor.pip_install_later(['six', 'requests'])
+            self.assertEqual(self.shell.calls, [])
+        self.assertEqual(self.shell.calls, [['pip', 'install', 'attrs', 'six', 'requests']])
+        self.assertEqual(first.result(), second.result())
+
+    def test_keys(self):
+        """requests for different environments or indexes are installed apart"""
+        with self.planner:
+            self.executor.pip_install_later(['attrs'])
+            self.executor.pip_install_later(['six'], index_url='http://orbifold.xyz')
+            self.executor.in_virtualenv('/appenv').pip_install_later(['requests'])
+            self.executor.conda_install_later(['numpy'])
+        self.assertEqual(len(self.shell.calls), 4)
+
+    def test_failure(self):
+        """a failed merged install is retried per request, to blame the right one"""
+        with self.planner:
+            good = self.executor.pip_install_later(['attrs'])
+            bad = self.executor.pip_install_later(['broken'])
+        self.assertEqual(len(self.shell.calls), 3)
+        self.assertEqual(good.result()[0], 'pip install attrs')
+        with self.assertRaises(shell.ProcessError):
+            bad.result()
+
+    def test_result_flushes(self):
+        """asking for a result installs what is pending, without a window"""
+        pending = self.executor.pip_install_later(['attrs'])
+        output, _error = self.executor.pip_install(['six'])
+        self.assertEqual(output, 'pip install attrs six')
+        self.assertTrue(pending.done())
+
+    def test_window(self):
+        """with a window, installs from different threads are merged"""
+        planner = installplan.InstallPlanner(window=0.5)
+        xctr = executor.Executor(self.shell).with_install_planner(planner)
+        outputs = []
+        def _install(pkg_id):
+            outputs.append(xctr.conda_install([pkg_id]))
+        threads = [threading.Thread(target=_install, args=(pkg_id,))
+                   for pkg_id in ('numpy', 'scipy')]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(self.shell.calls), 1)
+        self.assertEqual(set(self.shell.calls[0][-2:]), set(['numpy', 'scipy']))
+        self.assertEqual(len(outputs), 2)
+
+    def test_no_planner(self):
+        """requesting installs for later needs a planner"""
+        with self.assertRaises(ValueError):
+            executor.Executor(self.shell).pip_install_later(['attrs'])
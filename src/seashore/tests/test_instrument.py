@@ -0,0 +1,125 @@
+# Copyright (c) Shopkick 2017
+# See LICENSE for details.
+"""Tests for seashore.instrument"""
+
+import logging
+import os
+import sys
+import unittest
+
+from seashore import instrument, launch, shell
+
+ALLOCATE = "import sys;data = b'x' * (64 * 1024 * 1024);sys.stdout.write('hello')"
+
+class InstrumentTest(unittest.TestCase):
+
+    """Tests for process records"""
+
+    def setUp(self):
+        """create a shell which keeps records"""
+        self.records = []
+        self.shell = shell.Shell(hooks=[self.records.append])
+
+    def _only_record(self):
+        """the record of the only process run"""
+        self.assertEqual(len(self.records), 1)
+        return self.records[0]
+
+    def test_batch(self):
+        """batch mode records timings, resource usage and output sizes"""
+        self.shell.batch([sys.executable, '-c', ALLOCATE])
+        record = self._only_record()
+        self.assertEqual(record.argv, [sys.executable, '-c', ALLOCATE])
+        self.assertEqual(record.cwd, os.getcwd())
+        self.assertEqual(record.returncode, 0)
+        self.assertEqual((record.stdout_bytes, record.stderr_bytes), (5, 0))
+        self.assertGreaterEqual(record.wall_time, record.spawn_latency)
+        if hasattr(os, 'wait4'):
+            self.assertGreater(record.user_time + record.system_time, 0)
+            self.assertGreater(record.max_rss, 64 * 1024)
+
+    def test_failure(self):
+        """errors carry the record"""
+        with self.assertRaises(shell.ProcessError) as context:
+            self.shell.batch([sys.executable, '-c', 'import sys;sys.exit(3)'])
+        self.assertEqual(context.exception.record, self.records[0])
+        self.assertEqual(context.exception.record.returncode, 3)
+        with self.assertRaises(shell.ProcessError) as context:
+            self.shell.interactive([sys.executable, '-c', 'import sys;sys.exit(4)'])
+        self.assertEqual(context.exception.record.returncode, 4)
+
+    def test_interactive_redirect(self):
+        """output not read by us is not counted"""
+        self.shell.interactive([sys.executable, '-c', ''])
+        with open(os.devnull, 'w') as devnull:
+            self.shell.redirect([sys.executable, '-c', 'print(1)'], devnull, devnull)
+        self.assertEqual([(record.returncode, record.stdout_bytes) for record in self.records],
+                         [(0, None), (0, None)])
+
+    def test_stream(self):
+        """streaming counts the output read"""
+        script = "import sys;sys.stdout.write('a\\nb\\n');sys.stderr.write('oops')"
+        self.assertEqual(list(self.shell.stream([sys.executable, '-c', script])),
+                         [b'a\n', b'b\n'])
+        record = self._only_record()
+        self.assertEqual((record.stdout_bytes, record.stderr_bytes), (4, 4))
+
+    def test_clone_hooks(self):
+        """clones share hooks, including ones added later"""
+        clone = self.shell.clone()
+        other = []
+        self.shell.add_hook(other.append)
+        clone.batch([sys.executable, '-c', ''])
+        self.assertEqual(len(self.records), 1)
+        self.assertEqual(other, self.records)
+
+    @unittest.skipUnless(hasattr(os, 'posix_spawn'), "posix_spawn not available")
+    def test_spawned(self):
+        """processes from other launchers give their own resource usage"""
+        new_shell = shell.Shell(launcher=launch.SpawnLauncher(), hooks=[self.records.append])
+        new_shell.batch([sys.executable, '-c', ALLOCATE])
+        record = self._only_record()
+        self.assertGreater(record.max_rss, 64 * 1024)
+
+    def test_process_error_keywords(self):
+        """unknown keyword arguments are rejected"""
+        with self.assertRaises(TypeError):
+            shell.ProcessError(1, recrod=None)
+
+def _record(argv, wall_time, returncode=0, **kwargs):
+    """make a record"""
+    return instrument.ProcessRecord(argv=argv, cwd='/', returncode=returncode,
+                                    wall_time=wall_time, spawn_latency=0.001, **kwargs)
+
+class HookTest(unittest.TestCase):
+
+    """Tests for the bundled hooks"""
+
+    def test_histogram(self):
+        """records are aggregated per program, in wall time buckets"""
+        histogram = instrument.Histogram(buckets=[1, 10])
+        histogram(_record(['/usr/bin/git', 'status'], 0.5, user_time=0.25, system_time=0.25,
+                          max_rss=100))
+        histogram(_record(['git', 'fetch'], 5, returncode=1, max_rss=50))
+        histogram(_record(['pip', 'install'], 20))
+        summary = histogram.summary()
+        self.assertEqual(list(summary), ['pip', 'git'])
+        self.assertEqual(summary['git'], dict(counts=[1, 1, 0], calls=2, failures=1,
+                                              wall_time=5.5, cpu_time=0.5, max_rss=100))
+        self.assertEqual(summary['pip']['counts'], [0, 0, 1])
+
+    def test_logging(self):
+        """records can be logged"""
+        messages = []
+        class Handler(logging.Handler):
+            """keep messages"""
+            def emit(self, record):
+                """keep the message"""
+                messages.append(record.getMessage())
+        logger = logging.getLogger('seashore.tests.instrument')
+        logger.addHandler(Handler())
+        logger.setLevel(logging.INFO)
+        sink = instrument.LoggingSink(logger=logger, level=logging.INFO)
+        sink(_record(['git', 'status'], 0.5))
+        self.assertEqual(len(messages), 1)
+        self.assertTrue(messages[0].startswith('git status exited 0 after 0.500s'))
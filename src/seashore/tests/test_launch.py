@@ -0,0 +1,97 @@
+# Copyright (c) Shopkick 2017
+# See LICENSE for details.
+"""Tests for seashore.launch"""
+
+import os
+import sys
+import tempfile
+import unittest
+
+from seashore import launch, shell
+
+@unittest.skipUnless(hasattr(os, 'posix_spawn'), "posix_spawn not available")
+class SpawnLauncherTest(unittest.TestCase):
+
+    """Tests for running a Shell with a SpawnLauncher"""
+
+    def setUp(self):
+        """create a new shell object with a posix_spawn launcher"""
+        self.launcher = launch.SpawnLauncher()
+        self.shell = shell.Shell(launcher=self.launcher)
+
+    def test_batch(self):
+        """batch mode works, and goes through posix_spawn"""
+        python_script = "import sys;sys.stdout.write('hello');sys.stderr.write('goodbye')"
+        out, err = self.shell.batch([sys.executable, '-c', python_script])
+        self.assertEqual((out, err), (b'hello', b'goodbye'))
+        self.assertEqual(self.launcher.counts['posix_spawn'], 1)
+
+    def test_failed_batch(self):
+        """the return code of spawned processes is reported"""
+        with self.assertRaises(shell.ProcessError) as context:
+            self.shell.batch([sys.executable, '-c', 'raise SystemExit(3)'])
+        self.assertEqual(context.exception.returncode, 3)
+
+    def test_path(self):
+        """commands are found on the shell's PATH, not ours"""
+        directory = os.path.dirname(os.path.abspath(sys.executable))
+        self.shell.setenv('PATH', directory)
+        out, _err = self.shell.batch([os.path.basename(sys.executable), '-c',
+                                      'import sys;sys.stdout.write("found")'])
+        self.assertEqual(out, b'found')
+
+    def test_missing(self):
+        """missing commands raise an OSError, like Popen"""
+        self.shell.setenv('PATH', '/nonexistent')
+        with self.assertRaises(OSError):
+            self.shell.batch(['no-such-command-seashore'])
+
+    def test_redirect(self):
+        """redirect to files works through posix_spawn"""
+        python_script = "import sys;sys.stdout.write('hello');sys.stderr.write('goodbye')"
+        with tempfile.TemporaryFile() as stdout, tempfile.TemporaryFile() as stderr:
+            self.shell.redirect([sys.executable, '-c', python_script], stdout, stderr)
+            stdout.seek(0)
+            stderr.seek(0)
+            self.assertEqual((stdout.read(), stderr.read()), (b'hello', b'goodbye'))
+        self.assertEqual(self.launcher.counts['posix_spawn'], 1)
+
+    def test_stream_interleave(self):
+        """standard error can be sent to standard output"""
+        python_script = "import sys;sys.stderr.write('err')"
+        lines = list(self.shell.stream([sys.executable, '-c', python_script],
+                                       stderr='interleave'))
+        self.assertEqual(lines, [b'err'])
+
+    def test_reaper(self):
+        """spawned processes can be reaped"""
+        proc = self.shell.popen([sys.executable, '-c', 'import time;time.sleep(100000)'])
+        self.assertEqual(proc.launched_by, 'posix_spawn')
+        self.assertIsNone(proc.poll())
+        self.shell.reap_all()
+        self.assertLess(proc.wait(), 0)
+
+    def test_fallback_cwd(self):
+        """a different working directory falls back to Popen"""
+        self.shell.chdir('/')
+        out, _err = self.shell.batch([sys.executable, '-c',
+                                      'import os,sys;sys.stdout.write(os.getcwd())'])
+        self.assertEqual(out, b'/')
+        self.assertEqual(self.launcher.counts['popen'], 1)
+        self.assertEqual(self.launcher.counts['posix_spawn'], 0)
+
+    def test_fallback_options(self):
+        """unsupported options fall back to Popen"""
+        proc = self.shell.popen([sys.executable, '-c', ''], close_fds=False)
+        proc.wait()
+        self.assertEqual(proc.launched_by, 'popen')
+
+class PopenLauncherTest(unittest.TestCase):
+
+    """Tests for the default launcher"""
+
+    def test_default(self):
+        """shells use Popen by default"""
+        proc = shell.Shell().popen([sys.executable, '-c', ''])
+        proc.wait()
+        self.assertEqual(proc.launched_by, 'popen')
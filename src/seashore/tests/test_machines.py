@@ -0,0 +1,141 @@
+# Copyright (c) Shopkick 2017
+# See LICENSE for details.
+"""Tests for seashore.machines"""
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from seashore import machines
+
+class Loader(object):
+
+    """Count calls, and return a fixed environment"""
+
+    def __init__(self, env=None):
+        """set up the environment to return"""
+        self.env = env or dict(DOCKER_HOST='tcp://192.168.99.100:2376')
+        self.calls = 0
+
+    def __call__(self):
+        """return the environment"""
+        self.calls += 1
+        return self.env
+
+class MachineEnvironmentsTest(unittest.TestCase):
+
+    """Tests for the Docker machine environment cache"""
+
+    def setUp(self):
+        """create a cache with a fake clock"""
+        self.now = 1000.0
+        self.cache = machines.MachineEnvironments(ttl=60, clock=lambda: self.now)
+
+    def test_cached(self):
+        """a second lookup uses the cache"""
+        loader = Loader()
+        self.assertEqual(self.cache.get('default', loader), loader.env)
+        self.assertEqual(self.cache.get('default', loader), loader.env)
+        self.assertEqual(loader.calls, 1)
+
+    def test_copy(self):
+        """modifying a returned environment does not modify the cache"""
+        loader = Loader()
+        self.cache.get('default', loader)['DOCKER_HOST'] = 'nowhere'
+        self.assertEqual(self.cache.get('default', loader), loader.env)
+
+    def test_ttl(self):
+        """expired environments are looked up again"""
+        loader = Loader()
+        self.cache.get('default', loader)
+        self.now += 61
+        self.cache.get('default', loader)
+        self.assertEqual(loader.calls, 2)
+
+    def test_invalidate(self):
+        """invalidated machines are looked up again"""
+        loader, other_loader = Loader(), Loader()
+        self.cache.get('default', loader)
+        self.cache.get('other', other_loader)
+        self.cache.invalidate('default')
+        self.cache.get('default', loader)
+        self.cache.get('other', other_loader)
+        self.assertEqual((loader.calls, other_loader.calls), (2, 1))
+        self.cache.invalidate()
+        self.cache.get('other', other_loader)
+        self.assertEqual(other_loader.calls, 2)
+
+    def test_error(self):
+        """errors are not cached"""
+        def failing():
+            """fail to look up the machine"""
+            raise ValueError('no such machine')
+        with self.assertRaises(ValueError):
+            self.cache.get('default', failing)
+        loader = Loader()
+        self.cache.get('default', loader)
+        self.assertEqual(loader.calls, 1)
+
+    def test_in_flight(self):
+        """concurrent lookups of a machine share one load"""
+        started, release = threading.Event(), threading.Event()
+        loader = Loader()
+        def slow():
+            """block until released"""
+            started.set()
+            release.wait()
+            return loader()
+        results = []
+        first = threading.Thread(target=lambda: results.append(self.cache.get('default', slow)))
+        first.start()
+        started.wait()
+        second = threading.Thread(target=lambda: results.append(self.cache.get('default', slow)))
+        second.start()
+        release.set()
+        first.join()
+        second.join()
+        self.assertEqual(results, [loader.env, loader.env])
+        self.assertEqual(loader.calls, 1)
+
+    def test_file(self):
+        """environments can be shared through a file"""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'machines.json')
+        loader = Loader()
+        machines.MachineEnvironments(path=path).get('default', loader)
+        other = machines.MachineEnvironments(path=path)
+        self.assertEqual(other.get('default', loader), loader.env)
+        self.assertEqual(loader.calls, 1)
+        other.invalidate('default')
+        machines.MachineEnvironments(path=path).get('default', loader)
+        self.assertEqual(loader.calls, 2)
+        other.invalidate()
+        self.assertFalse(os.path.exists(path))
+
+    def test_file_ttl(self):
+        """entries in the file expire by the time of day they were written at"""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'machines.json')
+        loader = Loader()
+        machines.MachineEnvironments(ttl=60, path=path,
+                                     wall_clock=lambda: self.now).get('default', loader)
+        self.now += 61
+        machines.MachineEnvironments(ttl=60, path=path,
+                                     wall_clock=lambda: self.now).get('default', loader)
+        self.assertEqual(loader.calls, 2)
+
+    def test_unwritable_file(self):
+        """failing to write the file does not fail the lookup, nor the ones waiting on it"""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'missing', 'machines.json')
+        cache = machines.MachineEnvironments(path=path)
+        loader = Loader()
+        self.assertEqual(cache.get('default', loader), loader.env)
+        self.assertEqual(cache.get('default', loader), loader.env)
+        self.assertEqual(loader.calls, 1)
+        self.assertFalse(os.path.exists(path))
@@ -0,0 +1,77 @@
+# Copyright (c) Shopkick 2017
+# See LICENSE for details.
+"""Tests for seashore.parsers"""
+
+import sys
+import unittest
+
+from seashore import executor, parsers, shell
+
+class ParsersTest(unittest.TestCase):
+
+    """Tests for the parsers, on chunks split in awkward places"""
+
+    def test_split(self):
+        """records are split on the separator, wherever the chunks end"""
+        parse = parsers.split(b'--')
+        self.assertEqual(list(parse([b'a-', b'-b--', b'', b'c-', b'-', b'd'])),
+                         [b'a', b'b', b'c', b'd'])
+        self.assertEqual(list(parse([b'a--'])), [b'a'])
+        with self.assertRaises(ValueError):
+            parsers.split(b'')
+
+    def test_nul_records(self):
+        """records are split on NUL"""
+        self.assertEqual(list(parsers.nul_records([b' M a\0?? b', b'\0'])),
+                         [b' M a', b'?? b'])
+
+    def test_lines(self):
+        """lines are split and decoded"""
+        self.assertEqual(list(parsers.lines()([b'caf\xc3', b'\xa9\r\nb'])), [u'caf\xe9', u'b'])
+        self.assertEqual(list(parsers.lines(encoding=None)([b'a\nb\n'])), [b'a', b'b'])
+
+    def test_json_lines(self):
+        """each line is a document, and blank lines are skipped"""
+        self.assertEqual(list(parsers.json_lines([b'{"a": ', b'1}\n\n[2]\n'])),
+                         [dict(a=1), [2]])
+
+class ParseTest(unittest.TestCase):
+
+    """Tests for Shell.parse"""
+
+    def setUp(self):
+        """create a new shell object"""
+        self.shell = shell.Shell()
+
+    def test_parse(self):
+        """the output is parsed"""
+        script = "import sys;sys.stdout.write('{\"a\": 1}\\n{\"b\": 2}\\n')"
+        self.assertEqual(self.shell.parse([sys.executable, '-c', script], parsers.json_lines),
+                         [dict(a=1), dict(b=2)])
+
+    def test_custom(self):
+        """any callable returning an iterable is a parser"""
+        parser = lambda chunks: [len(b''.join(chunks))]
+        script = "import sys;sys.stdout.write('x' * 1000000)"
+        self.assertEqual(self.shell.parse([sys.executable, '-c', script], parser), [1000000])
+
+    def test_failure(self):
+        """failing processes raise, with the end of their standard error"""
+        script = "import sys;sys.stdout.write('a\\n');sys.stderr.write('oops');sys.exit(2)"
+        with self.assertRaises(shell.ProcessError) as context:
+            self.shell.parse([sys.executable, '-c', script], parsers.lines())
+        self.assertEqual((context.exception.returncode, context.exception.error), (2, b'oops'))
+
+    def test_parser_error(self):
+        """parser errors kill the process"""
+        script = "import sys,time;sys.stdout.write('nope\\n');sys.stdout.flush();time.sleep(100)"
+        with self.assertRaises(ValueError):
+            self.shell.parse([sys.executable, '-c', script], parsers.json_lines)
+        self.assertEqual(self.shell.reap_all().stages, {})
+
+    def test_prepared(self):
+        """prepared commands can be parsed"""
+        xctr = executor.Executor(self.shell)
+        script = "import sys;sys.stdout.write('a\\0b\\0')"
+        prepared = xctr.command([sys.executable, '-c', script])
+        self.assertEqual(prepared.parse(parsers.nul_records), [b'a', b'b'])
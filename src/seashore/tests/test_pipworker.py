@@ -0,0 +1,145 @@
+# Copyright (c) Shopkick 2017
+# See LICENSE for details.
+"""Tests for seashore.pipworker"""
+
+import os
+import shutil
+import signal
+import sys
+import tempfile
+import unittest
+
+from seashore import executor, pipworker, retry, shell
+
+try:
+    import pip # pylint: disable=unused-import
+except ImportError: # pragma: no cover
+    HAS_PIP = False
+else:
+    HAS_PIP = True
+
+@unittest.skipUnless(HAS_PIP, "pip not available")
+class PipWorkerPoolTest(unittest.TestCase):
+
+    """Tests for running pip in warm workers"""
+
+    def setUp(self):
+        """create a pool, and a shell whose python is ours"""
+        self.pool = pipworker.PipWorkerPool(python=sys.executable)
+        self.addCleanup(self.pool.close)
+        self.shell = shell.Shell()
+
+    def test_batch(self):
+        """pip runs in the worker, and its output comes back"""
+        out, _err = self.pool.batch(self.shell, ['pip', '--version'])
+        self.assertTrue(out.startswith(b'pip '))
+
+    def test_reuse(self):
+        """the same worker runs several commands"""
+        self.pool.batch(self.shell, ['pip', '--version'])
+        pids = self.pool.pids()
+        self.pool.batch(self.shell, ['pip', '--version'])
+        self.assertEqual(self.pool.pids(), pids)
+        self.assertEqual(len(pids), 1)
+
+    def test_environment(self):
+        """commands see the shell's environment, and don't leak it into the next one"""
+        self.shell.setenv('PIP_NO_COLOR', '1')
+        self.shell.setenv('SEASHORE_SPECIAL', 'lucy')
+        self.pool.batch(self.shell, ['pip', '--version'])
+        other = self.shell.clone()
+        other.setenv('SEASHORE_SPECIAL', None)
+        self.pool.batch(other, ['pip', '--version'])
+
+    def test_failure(self):
+        """failing pip commands raise ProcessError"""
+        with self.assertRaises(shell.ProcessError) as context:
+            self.pool.batch(self.shell, ['pip', 'install'])
+        self.assertNotEqual(context.exception.returncode, 0)
+
+    def test_dead_worker(self):
+        """a dead worker is unavailable, and replaced on the next command"""
+        self.pool.batch(self.shell, ['pip', '--version'])
+        pid, = self.pool.pids()
+        os.kill(pid, signal.SIGKILL)
+        with self.assertRaises(pipworker.WorkerUnavailable):
+            self.pool.batch(self.shell, ['pip', '--version'])
+        out, _err = self.pool.batch(self.shell, ['pip', '--version'])
+        self.assertTrue(out.startswith(b'pip '))
+
+    def test_reaped(self):
+        """workers are stopped by reaping the shell which started them"""
+        self.pool.batch(self.shell, ['pip', '--version'])
+        self.assertEqual(len(self.shell.reap_all().stages), 1)
+        with self.assertRaises(pipworker.WorkerUnavailable):
+            self.pool.batch(self.shell, ['pip', '--version'])
+
+    def test_fresh_metadata(self):
+        """distributions installed between commands are seen by the next one"""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.shell.setenv('PYTHONPATH', directory)
+        with self.assertRaises(shell.ProcessError):
+            self.pool.batch(self.shell, ['pip', 'show', 'seashore-fresh'])
+        dist_info = os.path.join(directory, 'seashore_fresh-1.0.dist-info')
+        os.mkdir(dist_info)
+        with open(os.path.join(dist_info, 'METADATA'), 'w') as metadata:
+            metadata.write('Metadata-Version: 2.1\nName: seashore-fresh\nVersion: 1.0\n')
+        out, _err = self.pool.batch(self.shell, ['pip', 'show', 'seashore-fresh'])
+        self.assertIn(b'Version: 1.0', out)
+
+    def test_touches_pip(self):
+        """commands which change pip itself are recognized"""
+        self.assertTrue(pipworker.touches_pip(['pip', 'install', '-U', 'pip']))
+        self.assertTrue(pipworker.touches_pip(['pip', 'install', 'pip>=9']))
+        self.assertFalse(pipworker.touches_pip(['pip', 'install', 'pipenv']))
+
+@unittest.skipUnless(HAS_PIP, "pip not available")
+class ExecutorPipWorkerTest(unittest.TestCase):
+
+    """Tests for Executor.with_pip_workers"""
+
+    def test_fallback(self):
+        """when workers can't start, pip runs as a subprocess"""
+        pool = pipworker.PipWorkerPool(python=os.devnull)
+        xctr = executor.Executor(shell.Shell()).with_pip_workers(pool)
+        xctr = xctr.patch_env(PATH=os.path.dirname(sys.executable) + os.pathsep +
+                              os.environ.get('PATH', ''))
+        with self.assertRaises(shell.ProcessError):
+            xctr.pip_install([])
+
+class FailingPool(object):
+
+    """A pool in which pip always fails"""
+
+    def __init__(self):
+        """count calls"""
+        self.calls = 0
+
+    def batch(self, _shell, _command):
+        """fail, as pip would"""
+        self.calls += 1
+        raise shell.ProcessError(1, b'', b'Connection refused')
+
+class ExecutorPipWorkerPolicyTest(unittest.TestCase):
+
+    """Tests for the executor's policies on installs in pip workers"""
+
+    def setUp(self):
+        """create an executor with a failing pool"""
+        self.pool = FailingPool()
+        self.executor = executor.Executor(shell.Shell()).with_pip_workers(self.pool)
+
+    def test_retry(self):
+        """installs in a worker are retried"""
+        xctr = self.executor.with_retry(retry.RetryPolicy(max_attempts=2, initial_delay=0))
+        with self.assertRaises(shell.ProcessError):
+            xctr.pip_install(['attrs'])
+        self.assertEqual(self.pool.calls, 2)
+
+    def test_timeout(self):
+        """installs with a timeout run as a subprocess, which can be stopped"""
+        xctr = self.executor.with_timeout(60).patch_env(PATH='/nonexistent')
+        with self.assertRaises(OSError):
+            xctr.pip_install(['attrs'])
+        self.assertEqual(self.pool.calls, 0)
@@ -0,0 +1,109 @@
+# Copyright (c) Shopkick 2017
+# See LICENSE for details.
+"""Tests for seashore.plan"""
+
+import sys
+import threading
+import time
+import unittest
+
+from seashore import executor, plan, shell
+
+def _sleeper(seconds, log=None, name=None):
+    """a step sleeping for a while, noting when it ran"""
+    def _run():
+        if log is not None:
+            log.append(name)
+        time.sleep(seconds)
+        return name
+    return _run
+
+class PlanTest(unittest.TestCase):
+
+    """Tests for Plan"""
+
+    def test_order(self):
+        """steps run after the steps they depend on"""
+        log = []
+        steps = plan.Plan()
+        fetch = steps.add('fetch', _sleeper(0, log, 'fetch'))
+        build = steps.add('build', _sleeper(0, log, 'build'), after=[fetch])
+        steps.add('test', _sleeper(0, log, 'test'), after=[build])
+        report = steps.run()
+        self.assertTrue(report.succeeded)
+        self.assertEqual(log, ['fetch', 'build', 'test'])
+        self.assertEqual(report.results['build'].value, 'build')
+
+    def test_parallel(self):
+        """independent steps run at once, so the time is that of the longest chain"""
+        steps = plan.Plan(concurrency=4)
+        first = steps.add('first', _sleeper(0.2))
+        for name in ('a', 'b', 'c'):
+            steps.add(name, _sleeper(0.2), after=[first])
+        steps.add('slow', _sleeper(0.5))
+        report = steps.run()
+        self.assertLess(report.elapsed, 0.8)
+        self.assertEqual(report.critical_path, ['slow'])
+
+    def test_critical_path(self):
+        """the critical path follows the step each one waited for last"""
+        steps = plan.Plan()
+        quick = steps.add('quick', _sleeper(0))
+        slow = steps.add('slow', _sleeper(0.2))
+        steps.add('end', _sleeper(0.05), after=[quick, slow])
+        self.assertEqual(steps.run().critical_path, ['slow', 'end'])
+
+    def test_concurrency(self):
+        """no more steps run at once than allowed"""
+        lock = threading.Lock()
+        running = []
+        peak = []
+        def _step():
+            with lock:
+                running.append(None)
+                peak.append(len(running))
+            time.sleep(0.05)
+            with lock:
+                running.pop()
+        steps = plan.Plan(concurrency=2)
+        for index in range(6):
+            steps.add(index, _step)
+        steps.run()
+        self.assertEqual(max(peak), 2)
+
+    def test_failure(self):
+        """failures skip dependents only"""
+        def _fail():
+            raise shell.ProcessError(1, b'', b'')
+        steps = plan.Plan()
+        broken = steps.add('broken', _fail)
+        fine = steps.add('fine', _sleeper(0))
+        after_broken = steps.add('after-broken', _sleeper(0), after=[broken])
+        steps.add('further', _sleeper(0), after=[after_broken, fine])
+        steps.add('after-fine', _sleeper(0), after=[fine])
+        report = steps.run()
+        self.assertFalse(report.succeeded)
+        self.assertEqual([result.name for result in report.failed()], ['broken'])
+        self.assertEqual([(result.name, result.skipped_after) for result in report.skipped()],
+                         [('after-broken', 'broken'), ('further', 'broken')])
+        self.assertTrue(report.results['after-fine'].succeeded)
+        with self.assertRaises(shell.ProcessError):
+            report.raise_for_failure()
+
+    def test_unknown(self):
+        """steps can only run after steps already added"""
+        steps = plan.Plan()
+        with self.assertRaises(ValueError):
+            steps.add('build', _sleeper(0), after=['fetch'])
+        steps.add('fetch', _sleeper(0))
+        with self.assertRaises(ValueError):
+            steps.add('fetch', _sleeper(0))
+
+    def test_executor(self):
+        """executors make plans whose steps can be commands"""
+        steps = executor.Executor(shell.Shell()).plan()
+        hello = steps.add('hello', [sys.executable, '-c', 'print("hello")'])
+        steps.add('fail', [sys.executable, '-c', 'raise SystemExit(2)'], after=[hello])
+        report = steps.run()
+        self.assertEqual(report.results['hello'].value, (b'hello\n', b''))
+        self.assertEqual(report.results['fail'].exception.returncode, 2)
@@ -0,0 +1,79 @@
+# Copyright (c) Shopkick 2017
+# See LICENSE for details.
+"""Tests for seashore.reap"""
+
+import os
+import sys
+import time
+import unittest
+
+from seashore import shell
+
+IGNORE_SIGINT = ("import signal,sys,time;signal.signal(signal.SIGINT, signal.SIG_IGN);"
+                 "sys.stdout.write('ready');sys.stdout.flush();time.sleep(100000)")
+
+IGNORE_SIGINT_SIGTERM = ("import signal,sys,time;signal.signal(signal.SIGINT, signal.SIG_IGN);"
+                         "signal.signal(signal.SIGTERM, signal.SIG_IGN);"
+                         "sys.stdout.write('ready');sys.stdout.flush();time.sleep(100000)")
+
+class ReapTest(unittest.TestCase):
+
+    """Tests for Shell.reap_all"""
+
+    def setUp(self):
+        """create a shell with short grace periods"""
+        self.shell = shell.Shell(grace_periods=(0.5, 0.5))
+
+    def _start(self, script):
+        """start a process, and wait until it is ready"""
+        proc = self.shell.popen([sys.executable, '-c', script],
+                                stdout=shell.subprocess.PIPE)
+        self.assertEqual(proc.stdout.read(5), b'ready')
+        proc.stdout.close()
+        return proc
+
+    def test_stages(self):
+        """each process is reported at the stage where it exited"""
+        done = self.shell.popen([sys.executable, '-c', ''])
+        done.wait()
+        gentle = self._start("import sys,time;sys.stdout.write('ready');sys.stdout.flush();"
+                             "time.sleep(100000)")
+        stubborn = self._start(IGNORE_SIGINT)
+        mule = self._start(IGNORE_SIGINT_SIGTERM)
+        report = self.shell.reap_all()
+        self.assertEqual(report.pids('exited'), [done.pid])
+        self.assertEqual(report.pids('SIGINT'), [gentle.pid])
+        self.assertEqual(report.pids('SIGTERM'), [stubborn.pid])
+        self.assertEqual(report.pids('SIGKILL'), [mule.pid])
+        # Python before 3.8 exits with 1 on an unhandled KeyboardInterrupt
+        self.assertNotEqual(gentle.wait(), 0)
+        for proc in (stubborn, mule):
+            self.assertLess(proc.wait(), 0)
+
+    def test_concurrent(self):
+        """processes are waited on together, not one after another"""
+        procs = [self._start(IGNORE_SIGINT) for _ in range(10)]
+        start = time.time()
+        report = self.shell.reap_all()
+        self.assertLess(time.time() - start, 3)
+        self.assertEqual(report.pids('SIGTERM'), sorted(proc.pid for proc in procs))
+
+    def test_quick_exit(self):
+        """processes that exit promptly do not wait for the grace period"""
+        slow_shell = shell.Shell(grace_periods=(30, 30))
+        slow_shell.popen([sys.executable, '-c', 'import time;time.sleep(100000)'])
+        start = time.time()
+        slow_shell.reap_all()
+        self.assertLess(time.time() - start, 10)
+
+    @unittest.skipUnless(hasattr(os, 'waitid'), "processes are reaped when polled")
+    def test_killed_record(self):
+        """processes which had to be killed still get a record with their resource usage"""
+        records = []
+        self.shell.add_hook(records.append)
+        with self.assertRaises(shell.ProcessTimeoutError):
+            self.shell.batch([sys.executable, '-c', IGNORE_SIGINT_SIGTERM], timeout=0.5)
+        self.assertEqual(len(records), 1)
+        record = records[0]
+        self.assertLess(record.returncode, 0)
+        self.assertIsNotNone(record.user_time)
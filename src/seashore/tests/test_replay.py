@@ -0,0 +1,109 @@
+# Copyright (c) Shopkick 2017
+# See LICENSE for details.
+"""Tests for seashore.replay"""
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+from seashore import executor, replay, shell
+
+class ReplayTest(unittest.TestCase):
+
+    """Tests for recording runs, and playing them back"""
+
+    def setUp(self):
+        """record a few runs to a cassette file"""
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.path = os.path.join(self.directory, 'cassette.jsonl')
+        self.cassette = replay.Cassette(env_keys=['SEASHORE_TEST'])
+        self.recording = replay.RecordingShell(shell.Shell(), self.cassette)
+        self.recording.chdir(self.directory)
+        self.recording.setenv('SEASHORE_TEST', 'recorded')
+        self.xctr = executor.Executor(self.recording)
+
+    def _replay(self, strict=True):
+        """save the cassette, and replay it from the file"""
+        self.cassette.save(self.path)
+        cassette = replay.Cassette.load(self.path)
+        replaying = replay.ReplayShell(cassette, strict=strict, cwd=self.directory,
+                                       env=dict(SEASHORE_TEST='recorded'))
+        return executor.Executor(replaying)
+
+    def test_batch(self):
+        """batch output is played back, with no process"""
+        recorded = self.xctr.command([sys.executable, '-c', 'print("hello")']).batch()
+        xctr = self._replay()
+        self.assertEqual(xctr.command([sys.executable, '-c', 'print("hello")']).batch(),
+                         recorded)
+        with self.assertRaises(replay.NoRecording):
+            xctr.command([sys.executable, '-c', 'print("hello")']).batch()
+
+    def test_binary(self):
+        """output which is not text survives the cassette file"""
+        script = 'import os;os.write(1, bytearray(range(256)))'
+        recorded, _err = self.recording.batch([sys.executable, '-c', script])
+        out, _err = self._replay().command([sys.executable, '-c', script]).batch()
+        self.assertEqual(out, recorded)
+        self.assertEqual(len(out), 256)
+
+    def test_failure(self):
+        """failures are played back as the same errors"""
+        script = 'import sys;sys.stderr.write("oops");sys.exit(3)'
+        with self.assertRaises(shell.ProcessError):
+            self.recording.batch([sys.executable, '-c', script])
+        with self.assertRaises(shell.ProcessError):
+            self.recording.interactive([sys.executable, '-c', 'raise SystemExit(4)'])
+        xctr = self._replay()
+        with self.assertRaises(shell.ProcessError) as context:
+            xctr.command([sys.executable, '-c', script]).batch()
+        self.assertEqual((context.exception.returncode, context.exception.error),
+                         (3, b'oops'))
+        with self.assertRaises(shell.ProcessError) as context:
+            xctr.command([sys.executable, '-c', 'raise SystemExit(4)']).interactive()
+        self.assertEqual(context.exception.returncode, 4)
+
+    def test_strict(self):
+        """strict replay needs the same directory and environment"""
+        self.recording.batch([sys.executable, '-c', ''])
+        xctr = self._replay()
+        with self.assertRaises(replay.NoRecording):
+            xctr.chdir('/').command([sys.executable, '-c', '']).batch()
+        with self.assertRaises(replay.NoRecording):
+            xctr.patch_env(SEASHORE_TEST='changed').command([sys.executable, '-c', '']).batch()
+
+    def test_lenient(self):
+        """lenient replay matches arguments alone, and serves runs again"""
+        self.recording.batch(['echo', 'hello'])
+        xctr = self._replay(strict=False).chdir('/')
+        for _ in range(2):
+            self.assertEqual(xctr.command(['echo', 'hello']).batch(), (b'hello\n', b''))
+
+    def test_order(self):
+        """runs of the same command are played back in the order recorded"""
+        counter = os.path.join(self.directory, 'counter')
+        script = ("import os,sys;path=sys.argv[1];"
+                  "count=len(open(path).read()) if os.path.exists(path) else 0;"
+                  "open(path,'a').write('x');print(count)")
+        for _ in range(2):
+            self.recording.batch([sys.executable, '-c', script, counter])
+        xctr = self._replay()
+        outputs = [xctr.command([sys.executable, '-c', script, counter]).batch()[0]
+                   for _ in range(2)]
+        self.assertEqual(outputs, [b'0\n', b'1\n'])
+
+    def test_popen(self):
+        """replay shells do not start processes"""
+        replaying = replay.ReplayShell(replay.Cassette())
+        with self.assertRaises(replay.NoRecording):
+            replaying.popen(['true'])
+
+    def test_not_a_cassette(self):
+        """files which are not cassettes are refused"""
+        with open(self.path, 'w') as cassette_file:
+            cassette_file.write('{}\n')
+        with self.assertRaises(ValueError):
+            replay.Cassette.load(self.path)
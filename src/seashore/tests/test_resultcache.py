@@ -0,0 +1,152 @@
+# Copyright (c) Shopkick 2017
+# See LICENSE for details.
+"""Tests for seashore.resultcache"""
+
+import sys
+import unittest
+
+from seashore import capture, executor, resultcache, shell
+
+PRINT_ARG = "import sys;sys.stdout.write(sys.argv[1])"
+
+class ResultCacheTest(unittest.TestCase):
+
+    """Tests for ResultCache"""
+
+    def setUp(self):
+        """create a shell which counts processes, and a cache with a fake clock"""
+        self.records = []
+        self.shell = shell.Shell(hooks=[self.records.append])
+        self.now = 1000.0
+        self.cache = resultcache.ResultCache(max_entries=2, max_bytes=10, ttl=60,
+                                             clock=lambda: self.now)
+
+    def _batch(self, arg, **kwargs):
+        """run a cached command printing its argument"""
+        return self.cache.batch(self.shell, [sys.executable, '-c', PRINT_ARG, arg], **kwargs)
+
+    def test_hit(self):
+        """the second run is a hit"""
+        self.assertEqual(self._batch('a'), (b'a', b''))
+        self.assertEqual(self._batch('a'), (b'a', b''))
+        self.assertEqual(len(self.records), 1)
+        self.assertEqual(self.cache.stats(), dict(hits=1, misses=1, evictions=0,
+                                                  entries=1, bytes=1))
+
+    def test_key(self):
+        """the working directory and environment are part of the key"""
+        self._batch('a')
+        self._batch('a', cwd='/')
+        self.shell.setenv('SEASHORE_TEST', 'value')
+        self._batch('a')
+        self.assertEqual(len(self.records), 3)
+
+    def test_env_keys(self):
+        """only the listed environment variables can be part of the key"""
+        self._batch('a', env_keys=['HOME'])
+        self.shell.setenv('SEASHORE_TEST', 'value')
+        self._batch('a', env_keys=['HOME'])
+        self.assertEqual(len(self.records), 1)
+
+    def test_invalidation(self):
+        """a change in the invalidation key invalidates the result"""
+        tokens = [1]
+        self._batch('a', invalidation=lambda: tokens[0])
+        self._batch('a', invalidation=lambda: tokens[0])
+        tokens[0] = 2
+        self._batch('a', invalidation=lambda: tokens[0])
+        self.assertEqual(len(self.records), 2)
+
+    def test_ttl(self):
+        """results expire"""
+        self._batch('a')
+        self.now += 60
+        self._batch('a')
+        self.assertEqual(len(self.records), 2)
+
+    def test_lru(self):
+        """the least recently used results are evicted"""
+        self._batch('a')
+        self._batch('b')
+        self._batch('a')
+        self._batch('c')
+        self.assertEqual(self.cache.evictions, 1)
+        self._batch('a')
+        self.assertEqual(len(self.records), 3)
+        self._batch('b')
+        self.assertEqual(len(self.records), 4)
+
+    def test_size(self):
+        """results are evicted to stay within the size, and huge ones are not kept"""
+        self._batch('aaaaaa')
+        self._batch('bbbbbb')
+        self.assertEqual(self.cache.stats()['entries'], 1)
+        self._batch('x' * 11)
+        self.assertEqual(self.cache.stats()['bytes'], 6)
+
+    def test_failures(self):
+        """failures are not cached"""
+        for _ in range(2):
+            with self.assertRaises(shell.ProcessError):
+                self.cache.batch(self.shell, [sys.executable, '-c', 'import sys;sys.exit(1)'])
+        self.assertEqual(len(self.records), 2)
+
+    def test_output_limits(self):
+        """truncated results are only served to batches truncated the same way"""
+        truncated, _err = self._batch('abcdef', max_output=2, output_policy='truncate')
+        self.assertEqual(truncated.dropped, 4)
+        self.assertEqual(self._batch('abcdef'), (b'abcdef', b''))
+        self.assertEqual(len(self.records), 2)
+        self._batch('abcdef', max_output=2, output_policy='truncate')
+        self.assertEqual(len(self.records), 2)
+
+    def test_spilled(self):
+        """output which spilled to a temporary file is not cached"""
+        for _ in range(2):
+            out, _err = self._batch('abc', max_output=1, output_policy='spill')
+            self.assertIsInstance(out, capture.SpilledOutput)
+            out.close()
+        self.assertEqual(len(self.records), 2)
+
+    def test_clear(self):
+        """cleared results are run again"""
+        self._batch('a')
+        self.cache.clear()
+        self._batch('a')
+        self.assertEqual(len(self.records), 2)
+
+class CachedExecutorTest(unittest.TestCase):
+
+    """Tests for Executor.cached"""
+
+    def setUp(self):
+        """create an executor which counts processes"""
+        self.records = []
+        self.cache = resultcache.ResultCache()
+        self.executor = executor.Executor(shell.Shell(hooks=[self.records.append]))
+
+    def test_executor(self):
+        """prepared commands of a cached executor are cached"""
+        cached = self.executor.cached(self.cache)
+        for _ in range(2):
+            cached.command([sys.executable, '-c', PRINT_ARG, 'a']).batch()
+        self.executor.command([sys.executable, '-c', PRINT_ARG, 'a']).batch()
+        self.assertEqual(len(self.records), 2)
+        self.assertEqual(self.cache.hits, 1)
+
+    def test_prepared(self):
+        """a prepared command can be cached"""
+        command = self.executor.command([sys.executable, '-c', PRINT_ARG, 'a'])
+        cached = command.cached(self.cache, env_keys=[])
+        self.assertEqual(cached.batch(), (b'a', b''))
+        self.assertEqual(cached.batch(), (b'a', b''))
+        self.assertEqual(len(self.records), 1)
+
+    def test_default(self):
+        """the default cache is the process-wide one"""
+        hits = resultcache.RESULTS.hits
+        cached = self.executor.command([sys.executable, '-c', PRINT_ARG, 'default']).cached()
+        self.addCleanup(resultcache.RESULTS.clear)
+        for _ in range(2):
+            cached.batch()
+        self.assertEqual(resultcache.RESULTS.hits, hits + 1)
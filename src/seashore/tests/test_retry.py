@@ -0,0 +1,140 @@
+# Copyright (c) Shopkick 2017
+# See LICENSE for details.
+"""Tests for seashore.retry"""
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+from seashore import executor, retry, shell
+
+try:
+    import asyncio
+except ImportError: # pragma: no cover
+    asyncio = None
+
+FLAKY = ("import os,sys;path=sys.argv[1];"
+         "count=len(open(path).read()) if os.path.exists(path) else 0;"
+         "open(path,'a').write('x');"
+         "sys.stderr.write('Connection reset');"
+         "sys.exit(0 if count + 1 >= int(sys.argv[2]) else 3)")
+
+QUICK = retry.RetryPolicy(initial_delay=0.01, jitter=0)
+
+class _Highest(object):
+
+    """a random number generator always at the top of its range"""
+
+    @staticmethod
+    def random():
+        """the highest random number"""
+        return 1.0
+
+class RetryPolicyTest(unittest.TestCase):
+
+    """Tests for RetryPolicy"""
+
+    def test_returncodes(self):
+        """only the listed return codes are retried"""
+        policy = retry.RetryPolicy(returncodes=[3])
+        self.assertTrue(policy.matches(shell.ProcessError(3, b'', b'')))
+        self.assertFalse(policy.matches(shell.ProcessError(1, b'', b'')))
+
+    def test_stderr(self):
+        """the standard error must match, whether bytes or text"""
+        policy = retry.RetryPolicy(stderr='reset|refused')
+        self.assertTrue(policy.matches(shell.ProcessError(1, b'', b'Connection refused')))
+        self.assertTrue(policy.matches(shell.ProcessError(1, '', 'Connection reset')))
+        self.assertFalse(policy.matches(shell.ProcessError(1, b'', b'No such package')))
+        self.assertFalse(policy.matches(shell.ProcessError(1)))
+
+    def test_timeouts(self):
+        """timeouts are only retried if asked for"""
+        exc = shell.ProcessTimeoutError(-2, b'', b'', timeout=1)
+        self.assertFalse(retry.RetryPolicy().matches(exc))
+        self.assertTrue(retry.RetryPolicy(timeouts=True).matches(exc))
+
+    def test_delay(self):
+        """waits grow exponentially, up to a maximum, minus jitter"""
+        policy = retry.RetryPolicy(initial_delay=1, factor=2, max_delay=5, jitter=0.5,
+                                   random=_Highest())
+        self.assertEqual([policy.delay(attempt) for attempt in range(1, 5)],
+                         [0.5, 1.0, 2.0, 2.5])
+
+    def test_backoff(self):
+        """attempts and the deadline limit retries"""
+        policy = retry.RetryPolicy(max_attempts=3, initial_delay=1, jitter=0, deadline=10)
+        exc = shell.ProcessError(1, b'', b'')
+        self.assertEqual(policy.backoff(1, exc, 0), 1)
+        self.assertIsNone(policy.backoff(3, exc, 0))
+        self.assertIsNone(policy.backoff(1, exc, 9.5))
+
+    def test_attempt_kwargs(self):
+        """attempts are given a timeout so as not to run past the deadline"""
+        policy = retry.RetryPolicy(deadline=10)
+        self.assertEqual(policy.attempt_kwargs(dict(cwd='/'), 4), dict(cwd='/', timeout=6))
+        self.assertEqual(policy.attempt_kwargs(dict(timeout=1), 4), dict(timeout=1))
+        self.assertEqual(retry.RetryPolicy().attempt_kwargs({}, 4), {})
+
+class RetryCommandTest(unittest.TestCase):
+
+    """Tests for retrying prepared commands"""
+
+    def setUp(self):
+        """create an executor, and a directory for attempt counts"""
+        self.records = []
+        self.executor = executor.Executor(shell.Shell(hooks=[self.records.append]))
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def _flaky(self, name, succeed_on):
+        """a command which fails until its given attempt"""
+        return [sys.executable, '-c', FLAKY, os.path.join(self.directory, name),
+                str(succeed_on)]
+
+    def test_retried(self):
+        """failures are retried until the command succeeds"""
+        xctr = self.executor.with_retry(QUICK)
+        _out, err = xctr.command(self._flaky('a', 3)).batch()
+        self.assertEqual(err, b'Connection reset')
+        self.assertEqual(len(self.records), 3)
+
+    def test_exhausted(self):
+        """the last failure is raised"""
+        command = self.executor.command(self._flaky('a', 5)).with_retry(QUICK)
+        with self.assertRaises(shell.ProcessError) as context:
+            command.batch()
+        self.assertEqual(context.exception.returncode, 3)
+        self.assertEqual(len(self.records), 3)
+
+    def test_no_match(self):
+        """failures the policy does not match are not retried"""
+        policy = retry.RetryPolicy(stderr='refused', initial_delay=0.01)
+        command = self.executor.command(self._flaky('a', 2)).with_retry(policy)
+        with self.assertRaises(shell.ProcessError):
+            command.batch()
+        self.assertEqual(len(self.records), 1)
+
+    def test_interactive(self):
+        """interactive commands are retried on return codes"""
+        command = self.executor.command(self._flaky('a', 2)).with_retry(QUICK)
+        command.interactive()
+        self.assertEqual(len(self.records), 2)
+
+    @unittest.skipIf(asyncio is None, "asyncio not available")
+    def test_abatch(self):
+        """asynchronous batches are retried too"""
+        command = self.executor.command(self._flaky('a', 2)).with_retry(QUICK)
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        if sys.version_info < (3, 8):
+            # Until 3.8, only the loop the child watcher is attached to can wait for processes
+            asyncio.get_child_watcher().attach_loop(loop)
+        try:
+            loop.run_until_complete(command.abatch())
+        finally:
+            asyncio.set_event_loop(None)
+            loop.close()
+        self.assertEqual(len(self.records), 2)
@@ -2,8 +2,13 @@
 # See LICENSE for details.
 """Tests for seashore.shell"""
 
+import io
+import os
+import shutil
+import signal
 import sys
 import tempfile
+import time
 import unittest
 import traceback
 
@@ -52,6 +57,71 @@ class ShellTest(unittest.TestCase):
         self.assertEquals(out, b'hello')
         self.assertEquals(err, b'goodbye')
 
+    def test_batch_large(self):
+        """batch mode reads both streams without deadlocking on full pipes"""
+        python_script = ("import sys;sys.stderr.write('e' * 1000000);"
+                         "sys.stdout.write('o' * 1000000)")
+        out, err = self.shell.batch([sys.executable, '-c', python_script])
+        self.assertEqual(out, b'o' * 1000000)
+        self.assertEqual(err, b'e' * 1000000)
+
+    def test_batch_spill(self):
+        """batch mode output spilled to temporary files is returned unchanged"""
+        python_script = "import sys;sys.stdout.write('hello');sys.stderr.write('goodbye')"
+        out, err = self.shell.batch([sys.executable, '-c', python_script], spill_threshold=0)
+        self.assertEqual(out, b'hello')
+        self.assertEqual(err, b'goodbye')
+
+    def test_failed_batch_output(self):
+        """failed batch mode processes report their output in the exception"""
+        python_script = "import sys;sys.stdout.write('hello');sys.exit(3)"
+        with self.assertRaises(shell.ProcessError) as context:
+            self.shell.batch([sys.executable, '-c', python_script])
+        self.assertEqual(context.exception.returncode, 3)
+        self.assertEqual(context.exception.output, b'hello')
+
+    def test_stream_lines(self):
+        """stream mode yields lines as they are produced"""
+        python_script = "import sys;sys.stdout.write('one\\ntwo\\nthree')"
+        lines = list(self.shell.stream([sys.executable, '-c', python_script]))
+        self.assertEqual(lines, [b'one\n', b'two\n', b'three'])
+
+    def test_stream_chunks(self):
+        """stream mode yields fixed size pieces when asked to"""
+        python_script = "import sys;sys.stdout.write('abcdefghij')"
+        pieces = list(self.shell.stream([sys.executable, '-c', python_script], chunk_size=4))
+        self.assertEqual(pieces, [b'abcd', b'efgh', b'ij'])
+
+    def test_stream_failed(self):
+        """stream mode raises with the end of standard error, once exhausted"""
+        python_script = ("import sys;sys.stdout.write('out\\n');"
+                         "sys.stderr.write('x' * 1000 + 'the end');sys.exit(2)")
+        lines = self.shell.stream([sys.executable, '-c', python_script], tail_size=7)
+        self.assertEqual(next(lines), b'out\n')
+        with self.assertRaises(shell.ProcessError) as context:
+            next(lines)
+        self.assertEqual(context.exception.returncode, 2)
+        self.assertEqual(context.exception.error, b'the end')
+
+    def test_stream_interleave(self):
+        """stream mode can mix standard error into the output"""
+        python_script = ("import sys;sys.stdout.write('out\\n');sys.stdout.flush();"
+                         "sys.stderr.write('err\\n')")
+        lines = list(self.shell.stream([sys.executable, '-c', python_script],
+                                       stderr='interleave'))
+        self.assertEqual(lines, [b'out\n', b'err\n'])
+
+    def test_stream_close(self):
+        """closing a stream early kills the process"""
+        python_script = "import sys\nwhile True: sys.stdout.write('y\\n')"
+        records = []
+        recorded = shell.Shell(hooks=[records.append])
+        lines = recorded.stream([sys.executable, '-c', python_script])
+        self.assertEqual(next(lines), b'y\n')
+        lines.close()
+        self.assertLess(records[0].returncode, 0)
+        self.assertEqual(recorded.reap_all().stages, {})
+
     def test_failed_batch(self):
         """processes exiting with non-zero code causes an exception in batch mode"""
         python_script = b"raise SystemExit(1)"
@@ -95,6 +165,17 @@ class ShellTest(unittest.TestCase):
         out, _ignored = new_shell.batch([sys.executable, '-c', python_script])
         self.assertEquals(out, b'lucy')
 
+    def test_clone_delete(self):
+        """deleting a variable in a clone leaves the original alone"""
+        self.shell.setenv('SPECIAL', 'emett')
+        new_shell = self.shell.clone()
+        new_shell.setenv('SPECIAL', None)
+        python_script = 'import sys,os;sys.stdout.write(os.environ.get("SPECIAL", "gone"))'
+        out, _ignored = new_shell.batch([sys.executable, '-c', python_script])
+        self.assertEqual(out, b'gone')
+        out, _ignored = self.shell.batch([sys.executable, '-c', python_script])
+        self.assertEqual(out, b'emett')
+
     def test_env_none(self):
         """passing env variable as none deletes it"""
         self.shell.setenv('SPECIAL', 'lucy')
@@ -103,6 +184,172 @@ class ShellTest(unittest.TestCase):
         out, _ignored = self.shell.batch([sys.executable, '-c', python_script])
         self.assertEquals(out, b'emett')
 
+UPPER = "import sys;sys.stdout.write(sys.stdin.read().upper())"
+
+FLOOD = "import sys;sys.stdout.write('a' * 1000 + 'b' * 1000);sys.stdout.flush()"
+
+class MaxOutputTest(unittest.TestCase):
+
+    """Tests for Shell.batch's output limits"""
+
+    def setUp(self):
+        """create a new shell object"""
+        self.shell = shell.Shell()
+
+    def test_raise(self):
+        """too much output kills the process"""
+        script = "import sys;sys.stdout.write('a' * 100000);sys.stdout.flush();input()"
+        with self.assertRaises(shell.OutputTooLarge) as context:
+            self.shell.batch([sys.executable, '-c', script], max_output=1000)
+        self.assertIsInstance(context.exception, shell.ProcessError)
+        self.assertEqual((context.exception.stream, context.exception.limit), ('stdout', 1000))
+        self.assertLessEqual(len(context.exception.output), 1000)
+        self.assertNotEqual(context.exception.returncode, 0)
+        self.assertEqual(self.shell.reap_all().stages, {})
+
+    def test_under_limit(self):
+        """output under the limit is returned"""
+        out, _err = self.shell.batch([sys.executable, '-c', FLOOD], max_output=2000)
+        self.assertEqual(len(out), 2000)
+
+    def test_truncate(self):
+        """truncated output keeps the head and tail"""
+        records = []
+        self.shell.add_hook(records.append)
+        out, _err = self.shell.batch([sys.executable, '-c', FLOOD], max_output=10,
+                                     output_policy='truncate')
+        self.assertEqual((out, out.dropped), (b'aaaaabbbbb', 1990))
+        self.assertEqual(records[0].stdout_bytes, 2000)
+
+    def test_spill(self):
+        """spilled output is memory-mapped"""
+        out, err = self.shell.batch([sys.executable, '-c', FLOOD], max_output=10,
+                                    output_policy='spill')
+        with out:
+            self.assertEqual((len(out), out[999:1001], err), (2000, b'ab', b''))
+
+    def test_unknown(self):
+        """unknown policies are rejected"""
+        with self.assertRaises(ValueError):
+            self.shell.batch(['true'], max_output=10, output_policy='ignore')
+
+STUBBORN = ("import signal,sys,time;signal.signal(signal.SIGINT, signal.SIG_IGN);"
+            "sys.stdout.write('started');sys.stdout.flush();time.sleep(100)")
+
+class TimeoutTest(unittest.TestCase):
+
+    """Tests for the timeout of Shell's methods"""
+
+    def setUp(self):
+        """create a new shell object, which escalates quickly"""
+        self.shell = shell.Shell(grace_periods=(0.2, 0.2))
+
+    def test_batch(self):
+        """a batch timing out is stopped, keeping the output read until then"""
+        records = []
+        self.shell.add_hook(records.append)
+        start = time.time()
+        with self.assertRaises(shell.ProcessTimeoutError) as context:
+            self.shell.batch([sys.executable, '-c', STUBBORN], timeout=1)
+        self.assertLess(time.time() - start, 20)
+        self.assertIsInstance(context.exception, shell.ProcessError)
+        self.assertEqual(context.exception.output, b'started')
+        self.assertEqual(context.exception.timeout, 1)
+        self.assertEqual(context.exception.returncode, -signal.SIGTERM)
+        self.assertEqual(records[0].returncode, -signal.SIGTERM)
+        self.assertEqual(self.shell.reap_all().stages, {})
+
+    def test_in_time(self):
+        """a batch finishing in time returns its output"""
+        out, _err = self.shell.batch([sys.executable, '-c', FLOOD], timeout=20)
+        self.assertEqual(len(out), 2000)
+
+    def test_interactive(self):
+        """interactive and redirect time out too"""
+        with self.assertRaises(shell.ProcessTimeoutError):
+            self.shell.interactive(['sleep', '100'], timeout=0.1)
+        with tempfile.TemporaryFile() as outfp:
+            with self.assertRaises(shell.ProcessTimeoutError) as context:
+                self.shell.redirect(['sleep', '100'], outfp, outfp, timeout=0.1)
+        self.assertEqual(context.exception.returncode, -signal.SIGINT)
+        self.assertEqual(self.shell.reap_all().stages, {})
+
+    def test_stream(self):
+        """streams time out even when no line is complete"""
+        script = "import sys,time;sys.stdout.write('partial');sys.stdout.flush();time.sleep(100)"
+        with self.assertRaises(shell.ProcessTimeoutError) as context:
+            list(self.shell.stream([sys.executable, '-c', script], timeout=0.5))
+        self.assertEqual(context.exception.error, b'')
+        self.assertEqual(self.shell.reap_all().stages, {})
+
+class PipelineTest(unittest.TestCase):
+
+    """Tests for Shell.pipeline"""
+
+    def setUp(self):
+        """create a new shell object, and a directory for files"""
+        self.shell = shell.Shell()
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def test_output(self):
+        """the output of each process goes to the next one"""
+        output = self.shell.pipeline([[sys.executable, '-c', 'print("hello")'],
+                                      [sys.executable, '-c', UPPER],
+                                      ['cat']])
+        self.assertEqual(output, b'HELLO\n')
+        self.assertEqual(self.shell.reap_all().stages, {})
+
+    def test_files(self):
+        """paths are opened and passed to the processes"""
+        source = os.path.join(self.directory, 'source')
+        target = os.path.join(self.directory, 'target')
+        with open(source, 'wb') as source_file:
+            source_file.write(b'hello')
+        self.assertIsNone(self.shell.pipeline([['cat'], [sys.executable, '-c', UPPER]],
+                                              stdin=source, stdout=target))
+        with open(target, 'rb') as target_file:
+            self.assertEqual(target_file.read(), b'HELLO')
+
+    def test_relay(self):
+        """file objects without a file descriptor are relayed"""
+        output = io.BytesIO()
+        self.shell.pipeline([['cat'], [sys.executable, '-c', UPPER]],
+                            stdin=io.BytesIO(b'hello'), stdout=output)
+        self.assertEqual(output.getvalue(), b'HELLO')
+
+    def test_stderr(self):
+        """standard error of all processes can go to a file"""
+        with tempfile.TemporaryFile() as errfp:
+            self.shell.pipeline([[sys.executable, '-c', 'import sys;sys.stderr.write("a")'],
+                                 [sys.executable, '-c', 'import sys;sys.stderr.write("b")']],
+                                stderr=errfp)
+            errfp.seek(0)
+            self.assertEqual(sorted(errfp.read()), sorted(b'ab'))
+
+    def test_pipefail(self):
+        """the last failure is reported, with every status"""
+        with self.assertRaises(shell.PipelineError) as context:
+            self.shell.pipeline([[sys.executable, '-c', 'import sys;sys.exit(3)'],
+                                 [sys.executable, '-c', 'import sys;sys.exit(4)'],
+                                 ['cat']])
+        self.assertEqual(context.exception.returncode, 4)
+        self.assertEqual(context.exception.statuses, [3, 4, 0])
+        self.assertEqual(context.exception.record.argv[-1], 'import sys;sys.exit(4)')
+        self.assertIsInstance(context.exception, shell.ProcessError)
+        self.assertIn('[3, 4, 0]', repr(context.exception))
+
+    def test_missing_command(self):
+        """failing to start a process stops the ones already started"""
+        with self.assertRaises(OSError):
+            self.shell.pipeline([['sleep', '100000'], ['/no/such/command']])
+        self.assertEqual(self.shell.reap_all().stages, {})
+
+    def test_empty(self):
+        """an empty pipeline is an error"""
+        with self.assertRaises(ValueError):
+            self.shell.pipeline([])
+
 class ProcessErrorTest(unittest.TestCase):
 
     """Tests that check process error is useful"""
@@ -115,6 +362,10 @@ class ProcessErrorTest(unittest.TestCase):
         """output attribtue is set to passed-in value"""
         self.assertEquals(shell.ProcessError(13, "woo").output, "woo")
 
+    def test_error(self):
+        """error attribute is set to passed-in value"""
+        self.assertEqual(shell.ProcessError(13, "woo", "hoo").error, "hoo")
+
     def test_repr(self):
         """repr contains output, error and code"""
         procerr = shell.ProcessError(13, "myout42", "myerr42")
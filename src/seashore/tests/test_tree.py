@@ -0,0 +1,120 @@
+# Copyright (c) Shopkick 2017
+# See LICENSE for details.
+"""Tests for seashore.tree"""
+
+import os
+import sys
+import time
+import unittest
+
+from seashore import launch, shell, tree
+
+LEAK = ("import os,subprocess,sys;null=open(os.devnull,'w');"
+        "proc=subprocess.Popen(['sleep','100'],stdout=null,stderr=null,preexec_fn={});"
+        "sys.stdout.write(str(proc.pid))")
+
+HOLD = ("import subprocess,sys;"
+        "subprocess.Popen(['sleep','100']);sys.stdout.write('started');sys.stdout.flush()")
+
+def _running(pid):
+    """whether a process is running (zombies do not count)"""
+    return bool(tree.scan([pid]))
+
+def _settle(tracking):
+    """the number of live processes of a shell, once killed ones are gone"""
+    deadline = time.time() + 10
+    while tracking.tree_stats().processes and time.time() < deadline:
+        time.sleep(0.01)
+    return tracking.tree_stats().processes
+
+def _children(cgroup):
+    """the cgroups under a cgroup"""
+    return set(tree.Cgroup(os.path.join(cgroup.path, name)) for name in os.listdir(cgroup.path)
+               if os.path.isdir(os.path.join(cgroup.path, name)))
+
+class IsolateTest(unittest.TestCase):
+
+    """Tests for shells which isolate their processes"""
+
+    def setUp(self):
+        """create an isolating shell with short grace periods"""
+        self.shell = shell.Shell(grace_periods=(0.5, 0.5), isolate='session')
+
+    def test_leftovers(self):
+        """processes left by finished processes are counted, and reaped"""
+        out, _err = self.shell.batch([sys.executable, '-c', LEAK.format(None)])
+        grandchild = int(out)
+        self.assertTrue(_running(grandchild))
+        stats = self.shell.tree_stats()
+        self.assertEqual(stats.processes, 1)
+        self.assertGreater(stats.rss, 0)
+        report = self.shell.reap_all()
+        self.assertEqual(list(report.stages.values()), ['SIGINT'])
+        self.assertFalse(_running(grandchild))
+        self.assertEqual(self.shell.tree_stats().processes, 0)
+
+    def test_timeout(self):
+        """timeouts stop the processes a process started"""
+        start = time.time()
+        with self.assertRaises(shell.ProcessTimeoutError) as context:
+            self.shell.batch([sys.executable, '-c', HOLD], timeout=0.5)
+        self.assertLess(time.time() - start, 20)
+        self.assertEqual(context.exception.output, b'started')
+        self.assertEqual(_settle(self.shell), 0)
+
+    def test_group(self):
+        """processes can be started in a new process group instead"""
+        group_shell = shell.Shell(isolate='group')
+        proc = group_shell.popen(['sleep', '100'])
+        self.assertEqual((os.getpgid(proc.pid), proc.tree.pid), (proc.pid, proc.pid))
+        group_shell.reap_all()
+
+    def test_not_isolated(self):
+        """shells do not isolate processes by default"""
+        plain = shell.Shell()
+        proc = plain.popen(['sleep', '100'])
+        self.assertNotEqual(os.getpgid(proc.pid), proc.pid)
+        self.assertEqual(plain.tree_stats().processes, 1)
+        plain.reap_all()
+        self.assertEqual(plain.tree_stats().processes, 0)
+
+    def test_unknown(self):
+        """unknown isolations are rejected"""
+        with self.assertRaises(ValueError):
+            shell.Shell(isolate='island')
+
+    @unittest.skipUnless(hasattr(os, 'posix_spawn'), "posix_spawn not available")
+    def test_spawn(self):
+        """posix_spawn can start processes in a new session"""
+        spawn_shell = shell.Shell(launcher=launch.SpawnLauncher(), isolate='session')
+        proc = spawn_shell.popen(['sleep', '100'])
+        self.assertEqual((proc.launched_by, os.getsid(proc.pid)), ('posix_spawn', proc.pid))
+        spawn_shell.reap_all()
+
+@unittest.skipIf(tree.writable_cgroup() is None, "no writable cgroup v2")
+class CgroupTest(unittest.TestCase):
+
+    """Tests for shells which put processes in cgroups"""
+
+    def setUp(self):
+        """create a shell using cgroups"""
+        self.cgroup = tree.writable_cgroup()
+        self.shell = shell.Shell(grace_periods=(0.5, 0.5), cgroup=self.cgroup)
+
+    def test_escaped(self):
+        """processes which leave their session are still found"""
+        before = _children(self.cgroup)
+        out, _err = self.shell.batch([sys.executable, '-c', LEAK.format('os.setsid')])
+        grandchild = int(out)
+        leftover, = _children(self.cgroup) - before
+        self.assertEqual(leftover.pids(), [grandchild])
+        self.assertIsNotNone(self.shell.tree_stats().cpu_time)
+        self.shell.reap_all()
+        self.assertFalse(_running(grandchild))
+        self.assertFalse(os.path.exists(leftover.path))
+
+    def test_finished(self):
+        """the cgroup of a process which left nothing is removed"""
+        before = _children(self.cgroup)
+        self.shell.batch(['true'])
+        self.assertEqual(_children(self.cgroup), before)
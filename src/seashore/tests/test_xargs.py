@@ -0,0 +1,90 @@
+# Copyright (c) Shopkick 2017
+# See LICENSE for details.
+"""Tests for seashore.xargs"""
+
+import sys
+import unittest
+
+from seashore import executor, fanout, shell, xargs
+
+COUNT = "import sys;print(len(sys.argv) - 1)"
+
+class ChunksTest(unittest.TestCase):
+
+    """Tests for splitting arguments"""
+
+    def test_fit(self):
+        """chunks are as large as fit in the limit"""
+        base = xargs.size(['cmd'], {})
+        arg_size = xargs.size(['cmd', 'abc'], {}) - base
+        result = list(xargs.chunks(['cmd'], ['abc'] * 10, {}, limit=base + 3 * arg_size))
+        self.assertEqual([len(chunk) for chunk in result], [3, 3, 3, 1])
+
+    def test_environment(self):
+        """the environment takes from the limit"""
+        env = dict(KEY='v' * 100)
+        self.assertGreater(xargs.size(['cmd'], env), xargs.size(['cmd'], {}) + 100)
+        limit = xargs.size(['cmd', 'abc'], env)
+        self.assertEqual(list(xargs.chunks(['cmd'], ['abc', 'def'], env, limit=limit)),
+                         [['abc'], ['def']])
+
+    def test_max_args(self):
+        """chunks can be limited to a number of arguments"""
+        result = list(xargs.chunks(['cmd'], [str(index) for index in range(5)], {},
+                                   max_args=2))
+        self.assertEqual(result, [['0', '1'], ['2', '3'], ['4']])
+
+    def test_too_long(self):
+        """arguments which cannot fit on their own are refused"""
+        with self.assertRaises(ValueError):
+            list(xargs.chunks(['cmd'], ['x' * 100], {}, limit=xargs.size(['cmd'], {}) + 50))
+
+    def test_merge(self):
+        """failures are raised with everything's output"""
+        results = [fanout.BatchResult(index=0, command=None, output=b'a', error=b''),
+                   fanout.BatchResult(index=1, command=None,
+                                      exception=shell.ProcessError(2, b'b', b'oops')),
+                   fanout.BatchResult(index=2, command=None, output=b'c', error=b'')]
+        with self.assertRaises(shell.ProcessError) as context:
+            xargs.merge(results)
+        self.assertEqual((context.exception.returncode, context.exception.output,
+                          context.exception.error), (2, b'abc', b'oops'))
+
+class XargsCommandTest(unittest.TestCase):
+
+    """Tests for running prepared commands in xargs mode"""
+
+    def setUp(self):
+        """create an executor"""
+        self.executor = executor.Executor(shell.Shell())
+
+    def test_over_limit(self):
+        """more arguments than the kernel takes are run in several processes"""
+        args = ['argument-{:08d}'.format(index) for index in range(xargs.arg_max() // 20)]
+        out, _err = self.executor.command([sys.executable, '-c', COUNT]).xargs(args)
+        counts = [int(line) for line in out.split()]
+        self.assertGreater(len(counts), 1)
+        self.assertEqual(sum(counts), len(args))
+
+    def test_concurrency(self):
+        """chunks can run at once, and their output is merged in order"""
+        script = "import sys;print(' '.join(sys.argv[1:]))"
+        command = self.executor.command([sys.executable, '-c', script])
+        out, _err = command.xargs([str(index) for index in range(10)], concurrency=4,
+                                  max_args=3)
+        self.assertEqual(out.split(b'\n')[:-1], [b'0 1 2', b'3 4 5', b'6 7 8', b'9'])
+
+    def test_tuple_command(self):
+        """commands prepared from a tuple take arguments"""
+        script = "import sys;print(' '.join(sys.argv[1:]))"
+        command = self.executor.command((sys.executable, '-c', script))
+        self.assertEqual(command.xargs(('a', 'b')), (b'a b\n', b''))
+
+    def test_missing_executable(self):
+        """a command which cannot start is not mistaken for success"""
+        with self.assertRaises(OSError):
+            self.executor.command(['no-such-binary-seashore']).xargs(['a', 'b'])
+
+    def test_no_arguments(self):
+        """without arguments, nothing is run"""
+        self.assertEqual(self.executor.command(['false']).xargs([]), (b'', b''))
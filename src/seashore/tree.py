@@ -0,0 +1,430 @@
+# Copyright (c) Shopkick 2017
+# See LICENSE for details.
+"""
+Tree
+----
+
+Keeping track of the processes that processes start.
+
+Commands like :code:`docker-machine`, :code:`conda` and pip's build backends
+start processes of their own, which outlive them when they are stopped.
+A shell which isolates its processes starts each one in a new process group
+(or session), and optionally in a transient cgroup v2 leaf, so that signals
+reach every process it started, directly or not.
+
+A cgroup also catches processes which leave their process group, such as
+daemons, but processes started before the child is moved into the cgroup
+(that is, by the time :code:`Shell.popen` returns) are not in it.
+
+:const:`ISOLATIONS` -- how a process can be isolated:
+:code:`'group'` (a new process group) or :code:`'session'` (a new session)
+"""
+import errno
+import itertools
+import os
+import signal
+import sys
+import time
+
+import attr
+
+ISOLATIONS = ('group', 'session')
+
+_MAX_POLL_INTERVAL = 0.05
+
+_NAMES = itertools.count()
+
+def popen_kwargs(isolate):
+    """
+    Arguments isolating a process started by a launcher.
+
+    :param isolate: :code:`'group'`, :code:`'session'` or :code:`None`
+    :returns: dictionary of :code:`subprocess.Popen` keyword arguments
+    """
+    if isolate is None:
+        return {}
+    if isolate not in ISOLATIONS:
+        raise ValueError('unknown isolation', isolate)
+    if isolate == 'group':
+        if sys.version_info >= (3, 11):
+            return dict(process_group=0)
+        return dict(preexec_fn=os.setpgrp) # pragma: no cover
+    if sys.version_info >= (3, 2):
+        return dict(start_new_session=True)
+    return dict(preexec_fn=os.setsid) # pragma: no cover
+
+@attr.s(frozen=True)
+class TreeStats(object):
+
+    """
+    What a set of process trees is using now.
+
+    Fields which could not be measured are :code:`None`.
+
+    :param processes: number of live processes
+    :param cpu_time: seconds of CPU time (in a cgroup, including that of
+                     processes which have exited)
+    :param rss: resident memory, in bytes
+    """
+
+    processes = attr.ib(default=0)
+    cpu_time = attr.ib(default=None)
+    rss = attr.ib(default=None)
+
+def _add(first, second):
+    if first is None:
+        return second
+    if second is None:
+        return first
+    return first + second
+
+def total(stats):
+    """
+    Add up stats.
+
+    :param stats: iterable of :code:`TreeStats`
+    :returns: :code:`TreeStats`
+    """
+    ret = TreeStats()
+    for stat in stats:
+        ret = TreeStats(processes=ret.processes + stat.processes,
+                        cpu_time=_add(ret.cpu_time, stat.cpu_time),
+                        rss=_add(ret.rss, stat.rss))
+    return ret
+
+@attr.s(frozen=True)
+class _ProcStat(object):
+
+    pid = attr.ib()
+    pgrp = attr.ib()
+    cpu_time = attr.ib()
+    rss = attr.ib()
+
+def _proc_stat(pid):
+    with open('/proc/{}/stat'.format(pid), 'rb') as stat_file:
+        data = stat_file.read()
+    # The command name is in parentheses, and may contain anything
+    fields = data[data.rindex(b')') + 2:].split()
+    if fields[0] == b'Z':
+        return None
+    ticks = float(os.sysconf('SC_CLK_TCK'))
+    return _ProcStat(pid=pid, pgrp=int(fields[2]),
+                     cpu_time=(int(fields[11]) + int(fields[12])) / ticks,
+                     rss=int(fields[21]) * os.sysconf('SC_PAGE_SIZE'))
+
+def scan(pids=None):
+    """
+    Read the state of live (that is, not zombie) processes from :code:`/proc`.
+
+    :param pids: process ids to read (default is all processes)
+    :returns: list of process states, or :code:`None` if there is no :code:`/proc`
+    """
+    if pids is None:
+        try:
+            pids = [int(name) for name in os.listdir('/proc') if name.isdigit()]
+        except OSError: # pragma: no cover
+            return None
+    ret = []
+    for pid in pids:
+        try:
+            stat = _proc_stat(pid)
+        except (IOError, OSError):
+            continue # It exited while we were looking
+        if stat is not None:
+            ret.append(stat)
+    return ret
+
+def _read(path):
+    with open(path) as opened:
+        return opened.read()
+
+def _cgroup2_root():
+    with open('/proc/self/mountinfo') as mountinfo:
+        for line in mountinfo:
+            mount, _dash, fstype = line.partition(' - ')
+            if fstype.split()[0] == 'cgroup2':
+                fields = mount.split()
+                return fields[3], fields[4]
+    return None
+
+def writable_cgroup():
+    """
+    Find this process's cgroup v2, if we can create cgroups under it.
+
+    :returns: :code:`Cgroup`, or :code:`None`
+    """
+    try:
+        root = _cgroup2_root()
+        own = [line.split(':', 2)[2].strip() for line in _read('/proc/self/cgroup').splitlines()
+               if line.startswith('0::')]
+    except (IOError, OSError):
+        return None
+    if root is None or not own:
+        return None
+    mount_root, mount_point = root
+    relative = os.path.relpath(own[0], mount_root)
+    if relative.startswith(os.pardir):
+        return None
+    path = os.path.normpath(os.path.join(mount_point, relative))
+    if not os.access(path, os.W_OK) or not os.path.exists(os.path.join(path, 'cgroup.procs')):
+        return None
+    return Cgroup(path)
+
+@attr.s(frozen=True)
+class Cgroup(object):
+
+    """
+    A cgroup v2 directory.
+
+    :param path: the directory
+    """
+
+    path = attr.ib()
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    def child(self, name=None):
+        """
+        Create a cgroup under this one.
+
+        :param name: name of the new cgroup (default is a new unique name)
+        :returns: :code:`Cgroup`
+        :raises: :code:`OSError` if the cgroup cannot be created
+        """
+        if name is None:
+            name = 'seashore-{}-{}'.format(os.getpid(), next(_NAMES))
+        path = self._file(name)
+        os.mkdir(path)
+        return Cgroup(path)
+
+    def add(self, pid):
+        """
+        Move a process into the cgroup.
+
+        :param pid: process id
+        :raises: :code:`OSError` if the process cannot be moved
+        """
+        with open(self._file('cgroup.procs'), 'w') as procs:
+            procs.write(str(pid))
+
+    def pids(self):
+        """
+        Processes in the cgroup.
+
+        :returns: list of process ids
+        """
+        try:
+            return [int(line) for line in _read(self._file('cgroup.procs')).split()]
+        except (IOError, OSError):
+            return []
+
+    def kill(self):
+        """
+        Kill every process in the cgroup.
+
+        Uses :code:`cgroup.kill` where the kernel has it (Linux 5.14+),
+        and signals each process otherwise.
+        """
+        try:
+            with open(self._file('cgroup.kill'), 'w') as kill_file:
+                kill_file.write('1')
+        except (IOError, OSError):
+            for pid in self.pids():
+                _signal(os.kill, pid, signal.SIGKILL)
+
+    def stats(self):
+        """
+        What the processes in the cgroup are using.
+
+        :returns: :code:`TreeStats`
+        """
+        pids = self.pids()
+        cpu_time = rss = None
+        try:
+            for line in _read(self._file('cpu.stat')).splitlines():
+                key, _space, value = line.partition(' ')
+                if key == 'usage_usec':
+                    cpu_time = int(value) / 1000000.0
+        except (IOError, OSError): # pragma: no cover
+            pass
+        try:
+            rss = int(_read(self._file('memory.current')))
+        except (IOError, OSError):
+            states = scan(pids)
+            if states is not None:
+                rss = sum(state.rss for state in states)
+        return TreeStats(processes=len(pids), cpu_time=cpu_time, rss=rss)
+
+    def remove(self):
+        """
+        Remove the cgroup, if it is empty.
+
+        :returns: whether the cgroup was removed
+        """
+        try:
+            os.rmdir(self.path)
+        except OSError as exc:
+            if exc.errno == errno.ENOENT:
+                return True
+            return False
+        return True
+
+def _signal(kill, pid, signum):
+    try:
+        kill(pid, signum)
+    except OSError as exc:
+        if exc.errno not in (errno.ESRCH, errno.EPERM):
+            raise
+
+@attr.s
+class ProcessTree(object):
+
+    """
+    The processes started, directly or not, by one process.
+
+    A tree is tracked by the process group the process leads (if it is
+    :code:`grouped`), and by its cgroup (if it has one).
+    It outlives the process: processes the process started may still be running.
+
+    Supports the parts of the :code:`subprocess.Popen` interface
+    that :code:`reap.reap` uses, so that such leftovers can be stopped
+    like processes; a tree "exits", with return code 0, once it has no
+    live processes.
+
+    :param pid: process id of the process, which is also the process group id
+    :param grouped: whether the process leads a process group
+    :param cgroup: :code:`Cgroup` of the tree, if any
+    """
+
+    pid = attr.ib()
+    grouped = attr.ib(default=True)
+    cgroup = attr.ib(default=None)
+    returncode = attr.ib(init=False, default=None)
+
+    def pids(self):
+        """
+        Live processes in the tree.
+
+        :returns: list of process ids
+        """
+        if self.cgroup is not None:
+            return self.cgroup.pids()
+        if not self.grouped:
+            states = scan([self.pid])
+            if states is None: # pragma: no cover
+                return [self.pid] if _alive(os.kill, self.pid) else []
+            return [state.pid for state in states]
+        if not _alive(os.killpg, self.pid):
+            return []
+        states = scan()
+        if states is None: # pragma: no cover
+            return [self.pid]
+        return [state.pid for state in states if state.pgrp == self.pid]
+
+    def stats(self, states=None):
+        """
+        What the processes in the tree are using.
+
+        :param states: result of :code:`scan()`, to share one scan between trees
+        :returns: :code:`TreeStats`
+        """
+        if self.cgroup is not None:
+            return self.cgroup.stats()
+        if states is None:
+            states = scan() if self.grouped else scan([self.pid])
+        if states is None: # pragma: no cover
+            return TreeStats(processes=len(self.pids()))
+        if self.grouped:
+            members = [state for state in states if state.pgrp == self.pid]
+        else:
+            members = [state for state in states if state.pid == self.pid]
+        return TreeStats(processes=len(members),
+                         cpu_time=sum(state.cpu_time for state in members),
+                         rss=sum(state.rss for state in members))
+
+    def send_signal(self, signum):
+        """
+        Send a signal to every process in the tree.
+
+        :param signum: signal number
+        """
+        if self.cgroup is not None:
+            if signum == signal.SIGKILL:
+                self.cgroup.kill()
+                return
+            for pid in self.cgroup.pids():
+                _signal(os.kill, pid, signum)
+        elif self.grouped:
+            _signal(os.killpg, self.pid, signum)
+        else:
+            _signal(os.kill, self.pid, signum)
+
+    def kill(self):
+        """Send :code:`SIGKILL` to every process in the tree"""
+        self.send_signal(signal.SIGKILL)
+
+    def poll(self):
+        """
+        Check whether the tree still has live processes.
+
+        :returns: 0 if it has none, :code:`None` otherwise
+        """
+        if self.returncode is None and not self.pids():
+            self.returncode = 0
+        return self.returncode
+
+    def wait(self):
+        """
+        Wait for every process in the tree to end.
+
+        :returns: 0
+        """
+        delay = 0.0005
+        while self.poll() is None:
+            time.sleep(delay)
+            delay = min(delay * 2, _MAX_POLL_INTERVAL)
+        return self.returncode
+
+    def close(self):
+        """
+        Remove the tree's cgroup, if it has no processes left.
+
+        :returns: whether there is nothing left to clean up
+        """
+        if self.cgroup is None:
+            return True
+        return self.cgroup.remove()
+
+def _alive(kill, pid):
+    try:
+        kill(pid, 0)
+    except OSError as exc:
+        if exc.errno == errno.ESRCH:
+            return False
+        if exc.errno != errno.EPERM: # pragma: no cover
+            raise
+    return True
+
+def track(pid, grouped, cgroup=None):
+    """
+    Start tracking the tree of a newly started process.
+
+    :param pid: process id
+    :param grouped: whether the process was started in a new process group or session
+    :param cgroup: :code:`Cgroup` under which to make a leaf for the tree, if any;
+                   if the process cannot be moved there, it is tracked without it
+    :returns: :code:`ProcessTree`, or :code:`None` if there is nothing to track it by
+    """
+    leaf = None
+    if cgroup is not None:
+        try:
+            leaf = cgroup.child()
+            leaf.add(pid)
+        except (IOError, OSError):
+            if leaf is not None:
+                leaf.remove()
+            leaf = None
+    if not grouped and leaf is None:
+        return None
+    return ProcessTree(pid=pid, grouped=grouped, cgroup=leaf)
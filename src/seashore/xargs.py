@@ -0,0 +1,130 @@
+# Copyright (c) Shopkick 2017
+# See LICENSE for details.
+"""
+Xargs
+-----
+
+Splitting long argument lists, as :code:`xargs` does.
+
+The kernel limits how much a process can be started with: its arguments
+and environment, each with a terminating NUL byte and a pointer to it,
+must fit in :code:`ARG_MAX` bytes, or starting it fails with :code:`E2BIG`.
+Commands such as :code:`git add` or :code:`docker rmi`, given many
+arguments, are run several times, each with as many of the arguments as fit.
+
+:const:`HEADROOM` -- bytes left unused, as POSIX asks of :code:`xargs`
+"""
+import os
+import struct
+import sys
+
+import six
+
+from seashore.shell import ProcessError, ProcessTimeoutError
+
+HEADROOM = 2048
+
+_POINTER_SIZE = struct.calcsize('P')
+
+# Linux also limits each single argument (MAX_ARG_STRLEN)
+_MAX_ARG_STRLEN = 32 * 4096
+
+def arg_max():
+    """
+    How many bytes of arguments and environment a process can be started with.
+
+    :returns: bytes (:code:`os.sysconf('SC_ARG_MAX')`, where known)
+    """
+    try:
+        return os.sysconf('SC_ARG_MAX')
+    except (AttributeError, ValueError, OSError): # pragma: no cover
+        return 128 * 1024
+
+def _encoded_size(value):
+    if isinstance(value, six.text_type):
+        value = value.encode(sys.getfilesystemencoding() or 'utf-8', 'surrogateescape'
+                             if six.PY3 else 'strict')
+    return len(value) + 1 + _POINTER_SIZE
+
+def size(argv, env):
+    """
+    How many bytes of the limit starting a process takes.
+
+    :param argv: list of arguments
+    :param env: dictionary of environment variables
+    :returns: bytes
+    """
+    ret = sum(_encoded_size(arg) for arg in argv)
+    # Each variable is written as KEY=VALUE, with one pointer to it
+    ret += sum(_encoded_size(key) + _encoded_size(value) - _POINTER_SIZE
+               for key, value in env.items())
+    return ret + 2 * _POINTER_SIZE
+
+def chunks(prefix, args, env, limit=None, max_args=None):
+    """
+    Split arguments into as few chunks as fit after a command.
+
+    :param prefix: the command, as a list of arguments
+    :param args: iterable of arguments to split
+    :param env: dictionary of environment variables the command runs with
+    :param limit: bytes of arguments and environment allowed
+                  (default is :code:`arg_max()` less :code:`HEADROOM`)
+    :param max_args: maximum number of arguments per chunk (default is no limit)
+    :returns: iterator of lists of arguments
+    :raises: :code:`ValueError` if an argument cannot fit, even on its own
+    """
+    if limit is None:
+        limit = arg_max() - HEADROOM
+    base = size(prefix, env)
+    chunk = []
+    used = base
+    for arg in args:
+        arg_size = _encoded_size(arg)
+        if chunk and (used + arg_size > limit or
+                      (max_args is not None and len(chunk) >= max_args)):
+            yield chunk
+            chunk = []
+            used = base
+        if base + arg_size > limit or (sys.platform.startswith('linux') and
+                                       arg_size - _POINTER_SIZE > _MAX_ARG_STRLEN):
+            raise ValueError('argument does not fit', arg[:100], base + arg_size, limit)
+        chunk.append(arg)
+        used += arg_size
+    if chunk:
+        yield chunk
+
+def _joined(parts):
+    parts = [part for part in parts if part is not None]
+    if parts and all(isinstance(part, six.text_type) for part in parts):
+        return u''.join(parts)
+    return b''.join(bytes(part) for part in parts)
+
+def merge(results):
+    """
+    Merge the results of running each chunk.
+
+    :param results: list of :code:`fanout.BatchResult`, in the order of the chunks
+    :returns: pair of all standard output, all standard error
+    :raises: :code:`ProcessError` (or :code:`ProcessTimeoutError`) with the return code
+             of the first chunk which failed, and all output and error;
+             or, if the first chunk which failed did not get to run (such as
+             an :code:`OSError` for a missing executable), what it raised
+    """
+    outputs, errors, failures = [], [], []
+    for result in results:
+        if result.succeeded:
+            outputs.append(result.output)
+            errors.append(result.error)
+            continue
+        outputs.append(getattr(result.exception, 'output', None))
+        errors.append(getattr(result.exception, 'error', None))
+        failures.append(result.exception)
+    output, error = _joined(outputs), _joined(errors)
+    if not failures:
+        return output, error
+    failed = failures[0]
+    if isinstance(failed, ProcessTimeoutError):
+        raise ProcessTimeoutError(failed.returncode, output, error, timeout=failed.timeout)
+    if isinstance(failed, ProcessError):
+        raise ProcessError(failed.returncode, output, error)
+    raise failed